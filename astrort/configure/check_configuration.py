@@ -25,7 +25,7 @@ class CheckConfiguration():
         return self
 
     def check_simulator(self):
-        keys = ['name', 'array', 'irf', 'prod', 'pointing', 'target', 'maxoffset', 'duration', 'samples', 'seed', 'model', 'output', 'replicate']
+        keys = ['name', 'array', 'irf', 'prod', 'pointing', 'target', 'maxoffset', 'duration', 'samples', 'seed', 'model', 'output', 'replicate', 'resume', 'queue', 'batch', 'lease', 'fused', 'keepdl3', 'keepxml', 'plan']
         assert self.conf['simulator'].keys() == keys
         assert type(self.conf['simulator']['name']) == str
         assert type(self.conf['simulator']['array']) in ['lst', 'mst', 'sst', 'cta', 'north', 'south']
@@ -40,6 +40,14 @@ class CheckConfiguration():
         assert type(self.conf['simulator']['model']) == str
         assert type(self.conf['simulator']['output']) == str
         assert type(self.conf['simulator']['replicate']) == (str or None)
+        assert type(self.conf['simulator']['resume']) == bool
+        assert type(self.conf['simulator']['queue']) in [str, type(None)]
+        assert type(self.conf['simulator']['batch']) == int
+        assert type(self.conf['simulator']['lease']) in [int, float]
+        assert type(self.conf['simulator']['fused']) == bool
+        assert 0 <= self.conf['simulator']['keepdl3'] <= 1
+        assert type(self.conf['simulator']['keepxml']) == bool
+        assert type(self.conf['simulator']['plan']) == bool
         return self
 
     def check_visibility(self):
@@ -49,11 +57,14 @@ class CheckConfiguration():
         return self
 
     def check_logging(self):
-        keys = ['level', 'logfile', 'datfile']
+        keys = ['level', 'logfile', 'datfile', 'flush', 'flushtime', 'binary']
         assert self.conf['logging'].keys() == keys
         assert (type(self.conf['logging']['level']) == str or type(self.conf['logging']['level']) == int) 
         assert type(self.conf['logging']['logfile']) == str 
         assert type(self.conf['logging']['datfile']) == str 
+        assert type(self.conf['logging']['flush']) == int
+        assert type(self.conf['logging']['flushtime']) in [int, float]
+        assert type(self.conf['logging']['binary']) == bool
         return self
     
     def check_slurm(self):
@@ -70,15 +81,27 @@ class CheckConfiguration():
         return self
     
     def check_mapper(self):
-        keys = ['exposure', 'smooth', 'pixelsize', 'center', 'plot', 'region', 'output', 'replicate', 'save']
+        keys = ['exposure', 'smooth', 'pixelsize', 'center', 'plot', 'region', 'output', 'replicate', 'save', 'selection', 'energy', 'resume', 'queue', 'batch', 'lease', 'shard', 'compression', 'plotpool', 'sheet', 'thumbscale', 'thumbnorm']
         assert self.conf['mapper'].keys() == keys
-        assert type(self.conf['mapper']['exposure']) == int
+        assert type(self.conf['mapper']['exposure']) in [int, list]
         assert type(self.conf['mapper']['smooth']) == (float or int)
         assert type(self.conf['mapper']['pixelsize']) == (float or int)
         assert type(self.conf['mapper']['center']) in ['pointing', 'source'] 
-        assert type(self.conf['mapper']['plot']) == bool
+        assert self.conf['mapper']['plot'] in [True, False, 'thumbnail']
         assert type(self.conf['mapper']['region']) == bool
         assert type(self.conf['mapper']['output']) == str
         assert type(self.conf['simulator']['replicate']) == (str or None)
         assert type(self.conf['simulator']['save']) == str
+        assert self.conf['mapper']['selection'] in ['box', 'circle', 'tangent']
+        assert type(self.conf['mapper']['energy']) in [int, list, type(None)]
+        assert type(self.conf['mapper']['resume']) == bool
+        assert type(self.conf['mapper']['queue']) in [str, type(None)]
+        assert type(self.conf['mapper']['batch']) == int
+        assert type(self.conf['mapper']['lease']) in [int, float]
+        assert type(self.conf['mapper']['shard']) == int
+        assert self.conf['mapper']['compression'] in [None, 'zlib']
+        assert type(self.conf['mapper']['plotpool']) == int
+        assert type(self.conf['mapper']['sheet']) == int
+        assert type(self.conf['mapper']['thumbscale']) == int
+        assert self.conf['mapper']['thumbnorm'] in ['symlog', 'linear']
         return self
\ No newline at end of file
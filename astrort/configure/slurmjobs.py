@@ -6,10 +6,13 @@
 # Ambra Di Piano <ambra.dipiano@inaf.it>
 # *****************************************************************************
 
+import numpy as np
 from yaml import dump
 from os import system, makedirs
 from os.path import join, dirname, abspath
-from astrort.utils.wrap import load_yaml_conf
+from astrort.utils.wrap import load_yaml_conf, get_simulation_plan
+from astrort.utils.workqueue import open_seed_queue
+from astrort.utils.replica import is_replica_store
 from astrort.configure.logging import set_logger, get_log_level
 
 def make_configuration(jobname_conf, configuration, node_number, mode):
@@ -18,19 +21,22 @@ def make_configuration(jobname_conf, configuration, node_number, mode):
     # logging
     configuration['logging']['logfile'] = join(configuration[mode]['output'], f'job_{node_number+1}_{mode}.log')
     configuration['logging']['datfile'] = join(configuration[mode]['output'], f'job_{node_number+1}_{mode}.dat')
-    if configuration[mode]['replicate'] is not None:
+    # a replica store covers all seeds, each job loads its own range
+    if configuration[mode]['replicate'] is not None and configuration[mode].get('queue') is None and not is_replica_store(configuration[mode]['replicate']):
         configuration[mode]['replicate'] = join(dirname(configuration[mode]['replicate']), f'job_{node_number+1}_simulator.dat')
     # write new configuration
     with open(jobname_conf, 'w+') as f:
         dump(configuration, f, default_flow_style=False)
 
-def make_sh(jobname, slurmconf, jobname_conf, jobname_sh, jobname_log, mode, script=None):
+def make_sh(jobname, slurmconf, jobname_conf, jobname_sh, jobname_log, mode, script=None, mpthreads=0):
     # write sbatch
     with open(jobname_sh, 'w+') as f:
         f.write("#!/bin/bash")
         #f.write("\n#SBATCH --nodes=1")
         #f.write("\n#SBATCH --ntasks-per-node=1")
         #f.write("\n#SBATCH --cpus-per-task=2")
+        if mpthreads > 1:
+            f.write(f"\n#SBATCH --cpus-per-task={mpthreads}")
         f.write(f"\n#SBATCH --job-name={jobname}")
         #f.write(f"\n#SBATCH --mem={slurmconf['memory']}")
         f.write(f"\n#SBATCH --output={jobname_log}")
@@ -39,7 +45,7 @@ def make_sh(jobname, slurmconf, jobname_conf, jobname_sh, jobname_log, mode, scr
         f.write(f"\n")
         f.write(f"\nsource activate {slurmconf['environment']}")
         if mode == 'simulator':
-            f.write(f"\npython {join(dirname(abspath(__file__)).replace('configure', 'simulator'), 'base_simulator.py')} -f {jobname_conf}\n")
+            f.write(f"\npython {join(dirname(abspath(__file__)).replace('configure', 'simulator'), 'base_simulator.py')} -f {jobname_conf} -mp {mpthreads}\n")
         elif mode == 'mapper' and script is None:
             f.write(f"\npython {join(dirname(abspath(__file__)).replace('configure', 'simulator'), 'base_mapper.py')} -f {jobname_conf}\n")
         elif mode == 'mapper' and script is not None:
@@ -47,16 +53,16 @@ def make_sh(jobname, slurmconf, jobname_conf, jobname_sh, jobname_log, mode, scr
         else:
             raise ValueError(f"Invalid 'mode' {mode}")
 
-def make_sbatch(jobname, configuration, node_number, mode, script=None):
+def make_sbatch(jobname, configuration, node_number, mode, script=None, mpthreads=0):
     output = configuration[mode]['output']
     jobname_sh = join(output, f"{jobname}_{mode}.sh")
     jobname_log = join(output, f"{jobname}_{mode}.slurm")
     jobname_conf = join(output, f"{jobname}_{mode}.yml")
     make_configuration(jobname_conf, configuration, node_number, mode=mode)
-    make_sh(jobname, configuration['slurm'], jobname_conf, jobname_sh, jobname_log, mode, script=script)
+    make_sh(jobname, configuration['slurm'], jobname_conf, jobname_sh, jobname_log, mode, script=script, mpthreads=mpthreads)
     system(f"sbatch {jobname_sh}")
 
-def slurm_submission(configuration_file, nodes, mode, script=None):
+def slurm_submission(configuration_file, nodes, mode, script=None, mpthreads=0):
     configuration = load_yaml_conf(configuration_file)
     log = set_logger(get_log_level(configuration['logging']['level']))
     # create output dir
@@ -64,6 +70,14 @@ def slurm_submission(configuration_file, nodes, mode, script=None):
     makedirs(configuration[mode]['output'], exist_ok=True)
     # sbatch jobs per each nodes
     configuration['slurm']['nodes'] = nodes
+    # nodes pull seed batches from the queue instead of owning a block
+    queue = open_seed_queue(configuration, mode, seeds=np.arange(1, nodes*configuration['simulator']['samples'] + 1))
+    if queue is not None:
+        log.info(f"Seed queue {configuration[mode]['queue']}: {queue.status()}")
+        queue.close()
+    # jobs read their seeds from a plan made once for all nodes
+    if mode == 'simulator' and configuration['simulator'].get('plan', False):
+        get_simulation_plan(configuration, np.arange(1, nodes*configuration['simulator']['samples'] + 1), log, subset=False)
     for node_number in range(configuration['slurm']['nodes']):
         jobname = f"{configuration['slurm']['name']}_{node_number+1}"
-        make_sbatch(jobname, configuration, node_number, mode=mode, script=script)
+        make_sbatch(jobname, configuration, node_number, mode=mode, script=script, mpthreads=mpthreads)
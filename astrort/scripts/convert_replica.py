@@ -0,0 +1,25 @@
+# *****************************************************************************
+# Copyright (C) 2023 Ambra Di Piano
+# This software is distributed under the terms of the BSD-3-Clause license
+#
+# Authors:
+# Ambra Di Piano <ambra.dipiano@inaf.it>
+# *****************************************************************************
+
+import argparse
+from astrort.utils.replica import convert_replica_plan
+
+def main(datfile, output):
+    if output is None:
+        output = datfile.replace('.dat', '_replica')
+    convert_replica_plan(datfile, output)
+    print(f"replica plan saved in {output}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='')
+    parser.add_argument('-f', '--datfile', type=str, required=True, help="Path of the replica data table")
+    parser.add_argument('-o', '--output', type=str, default=None, help='Folder of the columnar replica plan, if unset it will be next to the data table')
+    args = parser.parse_args()
+
+    main(args.datfile, args.output)
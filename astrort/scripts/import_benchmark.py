@@ -0,0 +1,58 @@
+# *****************************************************************************
+# Copyright (C) 2023 Ambra Di Piano
+# This software is distributed under the terms of the BSD-3-Clause license
+#
+# Authors:
+# Ambra Di Piano <ambra.dipiano@inaf.it>
+# *****************************************************************************
+
+import sys
+import json
+import argparse
+import subprocess
+import numpy as np
+
+# entry points of the short jobs
+MODULES = ['astrort.configure.slurmjobs', 'astrort.simulator.base_simulator', 'astrort.simulator.base_mapper', 'astrort.simulator.base_cleaner', 'astrort.utils.wrap']
+# dependencies that should only load on the code paths using them
+HEAVY = ['matplotlib', 'pandas', 'scipy', 'astropy.coordinates', 'astropy.wcs', 'astropy.io.fits', 'rtasci', 'gammalib']
+
+PROBE = '''import sys, json
+from time import perf_counter
+clock = perf_counter()
+import {module}
+print(json.dumps({{'seconds': perf_counter() - clock, 'loaded': [m for m in {heavy} if m in sys.modules]}}))
+'''
+
+def time_import(module, heavy=HEAVY):
+    # a fresh interpreter per import, nothing cached in sys.modules
+    output = subprocess.run([sys.executable, '-c', PROBE.format(module=module, heavy=heavy)], capture_output=True, text=True, check=True)
+    return json.loads(output.stdout.splitlines()[-1])
+
+def get_slowest_imports(module, top=10):
+    # cumulative times from python -X importtime, in microseconds
+    output = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'], capture_output=True, text=True, check=True)
+    times = []
+    for line in output.stderr.splitlines()[1:]:
+        fields = line.split('|')
+        if len(fields) == 3 and fields[1].strip().isdigit():
+            times.append((int(fields[1]), fields[2].strip()))
+    return sorted(times, reverse=True)[1:top+1]
+
+def main(modules, repeat, top):
+    for module in modules:
+        results = [time_import(module) for _ in range(repeat)]
+        seconds = np.array([result['seconds'] for result in results])
+        print(f"{module}: median {np.median(seconds)*1e3:.1f} ms, min {seconds.min()*1e3:.1f} ms over {repeat} runs, heavy modules loaded: {results[0]['loaded']}")
+        for microseconds, name in get_slowest_imports(module, top):
+            print(f"    {microseconds/1e3:8.1f} ms  {name}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='')
+    parser.add_argument('-m', '--modules', type=str, nargs='+', default=MODULES, help='Modules to import')
+    parser.add_argument('-r', '--repeat', type=int, default=5, help='Number of fresh interpreters per module')
+    parser.add_argument('-t', '--top', type=int, default=10, help='Number of slowest nested imports to list')
+    args = parser.parse_args()
+
+    main(args.modules, args.repeat, args.top)
@@ -11,12 +11,12 @@ from os.path import join
 from astrort.utils.wrap import load_yaml_conf, merge_data_info
 from astrort.configure.logging import set_logger
 
-def main(configuration, mode):
+def main(configuration, mode, threads=4, binary=False):
     configuration = load_yaml_conf(configuration)
     logfile = join(configuration[mode]['output'], f'merged_{mode}_data.log')
     log = set_logger(configuration['logging']['level'], logfile)
     log.info(f"merge {mode} data files")
-    merge_data_info(configuration[mode], mode, log)
+    merge_data_info(configuration[mode], mode, log, threads=threads, binary=binary)
     log.info(f"{mode} merge completed")
 
 
@@ -24,6 +24,8 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='')
     parser.add_argument('-f', '--configuration', type=str, required=True, help="Path of yaml configuration file")
     parser.add_argument('-m', '--mode', type=str, required=True, choices=['simulator', 'mapper'], help='Data table to merge')
+    parser.add_argument('-t', '--threads', type=int, default=4, help='Number of data files read ahead in parallel')
+    parser.add_argument('-b', '--binary', action='store_true', help='Also write the merged data in binary columnar format')
     args = parser.parse_args()
 
-    main(args.configuration, args.mode)
\ No newline at end of file
+    main(args.configuration, args.mode, args.threads, args.binary)
\ No newline at end of file
@@ -0,0 +1,34 @@
+# *****************************************************************************
+# Copyright (C) 2023 Ambra Di Piano
+# This software is distributed under the terms of the BSD-3-Clause license
+#
+# Authors:
+# Ambra Di Piano <ambra.dipiano@inaf.it>
+# *****************************************************************************
+
+import argparse
+from os.path import join
+from astrort.utils.loader import MapLoader
+
+def main(path, batch, threads, shuffle, cleaner, exposure=None):
+    if cleaner:
+        loader = MapLoader(join(path, 'noisy'), clean=join(path, 'clean'), batch=batch, threads=threads, shuffle=shuffle, exposure=exposure)
+    else:
+        loader = MapLoader(path, batch=batch, threads=threads, shuffle=shuffle, exposure=exposure)
+    for batch in loader:
+        pass
+    throughput = loader.get_throughput()
+    print(f"read {loader.stats['maps']} maps in {loader.stats['seconds']:.2f} s: {throughput['maps/s']:.1f} maps/s, {throughput['MB/s']:.1f} MB/s")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='')
+    parser.add_argument('-p', '--path', type=str, required=True, help="Mapper output folder, dataset folder or stacked npy file")
+    parser.add_argument('-b', '--batch', type=int, default=32, help='Number of maps per batch')
+    parser.add_argument('-t', '--threads', type=int, default=4, help='Number of threads prefetching batches')
+    parser.add_argument('-s', '--shuffle', action='store_true', help='Read the maps in random order')
+    parser.add_argument('-c', '--cleaner', action='store_true', help='Pair noisy and clean maps of the cleaner output folder')
+    parser.add_argument('-e', '--exposure', type=float, default=None, help='Exposure of the maps to read, required when the output has several exposures')
+    args = parser.parse_args()
+
+    main(args.path, args.batch, args.threads, args.shuffle, args.cleaner, args.exposure)
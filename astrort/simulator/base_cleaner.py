@@ -7,16 +7,79 @@
 # *****************************************************************************
 
 import argparse
-import pandas as pd
 import numpy as np
 from time import time
 from os import makedirs
 from os.path import join
 from astrort.utils.wrap import load_yaml_conf, write_mapping_info, plot_map
 from astrort.utils.utils import get_all_seeds, get_instrument_fov, get_instrument_tev_range, adjust_tev_range_to_irf
+from astrort.utils.replica import load_replica_plan
+from astrort.utils.workqueue import open_seed_queue
+from astrort.utils.records import open_records, close_records, flush_writers, get_record_options, install_handlers, MAPPING_COLUMNS
 from astrort.configure.logging import set_logger, get_log_level, get_logfile
 from astrort.configure.slurmjobs import slurm_submission
-from rtasci.lib.RTACtoolsAnalysis import RTACtoolsAnalysis
+
+def clean_seeds(configuration, seeds, datfile, replica, log, renew=None):
+    for seed in seeds:
+        # keep the queue lease of the batch
+        if renew is not None:
+            renew()
+        clean_seed(configuration, seed, datfile, replica, log)
+    return datfile
+
+def clean_seed(configuration, seed, datfile, replica, log):
+    from rtasci.lib.RTACtoolsAnalysis import RTACtoolsAnalysis
+    clock_map = time()
+    configuration['simulator']['seed'] = int(seed)
+    row = replica.row(configuration['simulator']['seed'])
+    # configure map
+    mapper = RTACtoolsAnalysis()
+    mapper.input = join(configuration['simulator']['output'], row['name'] + '.fits')
+    log.debug(f"DL3: {mapper.input}")
+    mapper.irf = row['irf'] 
+    log.debug(f"IRF: {mapper.irf}")
+    mapper.caldb = configuration['simulator']['prod']
+    mapper.e = adjust_tev_range_to_irf(get_instrument_tev_range(configuration['simulator']['array']), mapper.irf)
+    if configuration['mapper']['exposure'] == 'random': 
+        mapper.t = [0, np.random.randint(10, configuration['simulator']['duration'])]
+    else:
+        mapper.t = [0, configuration['mapper']['exposure']]
+    mapper.roi = get_instrument_fov(configuration['simulator']['array'])
+    # make noisy map
+    mapper.sky_subtraction = 'NONE'
+    mapper.output = join(configuration['mapper']['output'], 'noisy', row['name'] + '_map.fits')
+    mapper.run_skymap(wbin=configuration['mapper']['pixelsize'])
+    log.debug(f"Noisy map: {mapper.output}")
+    # make plot
+    if configuration['mapper']['plot'] and configuration['mapper']['save'] == 'fits':
+        clock_plot = time()
+        plotmap = plot_map(mapper.output, log, configuration)
+        log.info(f"Plotting noisy image (seed = {seed}) complete, took {time() - clock_plot} s")
+    # make clean map
+    mapper.sky_subtraction = 'IRF'
+    mapper.output = join(configuration['mapper']['output'], 'clean', row['name'] + '_map.fits')
+    mapper.run_skymap(wbin=configuration['mapper']['pixelsize'])
+    log.debug(f"Clean map: {mapper.output}")
+    # make plot
+    if configuration['mapper']['plot'] and configuration['mapper']['save'] == 'fits':
+        clock_plot = time()
+        plotmap = plot_map(mapper.output, log, configuration)
+        log.info(f"Plotting clean image (seed = {seed}) complete, took {time() - clock_plot} s")
+    log.info(f"Mapping (seed = {seed}) complete, took {time() - clock_map} s")
+    # timing simulation
+    clock_map = time() - clock_map
+    # save simulation data
+    write_mapping_info(configuration, datfile, clock_map, mapper=mapper)
+    del mapper
+    return datfile
+
+def clean_queue(configuration, datfile, replica, log):
+    queue = open_seed_queue(configuration, 'mapper')
+    for batch, seeds in queue.batches(before_complete=flush_writers):
+        log.info(f"Claimed batch {batch} with seeds [{seeds[0]}, {seeds[-1]}]")
+        clean_seeds(configuration, seeds, datfile, replica, log, renew=lambda: queue.renew(batch))
+    queue.close()
+    return datfile
 
 def base_cleaner(configuration_file, seeds=None):
     clock = time()
@@ -25,6 +88,8 @@ def base_cleaner(configuration_file, seeds=None):
     datfile = logfile.replace('.log', '.dat')
     # set logger
     log = set_logger(get_log_level(configuration['logging']['level']), logfile)
+    # flush buffered rows on exit and on SIGTERM/SIGINT
+    install_handlers()
     # collect simulations to map
     if seeds is None:
         log.info(f"Mapping of all simulations found")
@@ -38,52 +103,19 @@ def base_cleaner(configuration_file, seeds=None):
     # start mapping
     log.info(f"\n {'-'*15} \n| START MAPPER | \n {'-'*15} \n")
     if configuration['mapper']['replicate'] is not None:
-        replica = pd.read_csv(configuration['mapper']['replicate'], sep=' ', header=0)
+        replica = load_replica_plan(configuration['mapper']['replicate'], seeds if configuration['mapper'].get('queue') is None else None)
         log.info(f"Replicate pointing and IRF from {configuration['mapper']['replicate']}")
     else:
         raise ValueError(f'This script requires a "mapper:replicate" configuration other than None')
-    for seed in seeds:
-        clock_map = time()
-        # configure map
-        mapper = RTACtoolsAnalysis()
-        mapper.input = join(configuration['simulator']['output'], replica[replica['seed']==configuration['simulator']['seed']]['name'].values[0] + '.fits')
-        log.debug(f"DL3: {mapper.input}")
-        mapper.irf = replica[replica['seed']==configuration['simulator']['seed']]['irf'].values[0] 
-        log.debug(f"IRF: {mapper.irf}")
-        mapper.caldb = configuration['simulator']['prod']
-        mapper.e = adjust_tev_range_to_irf(get_instrument_tev_range(configuration['simulator']['array']), mapper.irf)
-        if configuration['mapper']['exposure'] == 'random': 
-            mapper.t = [0, np.random.randint(10, configuration['simulator']['duration'])]
-        else:
-            mapper.t = [0, configuration['mapper']['exposure']]
-        mapper.roi = get_instrument_fov(configuration['simulator']['array'])
-        # make noisy map
-        mapper.sky_subtraction = 'NONE'
-        mapper.output = join(configuration['mapper']['output'], 'noisy', replica[replica['seed']==configuration['simulator']['seed']]['name'].values[0] + '_map.fits')
-        mapper.run_skymap(wbin=configuration['mapper']['pixelsize'])
-        log.debug(f"Noisy map: {mapper.output}")
-        # make plot
-        if configuration['mapper']['plot'] and configuration['mapper']['save'] == 'fits':
-            clock_plot = time()
-            plotmap = plot_map(mapper.output, log)
-            log.info(f"Plotting noisy image (seed = {seed}) complete, took {time() - clock_plot} s")
-        # make clean map
-        mapper.sky_subtraction = 'IRF'
-        mapper.output = join(configuration['mapper']['output'], 'clean', replica[replica['seed']==configuration['simulator']['seed']]['name'].values[0] + '_map.fits')
-        mapper.run_skymap(wbin=configuration['mapper']['pixelsize'])
-        log.debug(f"Clean map: {mapper.output}")
-        # make plot
-        if configuration['mapper']['plot'] and configuration['mapper']['save'] == 'fits':
-            clock_plot = time()
-            plotmap = plot_map(mapper.output, log)
-            log.info(f"Plotting clean image (seed = {seed}) complete, took {time() - clock_plot} s")
-        log.info(f"Mapping (seed = {seed}) complete, took {time() - clock_map} s")
-        # timing simulation
-        clock_map = time() - clock_map
-        # save simulation data
-        write_mapping_info(configuration, mapper, datfile, clock_map)
-        configuration['simulator']['seed'] += 1
-        del mapper
+    open_records(datfile, MAPPING_COLUMNS, **get_record_options(configuration))
+    queue = open_seed_queue(configuration, 'mapper', seeds)
+    if queue is not None:
+        log.info(f"Seed queue {configuration['mapper']['queue']}: {queue.status()}")
+        queue.close()
+        clean_queue(configuration, datfile, replica, log)
+    else:
+        clean_seeds(configuration, seeds, datfile, replica, log)
+    close_records(datfile)
     # end simulations
     log.info(f"\n {'-'*15} \n| STOP MAPPER | \n {'-'*15} \n")
     log.info(f"Process complete, took {time() - clock} s")
@@ -9,11 +9,75 @@
 import argparse
 from time import time
 from os import makedirs
-from astrort.utils.wrap import load_yaml_conf, write_mapping_info, execute_mapper_no_visibility, plot_map
+from astrort.utils.wrap import load_yaml_conf, write_mapping_info, execute_mapper_no_visibility, execute_mapper_exposures, execute_mapper_batch, plot_maps, get_plot_mode, resume_seeds
 from astrort.utils.utils import get_all_seeds
+from astrort.utils.workqueue import open_seed_queue
+from astrort.utils.dataset import close_datasets, build_dataset_index, get_dataset_folder
+from astrort.utils.records import open_records, close_records, flush_writers, get_record_options, install_handlers, MAPPING_COLUMNS
 from astrort.configure.logging import set_logger, get_log_level, get_logfile
 from astrort.configure.slurmjobs import slurm_submission
 
+def map_seeds(configuration, seeds, datfile, log, renew=None):
+    if type(configuration['mapper']['exposure']) == list and configuration['mapper'].get('energy') is not None:
+        raise ValueError(f"Energy cubes require a single 'mapper:exposure', found {configuration['mapper']['exposure']}")
+    mapfiles = []
+    for seed in seeds:
+        # keep the queue lease of the batch
+        if renew is not None:
+            renew()
+        clock_map = time()
+        configuration['simulator']['seed'] = int(seed)
+        # make map
+        if type(configuration['mapper']['exposure']) == list:
+            skymaps = execute_mapper_exposures(configuration, log)
+        else:
+            skymaps = {configuration['mapper']['exposure']: execute_mapper_no_visibility(configuration, log)}
+        log.info(f"Mapping (seed = {seed}) complete, took {time() - clock_map} s")
+        mapfiles += list(skymaps.values())
+        # timing simulation
+        clock_map = (time() - clock_map) / len(skymaps)
+        # save simulation data
+        for exposure in skymaps.keys():
+            write_mapping_info(configuration, datfile, clock_map, exposure=exposure)
+    # make plots, once per batch of seeds
+    if get_plot_mode(configuration) is not None and len(mapfiles):
+        clock_plot = time()
+        plot_maps(configuration, mapfiles, log, prefix=datfile.replace('.dat', f'_{seeds[0]}_{seeds[-1]}'))
+        log.info(f"Plotting (seeds = [{seeds[0]}, {seeds[-1]}]) complete, took {time() - clock_plot} s")
+    return datfile
+
+def map_stack(configuration, seeds, datfile, log, stackfile=None, renew=None):
+    if type(configuration['mapper']['exposure']) == list:
+        raise ValueError(f"Stacked maps require a single 'mapper:exposure', found {configuration['mapper']['exposure']}")
+    if configuration['mapper'].get('energy') is not None:
+        raise ValueError(f"Stacked maps do not support energy cubes, found 'mapper:energy' {configuration['mapper']['energy']}")
+    clock_map = time()
+    # one stacked array per job instead of one file per seed
+    seeds = [int(seed) for seed in seeds]
+    if stackfile is None:
+        stackfile = datfile.replace('.dat', '_stack.npy')
+    execute_mapper_batch(configuration, seeds, stackfile, log, renew=renew)
+    log.info(f"Mapping (seeds = [{seeds[0]}, {seeds[-1]}]) complete in {stackfile}, took {time() - clock_map} s")
+    # timing simulation
+    clock_map = (time() - clock_map) / len(seeds)
+    # save simulation data
+    for seed in seeds:
+        configuration['simulator']['seed'] = int(seed)
+        write_mapping_info(configuration, datfile, clock_map)
+    return stackfile
+
+def map_queue(configuration, datfile, log):
+    queue = open_seed_queue(configuration, 'mapper')
+    for batch, seeds in queue.batches(before_complete=flush_writers):
+        log.info(f"Claimed batch {batch} with seeds [{seeds[0]}, {seeds[-1]}]")
+        if configuration['mapper']['save'] == 'stack':
+            # one stack per claimed batch
+            map_stack(configuration, seeds, datfile, log, stackfile=datfile.replace('.dat', f'_stack_{batch}.npy'), renew=lambda: queue.renew(batch))
+        else:
+            map_seeds(configuration, seeds, datfile, log, renew=lambda: queue.renew(batch))
+    queue.close()
+    return datfile
+
 def base_mapper(configuration_file, seeds=None):
     clock = time()
     configuration = load_yaml_conf(configuration_file)
@@ -21,31 +85,35 @@ def base_mapper(configuration_file, seeds=None):
     datfile = logfile.replace('.log', '.dat')
     # set logger
     log = set_logger(get_log_level(configuration['logging']['level']), logfile)
+    # flush buffered rows on exit and on SIGTERM/SIGINT
+    install_handlers()
     # collect simulations to map
     if seeds is None:
         log.info(f"Mapping of all simulations found")
         seeds = get_all_seeds(configuration['simulator'])
+    if configuration['mapper'].get('resume', False) and configuration['mapper']['save'] != 'stack':
+        seeds = resume_seeds(configuration, seeds, datfile, 'mapper', log)
     log.info(f"Mapper configured, took {time() - clock} s")
     # create output dir
     log.info(f"Output folder: {configuration['mapper']['output']}")
     makedirs(configuration['mapper']['output'], exist_ok=True)
     # start mapping
     log.info(f"\n {'-'*15} \n| START MAPPER | \n {'-'*15} \n")
-    for seed in seeds:
-        clock_map = time()
-        # make map
-        fitsmap = execute_mapper_no_visibility(configuration, log)
-        log.info(f"Mapping (seed = {seed}) complete, took {time() - clock_map} s")
-        # make plot
-        if configuration['mapper']['plot'] and configuration['mapper']['save'] == 'fits':
-            clock_plot = time()
-            plotmap = plot_map(fitsmap, log)
-            log.info(f"Plotting (seed = {seed}) complete, took {time() - clock_plot} s")
-        # timing simulation
-        clock_map = time() - clock_map
-        # save simulation data
-        write_mapping_info(configuration, datfile, clock_map)
-        configuration['simulator']['seed'] += 1
+    open_records(datfile, MAPPING_COLUMNS, **get_record_options(configuration))
+    queue = open_seed_queue(configuration, 'mapper', seeds)
+    if queue is not None:
+        log.info(f"Seed queue {configuration['mapper']['queue']}: {queue.status()}")
+        queue.close()
+        map_queue(configuration, datfile, log)
+    elif configuration['mapper']['save'] == 'stack':
+        map_stack(configuration, seeds, datfile, log)
+    else:
+        map_seeds(configuration, seeds, datfile, log)
+    close_records(datfile)
+    if configuration['mapper']['save'] == 'dataset':
+        # complete the last shard and index the whole dataset
+        close_datasets()
+        log.info(f"Dataset index {build_dataset_index(get_dataset_folder(configuration))}")
     # end simulations
     log.info(f"\n {'-'*15} \n| STOP MAPPER | \n {'-'*15} \n")
     log.info(f"Process complete, took {time() - clock} s")
@@ -62,4 +130,4 @@ if __name__ == '__main__':
     parser.add_argument('-n', '--nodes', type=int, default=0, help='Number of slurm nodes to occupy for submission, if unset it will not submit to slurm' )
     args = parser.parse_args()
 
-    main(args.configuration, args.nodes)
\ No newline at end of file
+    main(args.configuration, args.nodes)
@@ -6,72 +6,216 @@
 # Ambra Di Piano <ambra.dipiano@inaf.it>
 # *****************************************************************************
 
+import random
+import logging
 import argparse
-import pandas as pd
+import numpy as np
 from time import time
-from rtasci.lib.RTACtoolsSimulation import RTACtoolsSimulation
-from astrort.utils.wrap import load_yaml_conf, configure_simulator_no_visibility, write_simulation_info, set_pointing, set_irf, randomise_target, replicate_target
+from os import makedirs, remove
+from os.path import join, basename, isfile
+from shutil import move, rmtree
+from multiprocessing import Pool
+from astrort.utils.wrap import load_yaml_conf, configure_simulator_no_visibility, write_simulation_info, set_pointing, set_irf, get_simulation_plan, get_plan_pointing, randomise_target, replicate_target, merge_worker_datfiles, resume_seeds, execute_mapper_no_visibility, execute_mapper_exposures, write_mapping_info
+from astrort.utils.utils import get_all_seeds, split_seeds, get_worker_datfile, get_fused_datfile, get_fused_folder, keep_fused_dl3
+from astrort.utils.replica import load_replica_plan
+from astrort.utils.events import clear_event_cache
+from astrort.utils.models import get_model_tmpfile
+from astrort.utils.workqueue import open_seed_queue
+from astrort.utils.dataset import close_datasets, build_dataset_index, get_dataset_folder
+from astrort.utils.records import open_records, close_records, flush_writers, get_record_options, install_handlers, SIMULATION_COLUMNS, MAPPING_COLUMNS
 from astrort.configure.logging import set_logger, get_log_level, get_logfile
 from astrort.configure.slurmjobs import slurm_submission
 
-def base_simulator(configuration_file):
+def map_fused(configuration, phlist, datfile, log):
+    clock_map = time()
+    if type(configuration['mapper']['exposure']) == list:
+        skymaps = execute_mapper_exposures(configuration, log, phlist=phlist)
+    else:
+        skymaps = {configuration['mapper']['exposure']: execute_mapper_no_visibility(configuration, log, phlist=phlist)}
+    log.info(f"Mapping (seed = {configuration['simulator']['seed']}) complete, took {time() - clock_map} s")
+    clock_map = (time() - clock_map) / len(skymaps)
+    for exposure in skymaps.keys():
+        write_mapping_info(configuration, datfile, clock_map, exposure=exposure)
+    # release the memory map before the event list is removed
+    clear_event_cache()
+    return skymaps
+
+def simulate_seeds(configuration, seeds, datfile, log, replica=None, plan=None, renew=None):
+    from rtasci.lib.RTACtoolsSimulation import RTACtoolsSimulation
+    # per-seed models are rendered from the same template
+    template, keepxml = configuration['simulator']['model'], configuration['simulator'].get('keepxml', True)
+    fused = configuration['simulator'].get('fused', False)
+    if fused:
+        # event lists are mapped from memory backed storage and dropped
+        folder = get_fused_folder()
+        mapfile = get_fused_datfile(configuration, datfile)
+        makedirs(configuration['mapper']['output'], exist_ok=True)
+        open_records(mapfile, MAPPING_COLUMNS, **get_record_options(configuration))
+    irf = configuration['simulator']['irf']
+    try:
+        for seed in seeds:
+            # keep the queue lease of the batch
+            if renew is not None:
+                renew()
+            clock_sim = time()
+            configuration['simulator']['seed'] = int(seed)
+            # randomise source position in model
+            if configuration['simulator']['target'] == 'random' and replica is None and plan is None:
+                configuration['simulator']['model'] = randomise_target(model=template, output=configuration['simulator']['output'], name=configuration['simulator']['name'], samples=configuration['simulator']['samples'], seed=configuration['simulator']['seed'], keepxml=keepxml)
+            simulator = RTACtoolsSimulation()
+            # check pointing option
+            if replica is not None:
+                row = replica.row(configuration['simulator']['seed'])
+                configuration['simulator']['pointing'] = {'ra': row['point_ra'], 'dec': row['point_dec']}
+                configuration['simulator']['irf'] = row['irf']
+                configuration['simulator']['model'] = replicate_target(model=template, output=configuration['simulator']['output'], name=configuration['simulator']['name'], samples=configuration['simulator']['samples'], seed=configuration['simulator']['seed'], ra=row['source_ra'], dec=row['source_dec'], keepxml=keepxml)
+            elif plan is not None:
+                # everything is read from the plan, nothing is drawn here
+                row = plan.row(configuration['simulator']['seed'])
+                configuration['simulator']['irf'] = row['irf']
+                if configuration['simulator']['target'] == 'random':
+                    configuration['simulator']['model'] = replicate_target(model=template, output=configuration['simulator']['output'], name=configuration['simulator']['name'], samples=configuration['simulator']['samples'], seed=configuration['simulator']['seed'], ra=row['source_ra'], dec=row['source_dec'], keepxml=keepxml)
+
+            if plan is not None:
+                point = get_plan_pointing(row)
+                simulator.pointing = [point['point_ra'], point['point_dec']]
+            else:
+                simulator, point = set_pointing(simulator, configuration['simulator'], log)
+            simulator.irf = set_irf(configuration['simulator'], log)
+            # complete configuration
+            simulator = configure_simulator_no_visibility(simulator, configuration['simulator'], log)
+            if fused:
+                phlist, simulator.output = simulator.output, join(folder, basename(simulator.output))
+            simulator.run_simulation()
+            log.info(f"Simulation (seed = {configuration['simulator']['seed']}) complete, took {time() - clock_sim} s")
+            # timing simulation
+            clock_sim = time() - clock_sim
+            # save simulation data
+            write_simulation_info(simulator, configuration['simulator'], point, datfile, clock_sim)
+            if fused:
+                map_fused(configuration, simulator.output, mapfile, log)
+                # keep a sample of event lists for quality checks
+                if keep_fused_dl3(seed, configuration['simulator'].get('keepdl3', 0)):
+                    move(simulator.output, phlist)
+                else:
+                    remove(simulator.output)
+            del simulator
+    finally:
+        configuration['simulator']['irf'] = irf
+        if fused:
+            close_records(mapfile)
+            rmtree(folder, ignore_errors=True)
+        if not keepxml and isfile(get_model_tmpfile(configuration['simulator']['name'])):
+            remove(get_model_tmpfile(configuration['simulator']['name']))
+        configuration['simulator']['model'] = template
+    return datfile
+
+def simulate_queue(configuration, datfile, log, replica=None, plan=None):
+    # each process keeps its own connection to the queue
+    queue = open_seed_queue(configuration, 'simulator')
+    for batch, seeds in queue.batches(before_complete=flush_writers):
+        log.info(f"Claimed batch {batch} with seeds [{seeds[0]}, {seeds[-1]}]")
+        simulate_seeds(configuration, seeds, datfile, log, replica=replica, plan=plan, renew=lambda: queue.renew(batch))
+    queue.close()
+    return datfile
+
+def simulate_worker(configuration, seeds, datfile, logfile, replica=None, plan=None):
+    # forked workers share the parent random state, reseed to avoid duplicated samples
+    np.random.seed()
+    random.seed()
+    log = logging.getLogger()
+    if not log.handlers:
+        log = set_logger(get_log_level(configuration['logging']['level']), logfile)
+    open_records(datfile, SIMULATION_COLUMNS, **get_record_options(configuration))
+    try:
+        if seeds is None:
+            log.info(f"Worker started on queue {configuration['simulator']['queue']}, datfile {datfile}")
+            simulate_queue(configuration, datfile, log, replica=replica, plan=plan)
+        else:
+            log.info(f"Worker started on seeds [{seeds[0]}, {seeds[-1]}], datfile {datfile}")
+            simulate_seeds(configuration, seeds, datfile, log, replica=replica, plan=plan)
+    finally:
+        # the shard must be complete before the parent merges it
+        close_records(datfile)
+        close_datasets()
+    return datfile
+
+def base_simulator(configuration_file, mpthreads=0):
     clock = time()
     configuration = load_yaml_conf(configuration_file)
     logfile = get_logfile(configuration, mode='simulator')
     datfile = logfile.replace('.log', '.dat')
     log = set_logger(get_log_level(configuration['logging']['level']), logfile)
+    # flush buffered rows on exit and on SIGTERM/SIGINT
+    install_handlers()
     log.info(f"Simulator configured, took {time() - clock} s")
+    # fused jobs write one map per seed before removing the DL3
+    if configuration['simulator'].get('fused', False) and configuration['mapper']['save'] not in ['fits', 'npy', 'sparse', 'dataset']:
+        raise ValueError(f"Fused simulation and mapping does not support 'mapper:save' {configuration['mapper']['save']}")
     # create output dir
     log.info(f"Output folder: {configuration['simulator']['output']}")
     # start simulations
     log.info(f"\n {'-'*17} \n| START SIMULATOR | \n {'-'*17} \n")
+    seeds = get_all_seeds(configuration['simulator'])
+    if configuration['simulator'].get('resume', False):
+        seeds = resume_seeds(configuration, seeds, datfile, 'simulator', log)
+    # with a queue the seeds are claimed in batches instead of taken in order
+    queue = open_seed_queue(configuration, 'simulator', seeds)
+    if queue is not None:
+        log.info(f"Seed queue {configuration['simulator']['queue']}: {queue.status()}")
+        # the queue may hold seeds of other jobs, e.g. from the slurm submission
+        queued = queue.seeds()
+        queue.close()
     if configuration['simulator']['replicate'] is not None:
-        replica = pd.read_csv(configuration['simulator']['replicate'], sep=' ', header=0)
+        replica = load_replica_plan(configuration['simulator']['replicate'], seeds if queue is None else None)
         log.info(f"Replicate pointing and IRF from {configuration['simulator']['replicate']}")
     else:
         replica = None
-    # loop seeds
-    for i in range(configuration['simulator']['samples']):
-        clock_sim = time()
-        # randomise source position in model
-        if configuration['simulator']['target'] == 'random' and replica is None:
-            configuration['simulator']['model'] = randomise_target(model=configuration['simulator']['model'], output=configuration['simulator']['output'], name=configuration['simulator']['name'], samples=configuration['simulator']['samples'], seed=configuration['simulator']['seed'])
-        simulator = RTACtoolsSimulation()
-        # check pointing option
+    if configuration['simulator'].get('plan', False):
         if replica is not None:
-            configuration['simulator']['pointing'] = {'ra': replica[replica['seed']==configuration['simulator']['seed']]['point_ra'].values[0],  
-                                                      'dec': replica[replica['seed']==configuration['simulator']['seed']]['point_dec'].values[0]}
-            configuration['simulator']['irf'] = replica[replica['seed']==configuration['simulator']['seed']]['irf'].values[0]   
-            configuration['simulator']['model'] = replicate_target(model=configuration['simulator']['model'], output=configuration['simulator']['output'], name=configuration['simulator']['name'], samples=configuration['simulator']['samples'], seed=configuration['simulator']['seed'], ra=replica[replica['seed']==configuration['simulator']['seed']]['source_ra'].values[0], dec=replica[replica['seed']==configuration['simulator']['seed']]['source_dec'].values[0])
-
-        simulator, point = set_pointing(simulator, configuration['simulator'], log)
-        simulator.irf = set_irf(configuration['simulator'], log)
-        # complete configuration
-        simulator = configure_simulator_no_visibility(simulator, configuration['simulator'], log)
-        simulator.run_simulation()
-        log.info(f"Simulation (seed = {configuration['simulator']['seed']}) complete, took {time() - clock_sim} s")
-        # timing simulation
-        clock_sim = time() - clock_sim
-        # save simulation data
-        write_simulation_info(simulator, configuration['simulator'], point, datfile, clock_sim)
-        configuration['simulator']['seed'] += 1
-        del simulator
+            raise ValueError(f'Simulation plan and "simulator:replicate" cannot be used together')
+        plan = get_simulation_plan(configuration, get_all_seeds(configuration['simulator']) if queue is None else queued, log, subset=queue is None)
+        log.info(f"Pointing, source and IRF read from the simulation plan")
+    else:
+        plan = None
+    # loop seeds
+    if len(seeds) == 0:
+        log.info(f"No seeds left to simulate")
+    elif mpthreads > 1:
+        # each worker owns a seed range, or pulls from the queue, and its own datfile shard
+        chunks = split_seeds(seeds, mpthreads) if queue is None else [None] * mpthreads
+        jobs = [(configuration, chunk, get_worker_datfile(datfile, worker), logfile, replica, plan) for worker, chunk in enumerate(chunks)]
+        log.info(f"Simulating {len(seeds)} seeds with {len(jobs)} workers")
+        with Pool(processes=len(jobs)) as pool:
+            shards = pool.starmap(simulate_worker, jobs)
+        merge_worker_datfiles(datfile, shards, log)
+        if configuration['simulator'].get('fused', False):
+            merge_worker_datfiles(get_fused_datfile(configuration, datfile), [get_fused_datfile(configuration, shard) for shard in shards], log)
+    else:
+        open_records(datfile, SIMULATION_COLUMNS, **get_record_options(configuration))
+        if queue is not None:
+            simulate_queue(configuration, datfile, log, replica=replica, plan=plan)
+        else:
+            simulate_seeds(configuration, seeds, datfile, log, replica=replica, plan=plan)
+        close_records(datfile)
+    if configuration['simulator'].get('fused', False) and configuration['mapper']['save'] == 'dataset':
+        close_datasets()
+        log.info(f"Dataset index {build_dataset_index(get_dataset_folder(configuration))}")
     # end simulations
     log.info(f"\n {'-'*17} \n| STOP SIMULATOR | \n {'-'*17} \n")
     log.info(f"Process complete, took {time() - clock} s")
 
-def main(configuration, nodes):
+def main(configuration, nodes, mpthreads=0):
     if nodes == 0:
-        base_simulator(configuration)
+        base_simulator(configuration, mpthreads)
     else:
-        slurm_submission(configuration, nodes, mode='simulator')
+        slurm_submission(configuration, nodes, mode='simulator', mpthreads=mpthreads)
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='')
     parser.add_argument('-f', '--configuration', type=str, required=True, help="Path of yaml configuration file")
     parser.add_argument('-n', '--nodes', type=int, default=0, help='Number of slurm nodes to occupy for submission, if unset it will not submit to slurm' )
-    parser.add_argument('-mp', '--mpthreads', type=int, default=0, choices=range(0,7), help='Number of threads to use for parallel simulation, if unset it will not use multi-threading' )
+    parser.add_argument('-mp', '--mpthreads', type=int, default=0, help='Number of processes to use for parallel simulation, if unset it will simulate serially' )
     args = parser.parse_args()
 
-    main(args.configuration, args.nodes)
-
+    main(args.configuration, args.nodes, args.mpthreads)
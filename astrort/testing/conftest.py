@@ -8,6 +8,8 @@
 
 import pytest
 import astrort
+import numpy as np
+from astropy.io import fits
 from os.path import join, dirname, abspath
 from os import makedirs
 
@@ -22,4 +24,21 @@ def test_tmp_folder():
 
 @pytest.fixture(scope='function')
 def test_data_folder():
-    return join(dirname(abspath(astrort.__file__)), 'testing', 'data')
\ No newline at end of file
+    return join(dirname(abspath(astrort.__file__)), 'testing', 'data')
+
+@pytest.fixture(scope='function')
+def test_dl3_file(test_tmp_folder):
+    # synthetic photon list around the pointing, mimicking ctobssim output
+    rng = np.random.default_rng(1)
+    size = 5000
+    columns = [fits.Column(name='EVENT_ID', format='1J', array=np.arange(size)),
+               fits.Column(name='TIME', format='1D', unit='s', array=np.sort(rng.uniform(0, 100, size))),
+               fits.Column(name='RA', format='1E', unit='deg', array=rng.normal(83.63, 1, size)),
+               fits.Column(name='DEC', format='1E', unit='deg', array=rng.normal(22.01, 1, size)),
+               fits.Column(name='ENERGY', format='1E', unit='TeV', array=rng.uniform(0.03, 150, size))]
+    events = fits.BinTableHDU.from_columns(columns, name='EVENTS')
+    for key, value in {'RA_PNT': 83.63, 'DEC_PNT': 22.01, 'TSTART': 0.0, 'TSTOP': 100.0, 'TELAPSE': 100.0, 'ONTIME': 100.0, 'LIVETIME': 98.0, 'DEADC': 0.98, 'DSVAL2': '0.03:150', 'RADECSYS': 'ICRS'}.items():
+        events.header[key] = value
+    filename = join(test_tmp_folder, 'test_dl3.fits')
+    fits.HDUList([fits.PrimaryHDU(), events]).writeto(filename, overwrite=True)
+    return filename
@@ -6,12 +6,17 @@
 # Ambra Di Piano <ambra.dipiano@inaf.it>
 # *****************************************************************************
 
+import sys
 import pytest
+import numpy as np
+import subprocess
 from shutil import rmtree
 from os import listdir, makedirs
 from os.path import isfile, join
+from yaml import safe_load
 from astrort.configure.slurmjobs import make_configuration, make_sh
 from astrort.utils.wrap import load_yaml_conf
+from astrort.utils.replica import ReplicaPlan
 
 @pytest.mark.test_conf_file
 @pytest.mark.parametrize('mode', ['simulator', 'mapper'])
@@ -34,6 +39,19 @@ def test_make_configuration(test_conf_file, mode):
     found_configurations = len([f for f in listdir(conf[mode]['output']) if isfile(join(conf[mode]['output'], f)) and '.yml' in f and conf['slurm']['name'] in f])
     assert found_configurations == expected_configurations, f"Expected {expected_configurations} simulations, found {found_configurations}"
 
+@pytest.mark.test_conf_file
+@pytest.mark.test_tmp_folder
+def test_make_configuration_replica_store(test_conf_file, test_tmp_folder):
+    conf = load_yaml_conf(test_conf_file)
+    store = ReplicaPlan({'seed': np.arange(1, 11), 'irf': np.full(10, 'North_z60_0.5h_LST')}).save(join(test_tmp_folder, 'test_replica_store'))
+    conf['mapper']['replicate'] = store
+    makedirs(conf['mapper']['output'], exist_ok=True)
+    jobname_conf = join(conf['mapper']['output'], 'job_replica_store_mapper.yml')
+    make_configuration(jobname_conf, conf, 1, 'mapper')
+    # the store is shared by all jobs
+    with open(jobname_conf) as f:
+        assert safe_load(f)['mapper']['replicate'] == store
+
 @pytest.mark.test_conf_file
 @pytest.mark.parametrize('mode', ['simulator', 'mapper'])
 def test_make_sh(test_conf_file, mode):
@@ -58,3 +76,12 @@ def test_make_sh(test_conf_file, mode):
     found_sh = len([f for f in listdir(conf[mode]['output']) if isfile(join(conf[mode]['output'], f)) and '.sh' in f and conf['slurm']['name'] in f and mode in f])
     assert found_sh == expected_sh, f"Expected {expected_sh} files for {mode}, found {found_sh}"
 
+
+@pytest.mark.parametrize('module', ['astrort.configure.slurmjobs', 'astrort.utils.wrap'])
+def test_lazy_imports(module):
+
+    # import in a fresh interpreter
+    heavy = ['matplotlib', 'pandas', 'scipy', 'astropy.coordinates', 'astropy.wcs', 'rtasci']
+    output = subprocess.run([sys.executable, '-c', f"import sys, {module}; print(' '.join(m for m in {heavy} if m in sys.modules))"], capture_output=True, text=True, check=True)
+    loaded = output.stdout.split()
+    assert loaded == [], f"Importing {module} loaded {loaded}"
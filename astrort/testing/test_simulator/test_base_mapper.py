@@ -43,3 +43,26 @@ def test_base_mapper(test_conf_file, seeds, save):
     assert found_maps == expected_maps, f"Expected {expected_maps} maps, found {found_maps}"
 
 
+@pytest.mark.test_conf_file
+def test_base_mapper_stack(test_conf_file):
+
+    # clean output
+    conf = load_yaml_conf(test_conf_file)
+    conf['mapper']['save'] = 'stack'
+    rmtree(conf['mapper']['output'], ignore_errors=True)
+
+    # run simulator
+    base_simulator(test_conf_file)
+
+    # write new mapper configuration
+    update_conf_file = join(conf['mapper']['output'], 'tmp.yml')
+    with open(update_conf_file, 'w+') as f:
+        dump(conf, f, default_flow_style=False)
+    base_mapper(update_conf_file)
+
+    # check output
+    stackfile = join(conf['mapper']['output'], conf['logging']['logfile'].replace('.log', '_mapper_stack.npy'))
+    assert isfile(stackfile)
+    assert isfile(stackfile.replace('.npy', '.dat'))
+    assert np.load(stackfile).shape[0] == conf['simulator']['samples']
+
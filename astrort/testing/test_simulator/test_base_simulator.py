@@ -11,16 +11,18 @@ import yaml
 import pandas as pd
 import numpy as np
 from shutil import rmtree
-from os import listdir, makedirs
+from os import listdir, makedirs, remove
 from os.path import isfile, join
 from astrort.simulator.base_simulator import base_simulator
 from astrort.utils.wrap import load_yaml_conf
+from astrort.utils.workqueue import SeedQueue
 
 @pytest.mark.test_conf_file
 @pytest.mark.test_data_folder
 @pytest.mark.test_tmp_folder
 @pytest.mark.parametrize('replicate', [None, 'test_simulator.dat'])
-def test_base_simulator(test_conf_file, replicate, test_data_folder, test_tmp_folder):
+@pytest.mark.parametrize('mpthreads', [0, 2])
+def test_base_simulator(test_conf_file, replicate, mpthreads, test_data_folder, test_tmp_folder):
 
     # clean output
     conf = load_yaml_conf(test_conf_file)
@@ -34,7 +36,7 @@ def test_base_simulator(test_conf_file, replicate, test_data_folder, test_tmp_fo
         yaml.dump(conf, f)
 
     # run simulator
-    base_simulator(tmp_conf_file)
+    base_simulator(tmp_conf_file, mpthreads)
 
     # check output
     expected_simulations = conf['simulator']['samples']
@@ -49,6 +51,47 @@ def test_base_simulator(test_conf_file, replicate, test_data_folder, test_tmp_fo
             assert np.round(data_new['point_ra'][i], decimals=3) == np.round(data_old['point_ra'][i], decimals=3)
             assert np.round(data_new['point_dec'][i], decimals=3) == np.round(data_old['point_dec'][i], decimals=3)
 
+    # check worker files are merged
+    datfile = join(conf['simulator']['output'], conf['logging']['logfile'].replace('.log', '_simulator.dat'))
+    data = pd.read_csv(datfile, sep=' ', header=0)
+    assert len(data) == expected_simulations
+    assert list(data['seed']) == sorted(data['seed'])
+    assert len([f for f in listdir(conf['simulator']['output']) if 'worker' in f]) == 0
+
 
 
     
+
+@pytest.mark.test_conf_file
+@pytest.mark.test_tmp_folder
+def test_base_simulator_fused_save(test_conf_file, test_tmp_folder):
+    conf = load_yaml_conf(test_conf_file)
+    conf['simulator']['fused'] = True
+    conf['mapper']['save'] = 'stack'
+    makedirs(test_tmp_folder, exist_ok=True)
+    tmp_conf_file = join(test_tmp_folder, 'test_fused.yml')
+    with open(tmp_conf_file, 'w+') as f:
+        yaml.dump(conf, f)
+    # stacks are not written per seed, the DL3 would be removed without a map
+    with pytest.raises(ValueError):
+        base_simulator(tmp_conf_file)
+
+@pytest.mark.test_conf_file
+@pytest.mark.test_tmp_folder
+def test_base_simulator_queue_plan(test_conf_file, test_tmp_folder):
+    conf = load_yaml_conf(test_conf_file)
+    rmtree(conf['simulator']['output'], ignore_errors=True)
+    makedirs(test_tmp_folder, exist_ok=True)
+    conf['simulator']['plan'] = True
+    conf['simulator']['queue'] = join(test_tmp_folder, 'test_queue_plan.db')
+    if isfile(conf['simulator']['queue']):
+        remove(conf['simulator']['queue'])
+    conf['simulator']['batch'] = 2
+    # the queue already holds the seeds of a second job
+    SeedQueue(conf['simulator']['queue']).populate(np.arange(1, 2*conf['simulator']['samples'] + 1), batch=2).close()
+    tmp_conf_file = join(test_tmp_folder, 'test_queue_plan.yml')
+    with open(tmp_conf_file, 'w+') as f:
+        yaml.dump(conf, f)
+    base_simulator(tmp_conf_file)
+    found_simulations = len([f for f in listdir(conf['simulator']['output']) if f.endswith('.fits') and conf['simulator']['name'] in f])
+    assert found_simulations == 2*conf['simulator']['samples']
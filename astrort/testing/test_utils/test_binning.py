@@ -0,0 +1,40 @@
+# *****************************************************************************
+# Copyright (C) 2023 Ambra Di Piano
+# This software is distributed under the terms of the BSD-3-Clause license
+#
+# Authors:
+# Ambra Di Piano <ambra.dipiano@inaf.it>
+# *****************************************************************************
+
+import pytest
+import numpy as np
+from astrort.utils.binning import *
+
+@pytest.mark.parametrize('pointing', [(83.63, 22.01), (0.5, -30), (359.5, 60)])
+@pytest.mark.parametrize('pixelsize', [0.02, 0.05])
+def test_sky_grid_pixel_centres(pointing, pixelsize):
+    grid = get_sky_grid(ra=pointing[0], dec=pointing[1], maproi=2.5, pixelsize=pixelsize)
+    # one event at the centre of every pixel, as defined by CRPIX, CDELT and CRVAL
+    crpix = grid.nbins/2 + 0.5
+    pixels = np.arange(grid.nbins)
+    ra = (pointing[0] + (pixels + 1 - crpix) * pixelsize) % 360
+    dec = pointing[1] + (pixels + 1 - crpix) * pixelsize
+    ra, dec = np.meshgrid(ra, dec)
+    heatmap = grid.bin(ra.ravel(), dec.ravel())
+    assert heatmap.shape == (grid.nbins, grid.nbins)
+    assert np.all(heatmap == 1)
+
+def test_sky_grid_matches_histogram2d():
+    rng = np.random.default_rng(1)
+    ra, dec = rng.normal(83.63, 1, 10000), rng.normal(22.01, 1, 10000)
+    grid = get_sky_grid(ra=83.63, dec=22.01, maproi=2.5, pixelsize=0.02)
+    extent = grid.get_extent()
+    expected = np.histogram2d(ra, dec, bins=grid.nbins, range=[[extent[0], extent[1]], [extent[2], extent[3]]])[0].T
+    assert np.array_equal(grid.bin(ra, dec), expected)
+
+def test_sky_grid_from_extent():
+    grid = get_sky_grid_from_extent(extent=[80, 85, 20, 25], bins=250)
+    assert grid.nbins == 250
+    assert grid.ra == 82.5
+    assert grid.dec == 22.5
+    assert grid.get_extent() == [80, 85, 20, 25]
@@ -0,0 +1,92 @@
+# *****************************************************************************
+# Copyright (C) 2023 Ambra Di Piano
+# This software is distributed under the terms of the BSD-3-Clause license
+#
+# Authors:
+# Ambra Di Piano <ambra.dipiano@inaf.it>
+# *****************************************************************************
+
+import pytest
+import numpy as np
+from os import listdir, stat, umask
+from os.path import join
+from shutil import rmtree
+from astrort.utils.dataset import DatasetWriter, MapDataset, open_dataset, close_datasets, build_dataset_index
+
+def get_map(seed, exposure=0):
+    return np.full((20, 20), seed + exposure / 100)
+
+@pytest.mark.test_tmp_folder
+@pytest.mark.parametrize('compression', [None, 'zlib'])
+def test_map_dataset(test_tmp_folder, compression):
+    folder = join(test_tmp_folder, 'test_dataset')
+    rmtree(folder, ignore_errors=True)
+    # two writers with interleaved seeds, as two jobs would
+    writers = [DatasetWriter(folder, prefix=f'job_{job}', shard=4, compression=compression) for job in [1, 2]]
+    for seed in range(1, 22):
+        writers[seed % 2].write(seed, get_map(seed))
+    for writer in writers:
+        writer.close()
+    assert sorted(f for f in listdir(folder) if f.endswith('.npy')) == [f'job_{job}_{n:06d}.npy' for job in [1, 2] for n in range(3)]
+    dataset = MapDataset(folder)
+    assert len(dataset) == 21
+    assert 7 in dataset and 22 not in dataset
+    assert np.array_equal(dataset.get(7), get_map(7))
+    batch = dataset.get_batch([21, 2, 13])
+    assert np.array_equal(batch, np.array([get_map(21), get_map(2), get_map(13)]))
+    with pytest.raises(KeyError):
+        dataset.get(22)
+    # a later run appends new shards, picked up by the reader
+    writer = DatasetWriter(folder, prefix='job_1', shard=4, compression=compression)
+    writer.write(22, get_map(22)).close()
+    assert 'job_1_000003.npy' in listdir(folder)
+    assert np.array_equal(MapDataset(folder).get(22), get_map(22))
+    rmtree(folder)
+
+@pytest.mark.test_tmp_folder
+def test_open_dataset_exposures(test_tmp_folder):
+    folder = join(test_tmp_folder, 'test_dataset_exposures')
+    rmtree(folder, ignore_errors=True)
+    writer = open_dataset(folder, prefix='job_1', shard=3)
+    assert open_dataset(folder) is writer
+    for seed in [1, 2]:
+        for exposure in [10, 100]:
+            writer.write(seed, get_map(seed, exposure), exposure=exposure)
+    close_datasets(folder)
+    build_dataset_index(folder)
+    dataset = MapDataset(folder)
+    assert np.array_equal(dataset.get(2, exposure=100), get_map(2, 100))
+    assert np.array_equal(dataset.get(2), get_map(2, 10))
+    assert np.array_equal(dataset.get_batch([1, 2], exposure=100), np.array([get_map(1, 100), get_map(2, 100)]))
+    # the partial shard is cut to its rows
+    assert np.load(join(folder, 'job_1_000001.npy'), mmap_mode='r').shape == (1, 20, 20)
+    rmtree(folder)
+
+@pytest.mark.test_tmp_folder
+def test_dataset_file_mode(test_tmp_folder):
+    folder = join(test_tmp_folder, 'test_dataset_mode')
+    rmtree(folder, ignore_errors=True)
+    DatasetWriter(folder, prefix='job_1', shard=2).write(1, get_map(1)).close()
+    build_dataset_index(folder)
+    mask = umask(0)
+    umask(mask)
+    # manifests and index are readable by the group as the shards are
+    for name in ['job_1_000000.json', 'index.npz']:
+        assert stat(join(folder, name)).st_mode & 0o777 == 0o666 & ~mask
+    assert not [f for f in listdir(folder) if f.startswith('tmp')]
+    rmtree(folder)
+
+@pytest.mark.test_tmp_folder
+def test_map_dataset_read_only(test_tmp_folder):
+    folder = join(test_tmp_folder, 'test_dataset_read_only')
+    rmtree(folder, ignore_errors=True)
+    DatasetWriter(folder, prefix='job_1', shard=2).write(1, get_map(1)).close()
+    # readers index the shards in memory and write nothing
+    assert np.array_equal(MapDataset(folder).get(1), get_map(1))
+    assert 'index.npz' not in listdir(folder)
+    build_dataset_index(folder)
+    index = stat(join(folder, 'index.npz')).st_mtime_ns
+    DatasetWriter(folder, prefix='job_2', shard=2).write(2, get_map(2)).close()
+    assert np.array_equal(MapDataset(folder).get(2), get_map(2))
+    assert stat(join(folder, 'index.npz')).st_mtime_ns == index
+    rmtree(folder)
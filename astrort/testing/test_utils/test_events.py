@@ -0,0 +1,62 @@
+# *****************************************************************************
+# Copyright (C) 2023 Ambra Di Piano
+# This software is distributed under the terms of the BSD-3-Clause license
+#
+# Authors:
+# Ambra Di Piano <ambra.dipiano@inaf.it>
+# *****************************************************************************
+
+import pytest
+import numpy as np
+from astropy.io import fits
+from astrort.utils.events import *
+
+@pytest.mark.test_dl3_file
+def test_read_event_list(test_dl3_file):
+    clear_event_cache()
+    events = read_event_list(test_dl3_file)
+    with fits.open(test_dl3_file) as h:
+        expected = h['EVENTS'].data
+        assert np.array_equal(events['RA'], expected['RA'])
+        assert np.array_equal(events.field('TIME'), expected['TIME'])
+    assert events.names() == list(EVENT_COLUMNS)
+    assert events.header['RA_PNT'] == 83.63
+    assert len(events) == len(expected)
+
+@pytest.mark.test_dl3_file
+def test_read_event_list_cache(test_dl3_file):
+    clear_event_cache()
+    events = read_event_list(test_dl3_file)
+    assert read_event_list(test_dl3_file) is events
+    assert cached_event_list.cache_info().hits == 1
+
+@pytest.mark.test_dl3_file
+def test_event_list_selection(test_dl3_file):
+    events = read_event_list(test_dl3_file)
+    selected = events[events['TIME'] < 10]
+    assert isinstance(selected, EventList)
+    assert len(selected) == np.count_nonzero(events['TIME'] < 10)
+    assert selected.header is events.header
+
+@pytest.mark.test_dl3_file
+def test_select_events(test_dl3_file):
+    events = read_event_list(test_dl3_file)
+    pointing = {'ra': 83.63, 'dec': 22.01}
+    index = select_events(events, pointing=pointing, trange=[0, 50], erange=[1, 100], maproi=1.5, chunk=1000)
+    expected = (events['TIME'] > 0) & (events['TIME'] < 50) & (events['ENERGY'] > 1) & (events['ENERGY'] < 100)
+    expected &= (np.abs(events['RA'] - 83.63) < 1.5) & (np.abs(events['DEC'] - 22.01) < 1.5)
+    assert np.array_equal(index, np.flatnonzero(expected))
+
+@pytest.mark.parametrize('region', ['box', 'circle', 'tangent'])
+def test_get_roi_mask_wraps_ra(region):
+    pointing = {'ra': 0.5, 'dec': 0}
+    ra = np.array([359.0, 1.5, 180.0, 0.5])
+    dec = np.array([0.0, 0.0, 0.0, 2.4])
+    mask = get_roi_mask(ra, dec, pointing=pointing, maproi=2.5, region=region)
+    assert list(mask) == [True, True, False, True]
+
+def test_get_roi_mask_circle():
+    pointing = {'ra': 10, 'dec': 89}
+    # close to the pole RA differences shrink, the angular distance stays small
+    mask = get_roi_mask(np.array([190.0, 10.0]), np.array([89.0, 85.0]), pointing=pointing, maproi=2.5, region='circle')
+    assert list(mask) == [True, False]
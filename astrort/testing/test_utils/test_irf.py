@@ -0,0 +1,57 @@
+# *****************************************************************************
+# Copyright (C) 2023 Ambra Di Piano
+# This software is distributed under the terms of the BSD-3-Clause license
+#
+# Authors:
+# Ambra Di Piano <ambra.dipiano@inaf.it>
+# *****************************************************************************
+
+import pytest
+import numpy as np
+from os import makedirs
+from os.path import join, isfile
+from shutil import rmtree
+from astrort.utils.irf import IrfCatalog, parse_irf_name, get_irf_catalog, get_irf_cache_file, clear_irf_catalogs
+
+NAMES = ['North_z20_0.5h_LST', 'North_z20_N_0.5h_LST', 'North_z40_S_5h_LST', 'North_z60_0.5h_MST', 'South_z20_0.5h', 'South_z40_N_0.5h_SST', 'South_z60_50h_MST']
+
+def test_parse_irf_name():
+    assert parse_irf_name('North_z20_N_0.5h_LST') == {'site': 'north', 'zenith': 20, 'azimuth': 'N', 'duration': 0.5, 'array': 'lst'}
+    assert parse_irf_name('South_z40_0.5h') == {'site': 'south', 'zenith': 40, 'azimuth': 'average', 'duration': 0.5, 'array': 'south'}
+    assert np.isnan(parse_irf_name('README')['zenith'])
+
+@pytest.mark.parametrize('array', ['lst', 'mst', 'sst', 'north', 'south'])
+@pytest.mark.parametrize('filter', [None, 'z20', 'z40_N'])
+def test_irf_catalog_select(array, filter):
+    catalog = IrfCatalog('test', NAMES)
+    expected = [i for i in NAMES if array.lower() in i.lower() and '0.5h' in i.lower() and (filter is None or filter.lower() in i.lower())]
+    assert catalog.select(array, filter=filter) == expected
+
+def test_irf_catalog_query_sample():
+    catalog = IrfCatalog('test', NAMES)
+    assert catalog.query(site='North', zenith=20) == ['North_z20_0.5h_LST', 'North_z20_N_0.5h_LST']
+    assert catalog.query(azimuth='average', duration=0.5) == ['North_z20_0.5h_LST', 'North_z60_0.5h_MST', 'South_z20_0.5h']
+    irfs = catalog.sample('lst', 1000, rng=np.random.default_rng(1))
+    assert len(irfs) == 1000
+    assert set(irfs) == {'North_z20_0.5h_LST', 'North_z20_N_0.5h_LST'}
+    with pytest.raises(IndexError):
+        catalog.sample('cta', 10)
+
+@pytest.mark.test_tmp_folder
+def test_get_irf_catalog(test_tmp_folder, monkeypatch):
+    caldb = join(test_tmp_folder, 'caldb')
+    rmtree(caldb, ignore_errors=True)
+    for name in NAMES:
+        makedirs(join(caldb, 'data/cta/test-prod/bcf', name))
+    monkeypatch.setenv('CALDB', caldb)
+    monkeypatch.setenv('ASTRORT_CACHE', join(caldb, 'cache'))
+    clear_irf_catalogs()
+    catalog = get_irf_catalog('test-prod')
+    assert sorted(catalog.names) == sorted(NAMES)
+    assert isfile(get_irf_cache_file('test-prod'))
+    assert get_irf_catalog('test-prod') is catalog
+    # a new production folder content invalidates the cache
+    clear_irf_catalogs()
+    makedirs(join(caldb, 'data/cta/test-prod/bcf', 'South_z20_0.5h_LST'))
+    assert 'South_z20_0.5h_LST' in get_irf_catalog('test-prod').names
+    clear_irf_catalogs()
@@ -0,0 +1,106 @@
+# *****************************************************************************
+# Copyright (C) 2023 Ambra Di Piano
+# This software is distributed under the terms of the BSD-3-Clause license
+#
+# Authors:
+# Ambra Di Piano <ambra.dipiano@inaf.it>
+# *****************************************************************************
+
+import pytest
+import numpy as np
+import pandas as pd
+from os import makedirs
+from os.path import join
+from shutil import rmtree
+from astropy.io import fits
+from astrort.utils.loader import MapLoader, get_map_source, get_cleaner_loader
+from astrort.utils.dataset import DatasetWriter, build_dataset_index
+
+def get_map(seed, clean=False):
+    return np.full((10, 10), seed + (0.5 if clean else 0))
+
+def write_maps(folder, seeds, ext, clean=False):
+    makedirs(folder, exist_ok=True)
+    for seed in seeds:
+        filename = join(folder, f'crab_{seed:03d}_map.{ext}')
+        if ext == 'npy':
+            np.save(filename, get_map(seed, clean))
+        else:
+            fits.PrimaryHDU(data=get_map(seed, clean)).writeto(filename, overwrite=True)
+    return folder
+
+@pytest.mark.test_tmp_folder
+@pytest.mark.parametrize('ext', ['npy', 'fits'])
+@pytest.mark.parametrize('shuffle', [False, True])
+def test_map_loader(test_tmp_folder, ext, shuffle):
+    folder = join(test_tmp_folder, 'test_loader')
+    rmtree(folder, ignore_errors=True)
+    write_maps(folder, range(1, 11), ext)
+    loader = MapLoader(folder, batch=4, shuffle=shuffle, seed=1, threads=2, prefetch=1)
+    assert len(loader) == 3
+    seen = []
+    for seeds, maps in loader:
+        assert maps.shape == (len(seeds), 10, 10)
+        assert np.array_equal(maps[:, 0, 0], seeds)
+        seen += seeds.tolist()
+    assert sorted(seen) == list(range(1, 11))
+    assert (seen != list(range(1, 11))) == shuffle
+    assert loader.stats['maps'] == 10
+    assert loader.get_throughput()['maps/s'] > 0
+    rmtree(folder)
+
+@pytest.mark.test_tmp_folder
+def test_cleaner_loader(test_tmp_folder):
+    folder = join(test_tmp_folder, 'test_loader_cleaner')
+    rmtree(folder, ignore_errors=True)
+    write_maps(join(folder, 'noisy'), range(1, 8), 'fits')
+    write_maps(join(folder, 'clean'), range(2, 9), 'fits', clean=True)
+    loader = get_cleaner_loader(folder, batch=3, drop_last=True)
+    assert len(loader) == 2
+    for seeds, noisy, clean in loader:
+        assert np.array_equal(noisy[:, 0, 0], seeds)
+        assert np.array_equal(clean[:, 0, 0], seeds + 0.5)
+    assert loader.stats['maps'] == 6
+    rmtree(folder)
+
+@pytest.mark.test_tmp_folder
+def test_get_map_source(test_tmp_folder):
+    folder = join(test_tmp_folder, 'test_loader_sources')
+    rmtree(folder, ignore_errors=True)
+    makedirs(folder)
+    # stacked maps with their seed table
+    npyname = join(folder, 'job_1_mapper_stack.npy')
+    np.save(npyname, np.array([get_map(seed) for seed in [5, 6, 7]]))
+    pd.DataFrame({'row': [0, 1, 2], 'seed': [5, 6, 7]}).to_csv(npyname.replace('.npy', '.dat'), sep=' ', index=False)
+    source = get_map_source(npyname)
+    assert np.array_equal(source.seeds, [5, 6, 7])
+    assert np.array_equal(source.read(6), get_map(6))
+    # sharded dataset
+    dataset = join(folder, 'crab_dataset')
+    writer = DatasetWriter(dataset, prefix='job_1', shard=2)
+    for seed in [3, 1, 2]:
+        writer.write(seed, get_map(seed))
+    writer.close()
+    build_dataset_index(dataset)
+    source = get_map_source(dataset)
+    assert np.array_equal(source.seeds, [1, 2, 3])
+    assert np.array_equal(source.read(3), get_map(3))
+    with pytest.raises(ValueError):
+        get_map_source(join(folder, 'missing.fits'))
+    rmtree(folder)
+
+@pytest.mark.test_tmp_folder
+def test_file_source_exposures(test_tmp_folder):
+    folder = join(test_tmp_folder, 'test_loader_exposures')
+    rmtree(folder, ignore_errors=True)
+    makedirs(folder)
+    for seed in [1, 2]:
+        for exposure in [10, 100]:
+            np.save(join(folder, f'crab_{seed:03d}_map_{exposure}s.npy'), get_map(seed) + exposure)
+    # one map per seed only once the exposure is given
+    with pytest.raises(ValueError):
+        get_map_source(folder)
+    source = get_map_source(folder, exposure=100)
+    assert np.array_equal(source.seeds, [1, 2])
+    assert np.array_equal(source.read(2), get_map(2) + 100)
+    rmtree(folder)
@@ -0,0 +1,91 @@
+# *****************************************************************************
+# Copyright (C) 2023 Ambra Di Piano
+# This software is distributed under the terms of the BSD-3-Clause license
+#
+# Authors:
+# Ambra Di Piano <ambra.dipiano@inaf.it>
+# *****************************************************************************
+
+import pytest
+import logging
+import numpy as np
+import pandas as pd
+from astropy.io import fits
+from shutil import copy
+from os import listdir, stat, umask
+from os.path import join, isfile
+from astrort.utils.mapping import Mapper
+from astrort.utils.utils import map_template
+from astrort.configure.logging import set_logger
+
+@pytest.mark.test_dl3_file
+@pytest.mark.test_tmp_folder
+@pytest.mark.parametrize('memmap', [True, False])
+def test_get_countmaps_in_stack(test_dl3_file, test_tmp_folder, memmap):
+    log = set_logger(logging.CRITICAL)
+    mapper = Mapper(log)
+    npyname = join(test_tmp_folder, 'test_stack.npy')
+    renewed = []
+    stack = mapper.get_countmaps_in_stack(dl3_files=[test_dl3_file]*3, seeds=[1, 2, 3], maproi=2.5, pixelsize=0.05, trange=[0, 10], sigma=0, npyname=npyname, memmap=memmap, renew=lambda: renewed.append(1))
+    # the queue lease is renewed for each seed
+    assert len(renewed) == 3
+    single, hdr = mapper.get_countmap(dl3_file=test_dl3_file, maproi=2.5, pixelsize=0.05, trange=[0, 10], sigma=0)
+    assert stack.shape == (3, 100, 100)
+    assert np.array_equal(np.load(npyname)[2], single)
+    table = pd.read_csv(npyname.replace('.npy', '.dat'), sep=' ')
+    assert list(table['seed']) == [1, 2, 3]
+    assert list(table['row']) == [0, 1, 2]
+    assert table['point_ra'][0] == hdr['CRVAL1']
+
+@pytest.mark.test_dl3_file
+@pytest.mark.test_tmp_folder
+def test_get_countmap_in_fits(test_dl3_file, test_tmp_folder):
+    log = set_logger(logging.CRITICAL)
+    mapper = Mapper(log)
+    fitsname = join(test_tmp_folder, 'test_map.fits')
+    mapper.get_countmap_in_fits(dl3_file=test_dl3_file, template=map_template(), fitsname=fitsname, maproi=2.5, pixelsize=0.02, trange=[0, 10], sigma=1)
+    # same file as updating a copy of the template in place
+    legacy = join(test_tmp_folder, 'test_map_legacy.fits')
+    copy(map_template(), legacy)
+    dl4_data, hdr_fits = mapper.get_countmap(dl3_file=test_dl3_file, maproi=2.5, pixelsize=0.02, trange=[0, 10], sigma=1)
+    mapper.set_dl4_hdr(dl4_file=legacy, hdr_fits=hdr_fits)
+    mapper.set_dl4_data(dl4_file=legacy, data=dl4_data)
+    with open(fitsname, 'rb') as f, open(legacy, 'rb') as g:
+        assert f.read() == g.read()
+    assert len([f for f in listdir(test_tmp_folder) if '.fits.tmp' in f]) == 0
+    # same permissions as any file created with the process umask
+    umask_value = umask(0)
+    umask(umask_value)
+    assert stat(fitsname).st_mode & 0o777 == 0o666 & ~umask_value
+
+@pytest.mark.test_dl3_file
+@pytest.mark.parametrize('sigma', [0, 1])
+def test_get_countmaps_by_exposure(test_dl3_file, sigma):
+    log = set_logger(logging.CRITICAL)
+    mapper = Mapper(log)
+    exposures = [30, 10, 100]
+    maps, hdr = mapper.get_countmaps_by_exposure(dl3_file=test_dl3_file, exposures=exposures, maproi=2.5, pixelsize=0.05, sigma=sigma)
+    assert list(maps.keys()) == sorted(exposures)
+    for exposure in exposures:
+        single, single_hdr = mapper.get_countmap(dl3_file=test_dl3_file, maproi=2.5, pixelsize=0.05, trange=[0, exposure], sigma=sigma)
+        assert np.array_equal(maps[exposure], single)
+        assert single_hdr == hdr
+
+@pytest.mark.test_dl3_file
+@pytest.mark.test_tmp_folder
+@pytest.mark.parametrize('ebins', [4, [0.03, 0.1, 1, 10, 150]])
+def test_get_countcube_in_fits(test_dl3_file, test_tmp_folder, ebins):
+    log = set_logger(logging.CRITICAL)
+    mapper = Mapper(log)
+    cube, edges, hdr = mapper.get_countcube(dl3_file=test_dl3_file, ebins=ebins, maproi=2.5, pixelsize=0.05, trange=[0, 100], sigma=0)
+    single, hdr = mapper.get_countmap(dl3_file=test_dl3_file, maproi=2.5, pixelsize=0.05, trange=[0, 100], erange=[edges[0], edges[-1]], sigma=0)
+    assert cube.shape == (4, 100, 100)
+    assert np.array_equal(cube.sum(axis=0), single)
+    fitsname = join(test_tmp_folder, 'test_cube.fits')
+    mapper.write_countcube_in_fits(cube=cube, edges=edges, hdr_fits=hdr, template=map_template(), fitsname=fitsname)
+    with fits.open(fitsname) as h:
+        assert h[0].header['NAXIS'] == 3
+        assert h[0].header['CRVAL1'] == hdr['CRVAL1']
+        assert np.array_equal(h[0].data, cube)
+        assert np.allclose(h['ENERGIES'].data['E_MIN'], edges[:-1])
+        assert np.allclose(h['ENERGIES'].data['E_MAX'], edges[1:])
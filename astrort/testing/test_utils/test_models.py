@@ -0,0 +1,52 @@
+# *****************************************************************************
+# Copyright (C) 2023 Ambra Di Piano
+# This software is distributed under the terms of the BSD-3-Clause license
+#
+# Authors:
+# Ambra Di Piano <ambra.dipiano@inaf.it>
+# *****************************************************************************
+
+import pytest
+from os.path import join, dirname, abspath
+from xml.etree import ElementTree
+from astrort.utils.models import ModelTemplate, get_model_template, get_model_tmpfile
+
+def get_template_file(name):
+    return join(dirname(abspath(__file__)).replace(join('testing', 'test_utils'), 'templates'), name)
+
+def get_source_parameters(xml, source='crab'):
+    root = ElementTree.fromstring(xml)
+    for src in root.iter('source'):
+        if src.attrib['name'] == source:
+            return {p.attrib['name']: p.attrib for p in src.iter('parameter')}
+
+@pytest.mark.parametrize('model', ['crab.xml', 'crab_only.xml'])
+def test_model_template(model):
+    template = ModelTemplate(get_template_file(model), 'crab')
+    assert template.get_ra_dec() == (83.6331, 22.0145)
+    parameters = get_source_parameters(template.render(145.36, -21.92))
+    assert float(parameters['RA']['value']) == 145.36
+    assert float(parameters['DEC']['value']) == -21.92
+    # the rest of the model is untouched
+    assert parameters['Index']['value'] == '2.48'
+    assert get_source_parameters(template.render(1, 2))['RA']['value'] == '1.0'
+
+@pytest.mark.test_tmp_folder
+def test_model_template_scale(test_tmp_folder):
+    model = join(test_tmp_folder, 'test_scaled.xml')
+    with open(get_template_file('crab.xml')) as f:
+        text = f.read().replace('<parameter name="RA"  scale="1.0" value="83.6331"', '<parameter name="RA"  scale="10.0" value="8.36331"')
+    with open(model, 'w+') as f:
+        f.write(text)
+    template = get_model_template(model, 'crab')
+    assert template.get_ra_dec()[0] == pytest.approx(83.6331)
+    assert float(get_source_parameters(template.render(100, 10))['RA']['value']) == 10
+    assert get_model_template(model, 'crab') is template
+
+def test_model_template_missing_source():
+    with pytest.raises(ValueError):
+        ModelTemplate(get_template_file('crab.xml'), 'vela')
+
+def test_get_model_tmpfile():
+    assert get_model_tmpfile('crab') == get_model_tmpfile('crab')
+    assert get_model_tmpfile('crab').endswith('_crab.xml')
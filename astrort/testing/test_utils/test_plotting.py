@@ -0,0 +1,60 @@
+# *****************************************************************************
+# Copyright (C) 2023 Ambra Di Piano
+# This software is distributed under the terms of the BSD-3-Clause license
+#
+# Authors:
+# Ambra Di Piano <ambra.dipiano@inaf.it>
+# *****************************************************************************
+
+import pytest
+import numpy as np
+from os import makedirs
+from os.path import join, isfile
+from shutil import rmtree
+from astropy.io import fits
+from astropy.wcs import WCS
+from astrort.utils.plotting import SkymapBatchPlotter, plot_skymaps, plot_contact_sheets
+
+def write_skymaps(folder, seeds, nbins=20):
+    makedirs(folder, exist_ok=True)
+    files = []
+    for seed in seeds:
+        w = WCS(naxis=2)
+        w.wcs.ctype = ['RA---CAR', 'DEC--CAR']
+        w.wcs.crpix = [nbins/2+0.5, nbins/2+0.5]
+        w.wcs.crval = [83.63 + seed, 22.01]
+        w.wcs.cdelt = [0.02, 0.02]
+        hdu = fits.ImageHDU(np.random.default_rng(seed).poisson(1, (nbins, nbins)).astype(float), header=w.to_header(), name='SKYMAP')
+        files.append(join(folder, f'crab_{seed:03d}_map.fits'))
+        fits.HDUList([fits.PrimaryHDU(), hdu]).writeto(files[-1], overwrite=True)
+    return files
+
+@pytest.mark.test_tmp_folder
+def test_batch_plotter(test_tmp_folder):
+    folder = join(test_tmp_folder, 'test_plotting')
+    rmtree(folder, ignore_errors=True)
+    files = write_skymaps(folder, range(1, 4)) + write_skymaps(folder, range(4, 6), nbins=30)
+    plotter = SkymapBatchPlotter(figsize=(4, 4), fontsize=8)
+    plotmaps = plotter.plot_files(files)
+    # one canvas per geometry
+    assert len(plotter.canvases) == 2
+    assert plotter.canvases[0].img.get_array().shape == (20, 20)
+    assert np.array_equal(plotter.canvases[0].wcs.wcs.crval, [83.63 + 3, 22.01])
+    assert all(isfile(plotmap) for plotmap in plotmaps)
+    assert plotmaps[0] == files[0].replace('.fits', '.png')
+    plotter.close()
+    assert len(plotter.canvases) == 0
+    rmtree(folder)
+
+@pytest.mark.test_tmp_folder
+def test_plot_skymaps_and_sheets(test_tmp_folder):
+    folder = join(test_tmp_folder, 'test_plotting')
+    rmtree(folder, ignore_errors=True)
+    files = write_skymaps(folder, range(1, 6))
+    plotmaps = plot_skymaps(files, processes=2, figsize=(4, 4))
+    assert plotmaps == [f.replace('.fits', '.png') for f in files]
+    assert all(isfile(plotmap) for plotmap in plotmaps)
+    sheets = plot_contact_sheets(files, join(folder, 'crab'), size=4, ncols=2)
+    assert sheets == [join(folder, 'crab_sheet_0000.png'), join(folder, 'crab_sheet_0001.png')]
+    assert all(isfile(sheet) for sheet in sheets)
+    rmtree(folder)
@@ -0,0 +1,163 @@
+# *****************************************************************************
+# Copyright (C) 2023 Ambra Di Piano
+# This software is distributed under the terms of the BSD-3-Clause license
+#
+# Authors:
+# Ambra Di Piano <ambra.dipiano@inaf.it>
+# *****************************************************************************
+
+import sys
+import pytest
+import signal
+import logging
+import subprocess
+import pandas as pd
+from os import remove, stat, umask, getpid
+from os.path import join, isfile, isdir
+from shutil import rmtree
+from astrort.utils.records import open_records, close_records, flush_records, write_record, WRITERS, read_records, merge_record_folders, merge_record_tables, get_record_folder, get_record_parts, MAPPING_COLUMNS
+from astrort.configure.logging import set_logger
+
+def clean_records(datfile):
+    if isfile(datfile):
+        remove(datfile)
+    if isdir(get_record_folder(datfile)):
+        rmtree(get_record_folder(datfile))
+
+@pytest.mark.test_tmp_folder
+def test_record_writer(test_tmp_folder):
+    datfile = join(test_tmp_folder, 'test_records.dat')
+    clean_records(datfile)
+    writer = open_records(datfile, MAPPING_COLUMNS, flush=3, flushtime=1e6, binary=True)
+    assert open_records(datfile, MAPPING_COLUMNS) is writer
+    assert writer.flush_rows == 3
+    for seed in range(1, 3):
+        writer.write([f'crab_{seed:02d}', seed, 10, 'pointing', 0.02, 1, 0.5])
+    assert not isfile(datfile)
+    writer.write({'name': 'crab_03', 'seed': 3, 'exposure': 10, 'center_on': 'pointing', 'pixelsize': 0.02, 'smooth': 1, 'map_time': 0.5})
+    writer.write(['crab_04', 4, 10, 'pointing', 0.02, 1, 0.5])
+    with open(datfile) as f:
+        lines = f.readlines()
+    assert lines[0] == 'name seed exposure center_on pixelsize smooth map_time\n'
+    assert lines[3] == 'crab_03 3 10 pointing 0.02 1 0.5\n'
+    assert len(lines) == 4
+    close_records(datfile)
+    table = pd.read_csv(datfile, sep=' ')
+    assert list(table['seed']) == [1, 2, 3, 4]
+    records = read_records(get_record_folder(datfile))
+    assert list(records['seed']) == [1, 2, 3, 4]
+    assert list(records['name']) == list(table['name'])
+    umask_value = umask(0)
+    umask(umask_value)
+    assert all(stat(part).st_mode & 0o777 == 0o666 & ~umask_value for part in get_record_parts(get_record_folder(datfile)))
+
+@pytest.mark.test_tmp_folder
+def test_merge_record_folders(test_tmp_folder):
+    shards = [join(test_tmp_folder, f'test_records_worker_{i}.dat') for i in range(2)]
+    clean_records(join(test_tmp_folder, 'test_merged.dat'))
+    for i, shard in enumerate(shards):
+        clean_records(shard)
+        writer = open_records(shard, MAPPING_COLUMNS, flush=10, binary=True)
+        for seed in [2+i, i]:
+            writer.write([f'crab_{seed:02d}', seed, 10, 'pointing', 0.02, 1, 0.5])
+        close_records(shard)
+    folder = merge_record_folders([get_record_folder(shard) for shard in shards], get_record_folder(join(test_tmp_folder, 'test_merged.dat')))
+    assert list(read_records(folder)['seed']) == [0, 1, 2, 3]
+
+@pytest.mark.test_tmp_folder
+def test_record_writer_signal(test_tmp_folder):
+    datfile = join(test_tmp_folder, 'test_records_signal.dat')
+    dataset = join(test_tmp_folder, 'test_records_signal_dataset')
+    clean_records(datfile)
+    rmtree(dataset, ignore_errors=True)
+    script = f"""
+import os, signal
+import numpy as np
+from astrort.utils.records import open_records, install_handlers, MAPPING_COLUMNS
+from astrort.utils.dataset import open_dataset
+install_handlers()
+writer = open_records({datfile!r}, MAPPING_COLUMNS, flush=100)
+writer.write(['crab_01', 1, 10, 'pointing', 0.02, 1, 0.5])
+open_dataset({dataset!r}, prefix='job_1').write(1, np.ones((4, 4)))
+os.kill(os.getpid(), signal.SIGTERM)
+"""
+    process = subprocess.run([sys.executable, '-c', script])
+    assert process.returncode == -signal.SIGTERM
+    assert list(pd.read_csv(datfile, sep=' ')['seed']) == [1]
+    # the partial shard is completed too
+    assert isfile(join(dataset, 'job_1_000000.json'))
+    rmtree(dataset)
+
+@pytest.mark.test_tmp_folder
+def test_flush_records(test_tmp_folder):
+    datfile = join(test_tmp_folder, 'test_records_flush.dat')
+    clean_records(datfile)
+    # rows are buffered with the same defaults as the jobs
+    open_records(datfile, MAPPING_COLUMNS).write(['crab_01', 1, 10, 'pointing', 0.02, 1, 0.5])
+    assert not isfile(datfile)
+    flush_records()
+    assert list(pd.read_csv(datfile, sep=' ')['seed']) == [1]
+    close_records(datfile)
+    clean_records(datfile)
+
+@pytest.mark.test_tmp_folder
+def test_write_record(test_tmp_folder):
+    datfile = join(test_tmp_folder, 'test_records_helper.dat')
+    clean_records(datfile)
+    # no writer is left open without the job
+    write_record(datfile, MAPPING_COLUMNS, ['crab_01', 1, 10, 'pointing', 0.02, 1, 0.5])
+    assert (getpid(), datfile) not in WRITERS
+    assert list(pd.read_csv(datfile, sep=' ')['seed']) == [1]
+    # rows go through the writer opened by the job
+    writer = open_records(datfile, MAPPING_COLUMNS, flush=10)
+    write_record(datfile, MAPPING_COLUMNS, ['crab_02', 2, 10, 'pointing', 0.02, 1, 0.5])
+    assert len(writer.rows) == 1
+    close_records(datfile)
+    assert list(pd.read_csv(datfile, sep=' ')['seed']) == [1, 2]
+    clean_records(datfile)
+
+@pytest.mark.test_tmp_folder
+@pytest.mark.parametrize('threads', [1, 3])
+def test_merge_record_tables(test_tmp_folder, threads):
+    log = set_logger(logging.CRITICAL)
+    datfiles = []
+    # job 10 repeats seed 3 and seeds 7-8 are missing
+    for job, seeds in zip([1, 2, 10], [[1, 2], [3, 4], [3, 5, 6, 9]]):
+        datfile = join(test_tmp_folder, f'test_job_{job}_mapper.dat')
+        clean_records(datfile)
+        writer = open_records(datfile, MAPPING_COLUMNS, flush=10)
+        for seed in seeds:
+            writer.write([f'crab_{seed:02d}', seed, 10, 'pointing', 0.02, 1, job])
+        close_records(datfile)
+        datfiles.append(datfile)
+    merger = join(test_tmp_folder, 'test_merged_mapper_data.dat')
+    clean_records(merger)
+    info = merge_record_tables(datfiles[::-1], merger, log, threads=threads, binary=True)
+    table = pd.read_csv(merger, sep=' ')
+    assert list(table['seed']) == [1, 2, 3, 4, 5, 6, 9]
+    assert list(table['map_time'][table['seed'] == 3]) == [2]
+    assert info == {'lines': 7, 'duplicates': 1, 'gaps': [(7, 8)]}
+    assert list(read_records(get_record_folder(merger))['seed']) == [1, 2, 3, 4, 5, 6, 9]
+
+@pytest.mark.test_tmp_folder
+def test_merge_record_tables_empty(test_tmp_folder):
+    log = set_logger(logging.CRITICAL)
+    # job 1 crashed after writing its header
+    datfiles = [join(test_tmp_folder, f'test_job_{job}_empty_mapper.dat') for job in [1, 2, 3]]
+    with open(datfiles[0], 'w') as f:
+        f.write(' '.join(MAPPING_COLUMNS) + '\n')
+    for job, datfile in zip([2, 3], datfiles[1:]):
+        clean_records(datfile)
+        writer = open_records(datfile, MAPPING_COLUMNS, flush=10)
+        for exposure in [10, 5, 10]:
+            writer.write([f'crab_{job:02d}', job, exposure, 'pointing', 0.02, 1, job])
+        close_records(datfile)
+    merger = join(test_tmp_folder, 'test_merged_empty_mapper_data.dat')
+    clean_records(merger)
+    info = merge_record_tables(datfiles, merger, log)
+    with open(merger) as f:
+        assert sum(line.startswith('name') for line in f) == 1
+    table = pd.read_csv(merger, sep=' ')
+    assert list(table['seed']) == [2, 2, 3, 3]
+    assert list(table['exposure']) == [10, 5, 10, 5]
+    assert info == {'lines': 4, 'duplicates': 2, 'gaps': []}
@@ -0,0 +1,51 @@
+# *****************************************************************************
+# Copyright (C) 2023 Ambra Di Piano
+# This software is distributed under the terms of the BSD-3-Clause license
+#
+# Authors:
+# Ambra Di Piano <ambra.dipiano@inaf.it>
+# *****************************************************************************
+
+import pytest
+import numpy as np
+from os.path import join
+from astrort.utils.replica import load_replica_plan, convert_replica_plan, is_replica_store
+
+def write_replica_table(folder):
+    datfile = join(folder, 'test_replica.dat')
+    with open(datfile, 'w+') as f:
+        f.write('name seed point_ra point_dec source_ra source_dec irf\n')
+        for seed in [3, 1, 2, 5, 4, 2]:
+            f.write(f'crab_{seed:03d} {seed} {seed*10.5} {seed*-1.5} {seed*10} {seed*-1} South_z{seed}_0.5h\n')
+    return datfile
+
+@pytest.mark.test_tmp_folder
+@pytest.mark.parametrize('store', [False, True])
+def test_load_replica_plan(test_tmp_folder, store):
+    datfile = write_replica_table(test_tmp_folder)
+    if store:
+        datfile = convert_replica_plan(datfile, join(test_tmp_folder, 'test_replica'))
+        assert is_replica_store(datfile)
+    plan = load_replica_plan(datfile)
+    assert len(plan) == 6
+    assert np.all(np.diff(plan.seeds) >= 0)
+    row = plan.row(5)
+    assert row['name'] == 'crab_005'
+    assert row['point_ra'] == 52.5
+    assert row['irf'] == 'South_z5_0.5h'
+    assert type(row['irf']) == str
+    assert plan.get(3, 'source_dec') == -3
+    with pytest.raises(KeyError):
+        plan.row(6)
+
+@pytest.mark.test_tmp_folder
+@pytest.mark.parametrize('store', [False, True])
+def test_load_replica_plan_seeds(test_tmp_folder, store):
+    datfile = write_replica_table(test_tmp_folder)
+    if store:
+        datfile = convert_replica_plan(datfile, join(test_tmp_folder, 'test_replica'))
+    plan = load_replica_plan(datfile, seeds=[2, 3, 4])
+    assert list(plan.seeds) == [2, 2, 3, 4]
+    assert 1 not in plan
+    assert 4 in plan
+    assert plan.get(2, 'point_dec') == -3
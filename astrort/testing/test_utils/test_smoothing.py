@@ -0,0 +1,52 @@
+# *****************************************************************************
+# Copyright (C) 2023 Ambra Di Piano
+# This software is distributed under the terms of the BSD-3-Clause license
+#
+# Authors:
+# Ambra Di Piano <ambra.dipiano@inaf.it>
+# *****************************************************************************
+
+import pytest
+import numpy as np
+from scipy.ndimage import gaussian_filter
+from astrort.utils.smoothing import GaussianSmoother, smooth_map, smooth_pixels, smooth_stack
+
+def get_counts(nbins, events, seed=1):
+    rng = np.random.default_rng(seed)
+    pixels = rng.integers(0, nbins*nbins, events)
+    # events on the borders and corners
+    pixels[:4] = [0, nbins-1, nbins*(nbins-1), nbins*nbins-1]
+    return pixels, np.bincount(pixels, minlength=nbins*nbins).astype(np.float64).reshape(nbins, nbins)
+
+@pytest.mark.parametrize('sigma', [0.5, 1, 2.5])
+@pytest.mark.parametrize('nbins', [50, 250])
+def test_splat(sigma, nbins):
+    pixels, heatmap = get_counts(nbins, 100)
+    smoother = GaussianSmoother(sigma)
+    assert np.allclose(smoother.splat(heatmap), gaussian_filter(heatmap, sigma=sigma), rtol=0, atol=1e-14)
+    assert np.allclose(smoother.splat_pixels(pixels, heatmap.shape), gaussian_filter(heatmap, sigma=sigma), rtol=0, atol=1e-14)
+
+@pytest.mark.parametrize('sigma', [0, 1, 3])
+@pytest.mark.parametrize('events', [10, 300, 20000])
+def test_smooth_map(sigma, events):
+    pixels, heatmap = get_counts(250, events)
+    expected = gaussian_filter(heatmap, sigma=sigma) if sigma != 0 else heatmap
+    assert np.allclose(smooth_map(heatmap, sigma), expected, rtol=0, atol=1e-14)
+    assert np.allclose(smooth_pixels(pixels, heatmap.shape, sigma), expected, rtol=0, atol=1e-14)
+
+def test_smooth_stack():
+    stack = np.array([get_counts(100, events, seed=events)[1] for events in [5, 50, 5000, 20000]])
+    expected = np.array([gaussian_filter(heatmap, sigma=1) for heatmap in stack])
+    assert np.allclose(smooth_stack(stack, 1), expected, rtol=0, atol=1e-14)
+    # dense maps go through the same filter as scipy
+    assert np.array_equal(smooth_stack(stack[2:], 1), expected[2:])
+    smooth_stack(stack, 1, out=stack)
+    assert np.allclose(stack, expected, rtol=0, atol=1e-14)
+
+def test_smooth_stack_no_sigma():
+    stack = np.array([get_counts(100, events, seed=events)[1] for events in [5, 5000]])
+    assert smooth_stack(stack, 0) is stack
+    # the counts are copied into a separate output
+    out = np.zeros(stack.shape)
+    assert smooth_stack(stack, 0, out=out) is out
+    assert np.array_equal(out, stack)
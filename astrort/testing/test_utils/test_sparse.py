@@ -0,0 +1,61 @@
+# *****************************************************************************
+# Copyright (C) 2023 Ambra Di Piano
+# This software is distributed under the terms of the BSD-3-Clause license
+#
+# Authors:
+# Ambra Di Piano <ambra.dipiano@inaf.it>
+# *****************************************************************************
+
+import pytest
+import logging
+import numpy as np
+from os.path import join
+from astrort.utils.mapping import Mapper
+from astrort.utils.sparse import read_sparse_map, densify_sparse_map, read_sparse_batch
+from astrort.configure.logging import set_logger
+
+@pytest.mark.test_dl3_file
+@pytest.mark.test_tmp_folder
+@pytest.mark.parametrize('sigma', [0, 1])
+@pytest.mark.parametrize('trange', [[0, 1], [0, 100]])
+def test_get_countmap_in_sparse(test_dl3_file, test_tmp_folder, sigma, trange):
+    log = set_logger(logging.CRITICAL)
+    mapper = Mapper(log)
+    npzname = join(test_tmp_folder, 'test_sparse.npz')
+    mapper.get_countmap_in_sparse(dl3_file=test_dl3_file, maproi=2.5, pixelsize=0.02, trange=trange, sigma=sigma, npzname=npzname)
+    dense, hdr = mapper.get_countmap(dl3_file=test_dl3_file, maproi=2.5, pixelsize=0.02, trange=trange, sigma=sigma)
+    sparse = read_sparse_map(npzname)
+    assert sparse['shape'] == (250, 250)
+    assert sparse['sigma'] == sigma
+    assert sparse['header']['CRVAL1'] == hdr['CRVAL1']
+    assert sparse['counts'].dtype == np.uint32
+    assert np.allclose(densify_sparse_map(npzname), dense, rtol=0, atol=1e-14)
+    counts, hdr = mapper.get_countmap(dl3_file=test_dl3_file, maproi=2.5, pixelsize=0.02, trange=trange, sigma=0)
+    assert np.array_equal(densify_sparse_map(sparse, smooth=False), counts)
+
+@pytest.mark.test_dl3_file
+@pytest.mark.test_tmp_folder
+def test_read_sparse_batch(test_dl3_file, test_tmp_folder):
+    log = set_logger(logging.CRITICAL)
+    mapper = Mapper(log)
+    npznames = [join(test_tmp_folder, f'test_sparse_{exposure}.npz') for exposure in [1, 10, 100]]
+    for npzname, exposure in zip(npznames, [1, 10, 100]):
+        mapper.get_countmap_in_sparse(dl3_file=test_dl3_file, maproi=2.5, pixelsize=0.05, trange=[0, exposure], sigma=1, npzname=npzname)
+    buffer = np.full((4, 100, 100), np.nan)
+    batch = read_sparse_batch(npznames, out=buffer[1:])
+    assert np.all(np.isnan(buffer[0]))
+    for i, exposure in enumerate([1, 10, 100]):
+        dense, hdr = mapper.get_countmap(dl3_file=test_dl3_file, maproi=2.5, pixelsize=0.05, trange=[0, exposure], sigma=1)
+        assert np.allclose(batch[i], dense, rtol=0, atol=1e-14)
+    assert read_sparse_batch(npznames).shape == (3, 100, 100)
+
+@pytest.mark.test_dl3_file
+@pytest.mark.test_tmp_folder
+def test_get_countcube_in_sparse(test_dl3_file, test_tmp_folder):
+    log = set_logger(logging.CRITICAL)
+    mapper = Mapper(log)
+    npzname = join(test_tmp_folder, 'test_sparse_cube.npz')
+    mapper.get_countcube_in_sparse(dl3_file=test_dl3_file, ebins=3, maproi=2.5, pixelsize=0.05, trange=[0, 100], sigma=1, npzname=npzname)
+    cube, edges, hdr = mapper.get_countcube(dl3_file=test_dl3_file, ebins=3, maproi=2.5, pixelsize=0.05, trange=[0, 100], sigma=1)
+    assert np.allclose(densify_sparse_map(npzname), cube, rtol=0, atol=1e-14)
+    assert np.array_equal(read_sparse_map(npzname)['energies'], edges)
@@ -0,0 +1,51 @@
+# *****************************************************************************
+# Copyright (C) 2023 Ambra Di Piano
+# This software is distributed under the terms of the BSD-3-Clause license
+#
+# Authors:
+# Ambra Di Piano <ambra.dipiano@inaf.it>
+# *****************************************************************************
+
+import pytest
+import numpy as np
+import matplotlib as mpl
+import matplotlib.pyplot as plt
+from os import makedirs
+from os.path import join, isfile
+from shutil import rmtree
+from matplotlib.colors import SymLogNorm, Normalize
+from astrort.utils.thumbnail import get_colormap_lut, render_thumbnail, render_thumbnails, write_png
+
+def get_map(seed=1):
+    rng = np.random.default_rng(seed)
+    return rng.poisson(3, (40, 50)) * rng.uniform(0, 10, (40, 50))
+
+@pytest.mark.parametrize('cmap', ['CMRmap', 'gray'])
+def test_colormap_lut(cmap):
+    assert np.array_equal(get_colormap_lut(cmap), mpl.colormaps[cmap](np.arange(256), bytes=True)[:, :3])
+
+@pytest.mark.parametrize('norm', ['symlog', 'linear'])
+def test_render_thumbnail(norm):
+    heatmap = get_map()
+    scaled = SymLogNorm(1, base=10)(heatmap) if norm == 'symlog' else Normalize()(heatmap)
+    expected = mpl.colormaps['CMRmap'](scaled, bytes=True)[..., :3][::-1]
+    assert np.array_equal(render_thumbnail(heatmap, norm=norm), expected)
+    assert render_thumbnail(heatmap, scale=2).shape == (80, 100, 3)
+    assert np.all(render_thumbnail(np.zeros((5, 5))) == get_colormap_lut()[0])
+
+@pytest.mark.test_tmp_folder
+def test_render_thumbnails(test_tmp_folder):
+    folder = join(test_tmp_folder, 'test_thumbnail')
+    rmtree(folder, ignore_errors=True)
+    makedirs(folder)
+    rgb = render_thumbnail(get_map())
+    assert np.array_equal((plt.imread(write_png(join(folder, 'map.png'), rgb)) * 255).round().astype(np.uint8), rgb)
+    files = []
+    for seed in range(1, 4):
+        files.append(join(folder, f'crab_{seed:03d}_map.npy'))
+        np.save(files[-1], get_map(seed))
+    thumbnails = render_thumbnails(files)
+    assert thumbnails == [f.replace('.npy', '.png') for f in files]
+    assert all(isfile(thumbnail) for thumbnail in thumbnails)
+    assert render_thumbnails([get_map()], names=[join(folder, 'array.png')]) == [join(folder, 'array.png')]
+    rmtree(folder)
@@ -8,7 +8,8 @@
 
 import pytest
 import numpy as np
-from os.path import isdir
+from os.path import isdir, join
+from shutil import rmtree
 from astrort.utils.utils import *
 from astrort.utils.wrap import *
 
@@ -111,3 +112,42 @@ def test_get_all_seeds(start):
     assert start+5 in seed
     assert start+15 in seed
 
+@pytest.mark.parametrize('workers', [1, 3, 7])
+def test_split_seeds(workers):
+    seeds = np.arange(1, 21)
+    chunks = split_seeds(seeds, workers)
+    assert len(chunks) == workers
+    assert np.array_equal(np.concatenate(chunks), seeds)
+
+def test_get_worker_datfile():
+    assert get_worker_datfile('out/job_1_simulator.dat', 0) == 'out/job_1_simulator_worker_1.dat'
+
+@pytest.mark.test_tmp_folder
+def test_seeds_to_string_formatter_files_suffix(test_tmp_folder):
+    name = seeds_to_string_formatter_files(10, test_tmp_folder, name='test', seed=1, ext='npy', suffix='map_10s')
+    assert name == f"{test_tmp_folder}/test_001_map_10s.npy"
+
+
+@pytest.mark.test_tmp_folder
+def test_get_worker_datfiles(test_tmp_folder):
+    datfile = join(test_tmp_folder, 'job_1_test.dat')
+    for worker in [1, 0]:
+        open(get_worker_datfile(datfile, worker), 'w+').close()
+    assert get_worker_datfiles(datfile) == [get_worker_datfile(datfile, 0), get_worker_datfile(datfile, 1)]
+
+@pytest.mark.test_conf_file
+def test_get_fused_datfile(test_conf_file):
+    conf = load_yaml_conf(test_conf_file)
+    datfile = get_fused_datfile(conf, join('out', 'job_1_simulator_worker_2.dat'))
+    assert datfile == join(conf['mapper']['output'], 'job_1_mapper_worker_2.dat')
+
+def test_keep_fused_dl3():
+    kept = [seed for seed in range(1, 1001) if keep_fused_dl3(seed, 0.1)]
+    assert kept == [seed for seed in range(1, 1001) if keep_fused_dl3(seed, 0.1)]
+    assert 50 < len(kept) < 150
+    assert not any(keep_fused_dl3(seed, 0) for seed in range(1, 101))
+
+def test_get_fused_folder():
+    folder = get_fused_folder()
+    assert isdir(folder)
+    rmtree(folder)
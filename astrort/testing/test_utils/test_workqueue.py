@@ -0,0 +1,127 @@
+# *****************************************************************************
+# Copyright (C) 2023 Ambra Di Piano
+# This software is distributed under the terms of the BSD-3-Clause license
+#
+# Authors:
+# Ambra Di Piano <ambra.dipiano@inaf.it>
+# *****************************************************************************
+
+import sys
+import pytest
+import signal
+import subprocess
+import numpy as np
+import pandas as pd
+from os import remove
+from os.path import join, isfile
+from multiprocessing import Pool
+from astrort.utils.workqueue import SeedQueue
+
+def get_queue(folder, name, lease=3600):
+    database = join(folder, name)
+    if isfile(database):
+        remove(database)
+    return SeedQueue(database, lease=lease)
+
+def claim_all(database):
+    queue = SeedQueue(database)
+    seeds = [seeds for batch, seeds in queue.batches()]
+    queue.close()
+    return np.concatenate(seeds) if len(seeds) > 0 else np.empty(0, dtype=int)
+
+@pytest.mark.test_tmp_folder
+def test_seed_queue(test_tmp_folder):
+    queue = get_queue(test_tmp_folder, 'test_queue.db')
+    queue.populate(np.concatenate([np.arange(1, 26), np.arange(31, 36)]), batch=10)
+    # a second populate does not add batches
+    queue.populate(np.arange(1, 100), batch=10)
+    assert queue.status() == {'todo': 4, 'claimed': 0, 'done': 0}
+    assert np.array_equal(queue.seeds(), np.concatenate([np.arange(1, 26), np.arange(31, 36)]))
+    batch, seeds = queue.claim()
+    assert list(seeds) == list(range(1, 11))
+    queue.complete(batch)
+    claimed = [list(seeds) for batch, seeds in queue.batches()]
+    assert claimed == [list(range(11, 21)), list(range(21, 26)), list(range(31, 36))]
+    assert queue.status() == {'todo': 0, 'claimed': 0, 'done': 4}
+    queue.close()
+
+@pytest.mark.test_tmp_folder
+def test_seed_queue_lease(test_tmp_folder):
+    queue = get_queue(test_tmp_folder, 'test_queue_lease.db', lease=-1)
+    queue.populate(np.arange(1, 11), batch=5)
+    first, seeds = queue.claim(owner='dead')
+    # the expired claim is handed out again
+    batch, seeds = queue.claim()
+    assert batch == first
+    queue.close()
+
+@pytest.mark.test_tmp_folder
+def test_seed_queue_release(test_tmp_folder):
+    queue = get_queue(test_tmp_folder, 'test_queue_release.db')
+    queue.populate(np.arange(1, 11), batch=5)
+    batches = queue.batches()
+    with pytest.raises(RuntimeError):
+        for batch, seeds in batches:
+            raise RuntimeError
+    batches.close()
+    # the failed batch goes back to the queue
+    assert queue.status() == {'todo': 2, 'claimed': 0, 'done': 0}
+    queue.close()
+
+@pytest.mark.test_tmp_folder
+def test_seed_queue_workers(test_tmp_folder):
+    queue = get_queue(test_tmp_folder, 'test_queue_workers.db')
+    queue.populate(np.arange(1, 201), batch=7)
+    queue.close()
+    with Pool(processes=4) as pool:
+        seeds = pool.map(claim_all, [queue.database] * 4)
+    seeds = np.sort(np.concatenate(seeds))
+    assert np.array_equal(seeds, np.arange(1, 201))
+
+@pytest.mark.test_tmp_folder
+def test_seed_queue_renew(test_tmp_folder):
+    queue = get_queue(test_tmp_folder, 'test_queue_renew.db', lease=-1)
+    queue.populate(np.arange(1, 11), batch=5)
+    first, seeds = queue.claim(owner='slow')
+    queue.lease = 3600
+    queue.renew(first, owner='slow')
+    # the renewed claim is not handed out again
+    batch, seeds = queue.claim(owner='other')
+    assert batch != first
+    # a worker that lost its lease cannot renew or complete the batch
+    queue.lease = -1
+    queue.renew(batch, owner='other')
+    taken, seeds = queue.claim(owner='new')
+    assert taken == batch
+    with pytest.raises(RuntimeError):
+        queue.renew(batch, owner='other')
+    queue.complete(batch, owner='other')
+    assert queue.status() == {'todo': 0, 'claimed': 2, 'done': 0}
+    queue.close()
+
+@pytest.mark.test_tmp_folder
+def test_seed_queue_killed_worker(test_tmp_folder):
+    queue = get_queue(test_tmp_folder, 'test_queue_killed.db')
+    queue.populate(np.arange(1, 31), batch=10)
+    datfile = join(test_tmp_folder, 'test_queue_killed.dat')
+    if isfile(datfile):
+        remove(datfile)
+    # rows are buffered as in the jobs, the worker dies right after its first batch is done
+    script = f"""
+import os, signal
+from astrort.utils.workqueue import SeedQueue
+from astrort.utils.records import open_records, flush_writers, MAPPING_COLUMNS
+queue = SeedQueue({queue.database!r})
+writer = open_records({datfile!r}, MAPPING_COLUMNS)
+for batch, seeds in queue.batches(before_complete=flush_writers):
+    if queue.status()['done'] > 0:
+        os.kill(os.getpid(), signal.SIGKILL)
+    for seed in seeds:
+        writer.write(['crab', seed, 10, 'pointing', 0.02, 1, 0.5])
+"""
+    process = subprocess.run([sys.executable, '-c', script])
+    assert process.returncode == -signal.SIGKILL
+    done = [np.arange(start, stop) for start, stop in queue.connection.execute("SELECT start, stop FROM batches WHERE status = 'done'")]
+    assert len(done) == 1
+    assert set(np.concatenate(done)) <= set(pd.read_csv(datfile, sep=' ')['seed'])
+    queue.close()
@@ -9,11 +9,16 @@
 import pytest
 import logging
 import numpy as np
+import astropy.units as u
+from os import makedirs
 from shutil import rmtree
 from astrort.utils.wrap import *
+from astrort.utils.records import open_records, close_records
 from astrort.configure.logging import set_logger
 from astrort.simulator.base_simulator import base_simulator
 from rtasci.lib.RTACtoolsSimulation import RTACtoolsSimulation
+from rtasci.lib.RTAManageXml import ManageXml
+from astropy.coordinates import SkyCoord
 
 @pytest.mark.test_conf_file
 def test_load_yaml_conf(test_conf_file):
@@ -216,3 +221,88 @@ def test_replicate_target(test_conf_file, test_tmp_folder):
     new_ra, new_dec = source[0][0], source[1][0]
     assert np.round(new_ra, decimals=2) == ra
     assert np.round(new_dec, decimals=2) == dec
+
+@pytest.mark.test_tmp_folder
+@pytest.mark.test_conf_file
+def test_resume_seeds(test_conf_file, test_tmp_folder):
+    conf = load_yaml_conf(test_conf_file)
+    conf['simulator']['output'] = join(test_tmp_folder, 'resume')
+    conf['simulator']['samples'] = 5
+    rmtree(conf['simulator']['output'], ignore_errors=True)
+    makedirs(conf['simulator']['output'])
+    datfile = join(conf['simulator']['output'], 'job_1_simulator.dat')
+    shard = get_worker_datfile(datfile, 0)
+    # seed 1 in datfile, seed 2 in a worker shard, seed 3 without its row, seed 4 without its file
+    for seed, dat in zip([1, 2, 4], [datfile, shard, datfile]):
+        open_records(dat, SIMULATION_COLUMNS).write([f'crab_{seed:03d}', seed, 0, 10, 10, 0, 0, 0, 0, 0, 'irf', 2.5, 1])
+        close_records(dat)
+    for seed in [1, 2, 3]:
+        open(seeds_to_string_formatter_files(5, conf['simulator']['output'], 'crab', seed, 'fits'), 'w+').close()
+    log = set_logger(logging.CRITICAL)
+    seeds = resume_seeds(conf, get_all_seeds(conf['simulator']), datfile, 'simulator', log)
+    assert list(seeds) == [3, 4, 5]
+    assert not isfile(shard)
+    # the row of seed 4 is written again when it runs
+    assert list(get_written_seeds(datfile)) == [1, 2]
+
+@pytest.mark.test_conf_file
+@pytest.mark.test_tmp_folder
+def test_randomise_target_keepxml(test_conf_file, test_tmp_folder):
+    conf = load_yaml_conf(test_conf_file)
+    np.random.seed(1)
+    new_model = randomise_target(model=conf['simulator']['model'], output=test_tmp_folder, samples=1, name='crab', seed=1, keepxml=False)
+    assert new_model == get_model_tmpfile('crab')
+    # same draws as setting the parameters one seed at a time
+    np.random.seed(1)
+    ra, dec = np.random.uniform(0, 360), np.random.choice([np.random.uniform(-90, 60), np.random.uniform(0, 90)])
+    model_xml = ManageXml(xml=new_model)
+    source = model_xml.getRaDec()
+    del model_xml
+    assert np.isclose(source[0][0], ra)
+    assert np.isclose(source[1][0], dec)
+
+@pytest.mark.test_conf_file
+@pytest.mark.parametrize('model', ['crab.xml', 'background.xml'])
+@pytest.mark.parametrize('pointing', ['random', {'ra': 83, 'dec': 22}])
+def test_make_simulation_plan(test_conf_file, model, pointing):
+    conf = load_yaml_conf(test_conf_file)
+    conf['simulator']['name'] = model.replace('.xml', '')
+    conf['simulator']['model'] = f'$TEMPLATES$/{model}'
+    conf['simulator']['pointing'] = pointing
+    conf['simulator']['samples'] = 100
+    seeds = get_all_seeds(conf['simulator'])
+    plan = make_simulation_plan(conf['simulator'], seeds)
+    assert len(plan) == 100
+    assert plan.row(5)['name'] == seeds_to_string_formatter(100, conf['simulator']['name'], 5)
+    assert set(plan.columns['irf']) == {conf['simulator']['irf']}
+    # the same seeds give the same plan
+    assert np.array_equal(plan.columns['point_ra'], make_simulation_plan(conf['simulator'], seeds).columns['point_ra'])
+    if pointing != 'random':
+        assert np.all(plan.columns['point_ra'] == 83)
+    if model == 'crab.xml':
+        source = SkyCoord(plan.columns['source_ra'] * u.deg, plan.columns['source_dec'] * u.deg)
+        point = SkyCoord(plan.columns['point_ra'] * u.deg, plan.columns['point_dec'] * u.deg)
+        assert np.allclose(source.separation(point).deg, plan.columns['offset'])
+        if pointing == 'random':
+            assert np.all(plan.columns['offset'] <= conf['simulator']['maxoffset'])
+    elif pointing != 'random':
+        assert np.all(np.isnan(plan.columns['offset']))
+
+@pytest.mark.test_conf_file
+@pytest.mark.test_tmp_folder
+def test_get_simulation_plan(test_conf_file, test_tmp_folder):
+    conf = load_yaml_conf(test_conf_file)
+    conf['simulator']['output'] = join(test_tmp_folder, 'test_simulation_plan')
+    rmtree(conf['simulator']['output'], ignore_errors=True)
+    log = set_logger(logging.CRITICAL)
+    seeds = get_all_seeds(conf['simulator'])
+    plan = get_simulation_plan(conf, seeds, log)
+    assert np.array_equal(get_simulation_plan(conf, seeds, log).columns['point_ra'], plan.columns['point_ra'])
+    # seeds outside the stored plan are not silently missing
+    with pytest.raises(ValueError):
+        get_simulation_plan(conf, np.arange(1, len(seeds) + 2), log, subset=False)
+    # a plan drawn with other settings is not reused
+    conf['simulator']['maxoffset'] += 1
+    with pytest.raises(ValueError):
+        get_simulation_plan(conf, seeds, log)
+    rmtree(conf['simulator']['output'])
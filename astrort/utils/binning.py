@@ -0,0 +1,65 @@
+# *****************************************************************************
+# Copyright (C) 2023 Ambra Di Piano
+# This software is distributed under the terms of the BSD-3-Clause license
+#
+# Authors:
+# Ambra Di Piano <ambra.dipiano@inaf.it>
+# *****************************************************************************
+
+import numpy as np
+from functools import lru_cache
+
+class SkyGrid():
+    '''Class that bins sky coordinates on the pointing centred pixel grid described by the count map header.'''
+    def __init__(self, ra, dec, maproi=5, pixelsize=0.02, nbins=None) -> None:
+        self.ra = ra
+        self.dec = dec
+        self.maproi = maproi
+        self.pixelsize = pixelsize
+        self.nbins = int(maproi*2/pixelsize) if nbins is None else int(nbins)
+        # CRPIX = nbins/2+0.5 so the lower edge of the first pixel is nbins/2 pixels below CRVAL
+        self.offset = self.nbins / 2
+        self.size = self.nbins * self.nbins
+        # RA differences need wrapping only when the map crosses RA=0/360
+        self.wrap = (ra - self.offset*pixelsize < 0) or (ra + self.offset*pixelsize >= 360)
+        pass
+
+    def get_extent(self):
+        half = self.offset * self.pixelsize
+        return [self.ra-half, self.ra+half, self.dec-half, self.dec+half]
+
+    def get_pixel_coordinates(self, ra, dec):
+        x = np.subtract(ra, self.ra, dtype=np.float64)
+        if self.wrap:
+            x = (x + 180) % 360 - 180
+        x /= self.pixelsize
+        x += self.offset
+        y = np.subtract(dec, self.dec, dtype=np.float64)
+        y /= self.pixelsize
+        y += self.offset
+        return x, y
+
+    def get_flat_index(self, ra, dec):
+        x, y = self.get_pixel_coordinates(ra, dec)
+        inside = (x >= 0) & (x < self.nbins) & (y >= 0) & (y < self.nbins)
+        # coordinates are positive inside the grid, truncation is the floor
+        index = y[inside].astype(np.intp) * self.nbins
+        index += x[inside].astype(np.intp)
+        return index, inside
+
+    def bin(self, ra, dec, weights=None):
+        index, inside = self.get_flat_index(ra, dec)
+        if weights is not None:
+            weights = np.asarray(weights)[inside]
+        counts = np.bincount(index, weights=weights, minlength=self.size)
+        return counts.astype(np.float64, copy=False).reshape(self.nbins, self.nbins)
+
+@lru_cache(maxsize=32)
+def get_sky_grid(ra, dec, maproi=5, pixelsize=0.02, nbins=None):
+    return SkyGrid(ra=ra, dec=dec, maproi=maproi, pixelsize=pixelsize, nbins=nbins)
+
+def get_sky_grid_from_extent(extent, bins, pixelsize=None):
+    maproi = (extent[1] - extent[0]) / 2
+    if pixelsize is None:
+        pixelsize = maproi * 2 / bins
+    return get_sky_grid(ra=(extent[0] + extent[1]) / 2, dec=(extent[2] + extent[3]) / 2, maproi=maproi, pixelsize=pixelsize, nbins=bins)
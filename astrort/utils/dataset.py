@@ -0,0 +1,225 @@
+# *****************************************************************************
+# Copyright (C) 2023 Ambra Di Piano
+# This software is distributed under the terms of the BSD-3-Clause license
+#
+# Authors:
+# Ambra Di Piano <ambra.dipiano@inaf.it>
+# *****************************************************************************
+
+import io
+import json
+import zlib
+import numpy as np
+from socket import gethostname
+from os import getpid, makedirs, listdir, replace, truncate
+from os.path import join, isfile, dirname, basename
+
+DATASET_INDEX = 'index.npz'
+
+def get_shard_manifest(shardfile):
+    return shardfile.replace('.npy', '.json')
+
+def resize_npy(filename, count):
+    # rewrite the header of a preallocated array with the rows actually written
+    with open(filename, 'r+b') as f:
+        if np.lib.format.read_magic(f) != (1, 0):
+            return False
+        shape, fortran, dtype = np.lib.format.read_array_header_1_0(f)
+        offset = f.tell()
+        header = io.BytesIO()
+        np.lib.format.write_array_header_1_0(header, {'descr': np.lib.format.dtype_to_descr(dtype), 'fortran_order': fortran, 'shape': (count,) + shape[1:]})
+        # the header is padded, a shorter shape keeps its length
+        if len(header.getvalue()) != offset:
+            return False
+        f.seek(0)
+        f.write(header.getvalue())
+    truncate(filename, offset + count * int(np.prod(shape[1:], dtype=np.int64)) * dtype.itemsize)
+    return True
+
+def write_json(filename, content):
+    # written aside and renamed, readers never see a partial manifest
+    tmpname = join(dirname(filename), f'tmp{getpid()}.json')
+    with open(tmpname, 'w') as f:
+        json.dump(content, f)
+    replace(tmpname, filename)
+    return filename
+
+class DatasetWriter():
+    '''Class that appends maps to fixed-size shards of a dataset folder.'''
+    def __init__(self, folder, prefix=None, shard=256, compression=None) -> None:
+        assert compression in [None, 'zlib'], f"Invalid compression {compression}"
+        self.folder = folder
+        self.prefix = prefix if prefix is not None else f'{gethostname()}_{getpid()}'
+        self.shard_size = shard
+        self.compression = compression
+        self.pid = getpid()
+        makedirs(folder, exist_ok=True)
+        # never overwrite shards of a previous run with the same prefix
+        numbers = [int(f.split('_')[-1].replace('.json', '')) for f in listdir(folder) if f.startswith(f'{self.prefix}_') and f.endswith('.json')]
+        self.number = max(numbers) + 1 if len(numbers) else 0
+        self.data = None
+        self.seeds, self.exposures, self.chunks = [], [], []
+        pass
+
+    def get_shardfile(self):
+        return join(self.folder, f'{self.prefix}_{self.number:06d}.npy')
+
+    def write(self, seed, dl4_data, exposure=0):
+        dl4_data = np.asarray(dl4_data, dtype=np.float64)
+        if self.compression is None:
+            if self.data is None:
+                self.data = np.lib.format.open_memmap(self.get_shardfile(), mode='w+', dtype=np.float64, shape=(self.shard_size,) + dl4_data.shape)
+            self.data[len(self.seeds)] = dl4_data
+        else:
+            self.shape = dl4_data.shape
+            self.chunks.append(zlib.compress(dl4_data.tobytes(), 1))
+        self.seeds.append(int(seed))
+        self.exposures.append(exposure)
+        if len(self.seeds) == self.shard_size:
+            self.flush()
+        return self
+
+    def flush(self):
+        if getpid() != self.pid or len(self.seeds) == 0:
+            return self
+        shardfile = self.get_shardfile()
+        manifest = {'seeds': self.seeds, 'exposures': self.exposures, 'compression': self.compression}
+        if self.compression is None:
+            manifest['shape'] = list(self.data.shape[1:])
+            self.data.flush()
+            del self.data
+            # the last shard is cut to its rows
+            if len(self.seeds) < self.shard_size:
+                resize_npy(shardfile, len(self.seeds))
+        else:
+            manifest['shape'] = list(self.shape)
+            manifest['offsets'] = np.cumsum([0] + [len(chunk) for chunk in self.chunks]).tolist()
+            np.save(shardfile, np.frombuffer(b''.join(self.chunks), dtype=np.uint8), allow_pickle=False)
+        # the shard is complete once its manifest exists
+        write_json(get_shard_manifest(shardfile), manifest)
+        self.number += 1
+        self.data = None
+        self.seeds, self.exposures, self.chunks = [], [], []
+        return self
+
+    def close(self):
+        return self.flush()
+
+WRITERS = {}
+
+def open_dataset(folder, prefix=None, shard=256, compression=None):
+    key = (getpid(), folder)
+    if key not in WRITERS:
+        WRITERS[key] = DatasetWriter(folder, prefix=prefix, shard=shard, compression=compression)
+    return WRITERS[key]
+
+def close_datasets(folder=None):
+    for key in list(WRITERS.keys()):
+        if key[0] == getpid() and (folder is None or key[1] == folder):
+            WRITERS.pop(key).close()
+
+def get_dataset_options(configuration):
+    return {'shard': configuration['mapper'].get('shard', 256), 'compression': configuration['mapper'].get('compression', None)}
+
+def get_dataset_folder(configuration):
+    return join(configuration['mapper']['output'], f"{configuration['simulator']['name']}_dataset")
+
+def get_shard_files(folder):
+    return sorted(join(folder, f.replace('.json', '.npy')) for f in listdir(folder) if f.endswith('.json') and not f.startswith('tmp'))
+
+def get_dataset_index(folder):
+    # global index of all complete shards, sorted by seed
+    shards = get_shard_files(folder)
+    seeds, exposures, numbers, offsets = [], [], [], []
+    for number, shardfile in enumerate(shards):
+        with open(get_shard_manifest(shardfile)) as f:
+            manifest = json.load(f)
+        seeds += manifest['seeds']
+        exposures += manifest['exposures']
+        numbers += [number] * len(manifest['seeds'])
+        offsets += list(range(len(manifest['seeds'])))
+    seeds, exposures = np.array(seeds, dtype=np.int64), np.array(exposures, dtype=np.float64)
+    order = np.lexsort((exposures, seeds))
+    return {'seed': seeds[order], 'exposure': exposures[order], 'shard': np.array(numbers, dtype=np.int64)[order], 'offset': np.array(offsets, dtype=np.int64)[order], 'shards': np.array([basename(f) for f in shards], dtype=str)}
+
+def build_dataset_index(folder):
+    # written by the jobs once their shards are complete
+    tmpname = join(folder, f'tmp{getpid()}.npz')
+    np.savez(tmpname, **get_dataset_index(folder))
+    replace(tmpname, join(folder, DATASET_INDEX))
+    return join(folder, DATASET_INDEX)
+
+class MapDataset():
+    '''Class that reads maps of a sharded dataset by seed, without opening a file per map.'''
+    def __init__(self, folder) -> None:
+        self.folder = folder
+        index = join(folder, DATASET_INDEX)
+        if isfile(index):
+            with np.load(index, allow_pickle=False) as data:
+                self.set_index(data)
+        # a missing index, or shards completed after it was written, are indexed in memory
+        if not isfile(index) or len(get_shard_files(folder)) != len(self.shards):
+            self.set_index(get_dataset_index(folder))
+        self.manifests = {}
+        self.arrays = {}
+        pass
+
+    def set_index(self, index):
+        self.seeds, self.exposure, self.shard, self.offset = index['seed'], index['exposure'], index['shard'], index['offset']
+        self.shards = [join(self.folder, f) for f in index['shards']]
+        return self
+
+    def __len__(self):
+        return len(self.seeds)
+
+    def __contains__(self, seed):
+        i = np.searchsorted(self.seeds, seed)
+        return i < len(self.seeds) and self.seeds[i] == seed
+
+    def get_manifest(self, number):
+        if number not in self.manifests:
+            with open(get_shard_manifest(self.shards[number])) as f:
+                self.manifests[number] = json.load(f)
+        return self.manifests[number]
+
+    def get_array(self, number):
+        # each shard is memory mapped once
+        if number not in self.arrays:
+            self.arrays[number] = np.load(self.shards[number], mmap_mode='r')
+        return self.arrays[number]
+
+    def index(self, seed, exposure=None):
+        lo, hi = np.searchsorted(self.seeds, seed, side='left'), np.searchsorted(self.seeds, seed, side='right')
+        if lo == hi:
+            raise KeyError(f"Seed {seed} not found in dataset {self.folder}")
+        if exposure is None:
+            return lo
+        match = np.flatnonzero(self.exposure[lo:hi] == exposure)
+        if len(match) == 0:
+            raise KeyError(f"Seed {seed} with exposure {exposure} not found in dataset {self.folder}")
+        return lo + match[0]
+
+    def read(self, i, out=None):
+        number, offset = self.shard[i], self.offset[i]
+        manifest, data = self.get_manifest(number), self.get_array(number)
+        if manifest['compression'] is None:
+            dl4_data = data[offset]
+        else:
+            chunk = data[manifest['offsets'][offset]:manifest['offsets'][offset+1]]
+            dl4_data = np.frombuffer(zlib.decompress(chunk), dtype=np.float64).reshape(manifest['shape'])
+        if out is None:
+            return np.array(dl4_data)
+        out[...] = dl4_data
+        return out
+
+    def get(self, seed, exposure=None):
+        return self.read(self.index(seed, exposure))
+
+    def get_batch(self, seeds, exposure=None, out=None):
+        rows = np.array([self.index(seed, exposure) for seed in seeds], dtype=np.int64)
+        if out is None:
+            out = np.empty((len(rows),) + tuple(self.get_manifest(self.shard[rows[0]])['shape']), dtype=np.float64) if len(rows) else np.empty((0,))
+        # read shard by shard, in file order
+        for j in np.lexsort((self.offset[rows], self.shard[rows])):
+            self.read(rows[j], out=out[j])
+        return out
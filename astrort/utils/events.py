@@ -0,0 +1,96 @@
+# *****************************************************************************
+# Copyright (C) 2023 Ambra Di Piano
+# This software is distributed under the terms of the BSD-3-Clause license
+#
+# Authors:
+# Ambra Di Piano <ambra.dipiano@inaf.it>
+# *****************************************************************************
+
+import numpy as np
+from os import stat
+from os.path import abspath
+from functools import lru_cache
+
+EVENT_COLUMNS = ('RA', 'DEC', 'TIME', 'ENERGY')
+
+class EventList():
+    '''Class that holds the projected columns of a photon list, as memory-mapped views, with its header.'''
+    def __init__(self, columns, header) -> None:
+        self.columns = columns
+        self.header = header
+        pass
+
+    def field(self, name):
+        return self.columns[name]
+
+    def names(self):
+        return list(self.columns.keys())
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return self.columns[key]
+        return EventList({name: column[key] for name, column in self.columns.items()}, self.header)
+
+    def __len__(self):
+        if len(self.columns) == 0:
+            return 0
+        return len(next(iter(self.columns.values())))
+
+@lru_cache(maxsize=8)
+def cached_event_list(filename, mtime, size, columns, extension):
+    from astropy.io import fits
+    with fits.open(filename, memmap=True) as h:
+        hdu = h[extension]
+        # views on the memory map, they stay valid after the file is closed
+        data = {name: hdu.data.field(name) for name in columns}
+        header = hdu.header
+    return EventList(data, header)
+
+def read_event_list(filename, columns=EVENT_COLUMNS, extension='EVENTS'):
+    filename = abspath(filename)
+    info = stat(filename)
+    return cached_event_list(filename, info.st_mtime_ns, info.st_size, tuple(columns), extension)
+
+def clear_event_cache():
+    cached_event_list.cache_clear()
+
+def get_roi_mask(ra, dec, pointing, maproi, region='box'):
+    dra = np.subtract(ra, pointing['ra'], dtype=np.float64)
+    dra = (dra + 180) % 360 - 180
+    ddec = np.subtract(dec, pointing['dec'], dtype=np.float64)
+    if region == 'box':
+        # same geometry as the count map
+        return (np.abs(dra) < maproi) & (np.abs(ddec) < maproi)
+    ra0, dec0 = np.radians(pointing['ra']), np.radians(pointing['dec'])
+    dra, dec = np.radians(dra), np.radians(dec, dtype=np.float64)
+    if region == 'circle':
+        # haversine angular separation
+        sep = np.sin((dec - dec0) / 2)**2 + np.cos(dec) * np.cos(dec0) * np.sin(dra / 2)**2
+        return 2 * np.arcsin(np.sqrt(np.clip(sep, 0, 1))) < np.radians(maproi)
+    elif region == 'tangent':
+        # gnomonic projection on the plane tangent to the pointing
+        cosc = np.sin(dec0) * np.sin(dec) + np.cos(dec0) * np.cos(dec) * np.cos(dra)
+        xi = np.degrees(np.cos(dec) * np.sin(dra) / cosc)
+        eta = np.degrees((np.cos(dec0) * np.sin(dec) - np.sin(dec0) * np.cos(dec) * np.cos(dra)) / cosc)
+        return (cosc > 0) & (np.abs(xi) < maproi) & (np.abs(eta) < maproi)
+    else:
+        raise ValueError(f"Invalid 'region' {region}")
+
+def select_events(events, pointing=None, trange=None, erange=None, maproi=None, region='box', chunk=1048576):
+    # one combined mask per chunk keeps temporaries bounded on large photon lists
+    index = []
+    for start in range(0, len(events), chunk):
+        stop = min(start + chunk, len(events))
+        mask = np.ones(stop - start, dtype=bool)
+        if trange is not None:
+            time = events['TIME'][start:stop]
+            mask &= (time > trange[0]) & (time < trange[1])
+        if erange is not None:
+            energy = events['ENERGY'][start:stop]
+            mask &= (energy > erange[0]) & (energy < erange[1])
+        if maproi is not None:
+            mask &= get_roi_mask(events['RA'][start:stop], events['DEC'][start:stop], pointing=pointing, maproi=maproi, region=region)
+        index.append(np.flatnonzero(mask) + start)
+    if len(index) == 0:
+        return np.empty(0, dtype=np.intp)
+    return np.concatenate(index)
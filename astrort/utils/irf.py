@@ -0,0 +1,121 @@
+# *****************************************************************************
+# Copyright (C) 2023 Ambra Di Piano
+# This software is distributed under the terms of the BSD-3-Clause license
+#
+# Authors:
+# Ambra Di Piano <ambra.dipiano@inaf.it>
+# *****************************************************************************
+
+import re
+import json
+import numpy as np
+from os import listdir, stat, environ, makedirs, replace, close
+from os.path import join, expandvars, expanduser, isfile, dirname
+from tempfile import mkstemp
+
+# e.g. North_z20_N_0.5h_LST, South_z40_0.5h
+IRF_PATTERN = re.compile(r'^(?P<site>North|South)_z(?P<zenith>\d+)(?:_(?P<azimuth>[NS]))?_(?P<duration>\d+(?:\.\d+)?)h(?:_(?P<array>\w+))?$')
+
+def parse_irf_name(name):
+    match = IRF_PATTERN.match(name)
+    if match is None:
+        return {'site': '', 'zenith': np.nan, 'azimuth': '', 'duration': np.nan, 'array': ''}
+    fields = match.groupdict()
+    # no azimuth tag is the azimuth average, no array tag is the full site array
+    return {'site': fields['site'].lower(), 'zenith': float(fields['zenith']), 'azimuth': fields['azimuth'] or 'average', 'duration': float(fields['duration']), 'array': (fields['array'] or fields['site']).lower()}
+
+class IrfCatalog():
+    '''Class that holds the IRF names of a CALDB production with their parsed fields.'''
+    def __init__(self, prod, names) -> None:
+        self.prod = prod
+        self.names = np.array(names, dtype=str)
+        self.lower = np.char.lower(self.names)
+        fields = [parse_irf_name(name) for name in names]
+        for key in ('site', 'zenith', 'azimuth', 'duration', 'array'):
+            setattr(self, key, np.array([f[key] for f in fields]))
+        self.candidates = {}
+        pass
+
+    def __len__(self):
+        return len(self.names)
+
+    def select(self, array, filter=None):
+        # same name matching as the CALDB listing, computed once per query
+        key = (array.lower(), filter.lower() if filter is not None else None)
+        if key not in self.candidates:
+            mask = (np.char.find(self.lower, key[0]) >= 0) & (np.char.find(self.lower, '0.5h') >= 0)
+            if filter is not None:
+                mask &= np.char.find(self.lower, key[1]) >= 0
+            self.candidates[key] = self.names[mask].tolist()
+        return self.candidates[key]
+
+    def query(self, site=None, zenith=None, azimuth=None, duration=None, array=None):
+        mask = np.ones(len(self), dtype=bool)
+        if site is not None:
+            mask &= self.site == site.lower()
+        if zenith is not None:
+            mask &= self.zenith == zenith
+        if azimuth is not None:
+            mask &= self.azimuth == azimuth
+        if duration is not None:
+            mask &= self.duration == duration
+        if array is not None:
+            mask &= self.array == array.lower()
+        return self.names[mask].tolist()
+
+    def sample(self, array, size, filter=None, rng=None):
+        candidates = self.select(array, filter=filter)
+        if len(candidates) == 0:
+            raise IndexError(f"No IRF found for array {array} and filter {filter} in {self.prod}")
+        rng = rng if rng is not None else np.random.default_rng()
+        return np.array(candidates)[rng.integers(0, len(candidates), size=size)]
+
+def get_caldb_path(prod):
+    return join(expandvars('$CALDB'), f'data/cta/{prod}/bcf')
+
+def get_irf_cache_file(prod):
+    folder = environ.get('ASTRORT_CACHE', join(expanduser('~'), '.cache', 'astrort'))
+    return join(folder, f'irf_{prod}.json')
+
+def read_irf_cache(cachefile, path, mtime):
+    if not isfile(cachefile):
+        return None
+    try:
+        with open(cachefile) as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return None
+    # the listing is valid until the production folder changes
+    if cache.get('path') != path or cache.get('mtime') != mtime:
+        return None
+    return cache['names']
+
+def write_irf_cache(cachefile, path, mtime, names):
+    try:
+        makedirs(dirname(cachefile), exist_ok=True)
+        fd, tmpname = mkstemp(suffix='.json', prefix='tmp', dir=dirname(cachefile))
+        close(fd)
+        with open(tmpname, 'w') as f:
+            json.dump({'path': path, 'mtime': mtime, 'names': names}, f)
+        replace(tmpname, cachefile)
+    except OSError:
+        # the cache is optional, a read-only home only costs a listing per job
+        pass
+    return cachefile
+
+CATALOGS = {}
+
+def get_irf_catalog(prod):
+    if prod not in CATALOGS:
+        path = get_caldb_path(prod)
+        mtime = stat(path).st_mtime_ns
+        cachefile = get_irf_cache_file(prod)
+        names = read_irf_cache(cachefile, path, mtime)
+        if names is None:
+            names = listdir(path)
+            write_irf_cache(cachefile, path, mtime, names)
+        CATALOGS[prod] = IrfCatalog(prod, names)
+    return CATALOGS[prod]
+
+def clear_irf_catalogs():
+    CATALOGS.clear()
@@ -0,0 +1,170 @@
+# *****************************************************************************
+# Copyright (C) 2023 Ambra Di Piano
+# This software is distributed under the terms of the BSD-3-Clause license
+#
+# Authors:
+# Ambra Di Piano <ambra.dipiano@inaf.it>
+# *****************************************************************************
+
+import re
+import numpy as np
+import pandas as pd
+from time import time
+from os import listdir
+from os.path import join, isdir, isfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from astropy.io import fits
+from astrort.utils.sparse import read_sparse_map, densify_sparse_map
+from astrort.utils.dataset import MapDataset, DATASET_INDEX
+
+# e.g. crab_00001_map.npy, crab_001_map_10s.fits
+MAP_PATTERN = re.compile(r'_(?P<seed>\d+)_map(?:_(?P<exposure>[\d.]+)s)?\.(?P<ext>npy|fits|npz)$')
+
+def read_fits_map(filename, out=None):
+    # first image in the file, the primary HDU for the mapper and ctskymap
+    with fits.open(filename, memmap=True) as h:
+        data = next(hdu.data for hdu in h if hdu.data is not None and hdu.data.ndim >= 2)
+        if out is None:
+            return np.array(data, dtype=np.float64)
+        out[...] = data
+    return out
+
+class FileSource():
+    '''Class that reads one map per file from a mapper output folder.'''
+    def __init__(self, folder, exposure=None) -> None:
+        self.folder = folder
+        files = {}
+        for f in listdir(folder):
+            match = MAP_PATTERN.search(f)
+            if match is None:
+                continue
+            if exposure is not None and (match['exposure'] is None or float(match['exposure']) != exposure):
+                continue
+            seed = int(match['seed'])
+            # maps of several exposures need the exposure to pick one
+            if exposure is None and seed in files:
+                raise ValueError(f"Several maps of seed {seed} found in {folder}, select one with 'exposure'")
+            files.setdefault(seed, join(folder, f))
+        self.seeds = np.array(sorted(files), dtype=np.int64)
+        self.files = files
+        self.shape = self.read(self.seeds[0]).shape if len(self.seeds) else None
+        pass
+
+    def read(self, seed, out=None):
+        filename = self.files[seed]
+        if filename.endswith('.fits'):
+            return read_fits_map(filename, out=out)
+        elif filename.endswith('.npz'):
+            return densify_sparse_map(read_sparse_map(filename), out=out)
+        data = np.load(filename, mmap_mode='r')
+        if out is None:
+            return np.array(data)
+        out[...] = data
+        return out
+
+class StackSource():
+    '''Class that reads maps from a stacked npy file and its seed table.'''
+    def __init__(self, npyname) -> None:
+        self.stack = np.load(npyname, mmap_mode='r')
+        table = pd.read_csv(npyname.replace('.npy', '.dat'), sep=' ', usecols=['row', 'seed'])
+        self.rows = dict(zip(table['seed'].tolist(), table['row'].tolist()))
+        self.seeds = np.array(sorted(self.rows), dtype=np.int64)
+        self.shape = self.stack.shape[1:]
+        pass
+
+    def read(self, seed, out=None):
+        data = self.stack[self.rows[seed]]
+        if out is None:
+            return np.array(data)
+        out[...] = data
+        return out
+
+class DatasetSource():
+    '''Class that reads maps from a sharded dataset.'''
+    def __init__(self, folder, exposure=None) -> None:
+        self.dataset = MapDataset(folder)
+        self.exposure = exposure
+        self.seeds = np.unique(self.dataset.seeds)
+        self.shape = self.read(self.seeds[0]).shape if len(self.seeds) else None
+        pass
+
+    def read(self, seed, out=None):
+        return self.dataset.read(self.dataset.index(seed, self.exposure), out=out)
+
+def get_map_source(path, exposure=None):
+    if isdir(path) and isfile(join(path, DATASET_INDEX)):
+        return DatasetSource(path, exposure=exposure)
+    elif isdir(path):
+        return FileSource(path, exposure=exposure)
+    elif path.endswith('.npy'):
+        return StackSource(path)
+    raise ValueError(f"Invalid map source {path}")
+
+class MapLoader():
+    '''Class that iterates over mapper outputs in batches, prefetched by a thread pool.'''
+    def __init__(self, path, batch=32, shuffle=False, seed=None, threads=4, prefetch=2, exposure=None, clean=None, drop_last=False) -> None:
+        self.sources = [get_map_source(path, exposure=exposure)]
+        if clean is not None:
+            # noisy and clean maps paired by seed
+            self.sources.append(get_map_source(clean, exposure=exposure))
+        self.seeds = self.sources[0].seeds
+        for source in self.sources[1:]:
+            self.seeds = np.intersect1d(self.seeds, source.seeds)
+        self.batch = batch
+        self.shuffle = shuffle
+        self.rng = np.random.default_rng(seed)
+        self.threads = max(threads, 1)
+        self.prefetch = max(prefetch, 1)
+        self.drop_last = drop_last
+        self.stats = {'maps': 0, 'bytes': 0, 'seconds': 0.0}
+        pass
+
+    def __len__(self):
+        if self.drop_last:
+            return len(self.seeds) // self.batch
+        return -(-len(self.seeds) // self.batch)
+
+    def get_order(self):
+        # shuffling permutes the index, maps are never moved
+        if self.shuffle:
+            return self.rng.permutation(len(self.seeds))
+        return np.arange(len(self.seeds))
+
+    def load_batch(self, seeds):
+        batch = []
+        for source in self.sources:
+            out = np.empty((len(seeds),) + tuple(source.shape), dtype=np.float64)
+            for i, seed in enumerate(seeds):
+                source.read(seed, out=out[i])
+            batch.append(out)
+        return batch
+
+    def __iter__(self):
+        order = self.get_order()
+        batches = [self.seeds[order[start:start+self.batch]] for start in range(0, len(self) * self.batch, self.batch)]
+        self.stats = {'maps': 0, 'bytes': 0, 'seconds': 0.0}
+        clock = time()
+        with ThreadPoolExecutor(max_workers=self.threads) as pool:
+            queue = deque()
+            for seeds in batches:
+                queue.append((seeds, pool.submit(self.load_batch, seeds)))
+                if len(queue) > self.prefetch * self.threads:
+                    yield self.collect(*queue.popleft(), clock)
+            while len(queue) > 0:
+                yield self.collect(*queue.popleft(), clock)
+
+    def collect(self, seeds, future, clock):
+        batch = future.result()
+        self.stats['maps'] += len(seeds)
+        self.stats['bytes'] += sum(maps.nbytes for maps in batch)
+        self.stats['seconds'] = time() - clock
+        return (seeds, *batch)
+
+    def get_throughput(self):
+        # sustained rate since the start of the epoch
+        seconds = max(self.stats['seconds'], 1e-9)
+        return {'maps/s': self.stats['maps'] / seconds, 'MB/s': self.stats['bytes'] / seconds / 1024**2}
+
+def get_cleaner_loader(output, **kwargs):
+    return MapLoader(join(output, 'noisy'), clean=join(output, 'clean'), **kwargs)
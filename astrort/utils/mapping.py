@@ -8,8 +8,24 @@
 
 import shutil
 import numpy as np
+import pandas as pd
+from os import replace, remove, getpid
+from os.path import basename, abspath
+from functools import lru_cache
 from astropy.io import fits
-from scipy.ndimage import gaussian_filter
+from astrort.utils.events import read_event_list, select_events
+from astrort.utils.binning import get_sky_grid, get_sky_grid_from_extent
+from astrort.utils.smoothing import smooth_map, smooth_pixels, smooth_stack
+from astrort.utils.sparse import write_sparse_map
+
+# maps smoothed together when stacking
+STACK_BLOCK = 64
+
+@lru_cache(maxsize=4)
+def load_template_header(template):
+    with fits.open(template) as h:
+        hdr = h['SKYMAP'].header.copy()
+    return hdr
 
 class Mapper():
     '''Class that read, writes and manages the FITS data format.'''
@@ -48,9 +64,20 @@ class Mapper():
         hdr['E_MAX'] = 0.0
         return hdr
 
-    def get_template(self):
-        '''TODO'''
-        return 
+    def get_template(self, template):
+        return load_template_header(abspath(template)).copy()
+
+    def write_fits(self, hdul, fitsname):
+        # write next to the target and rename, readers never see a partial map
+        # a plain open keeps the umask permissions, mkstemp files are owner only
+        tmpname = f'{fitsname}.tmp{getpid()}'
+        try:
+            hdul.writeto(tmpname, overwrite=True)
+            replace(tmpname, fitsname)
+        except Exception:
+            remove(tmpname)
+            raise
+        return self
 
     def convert_countmap_in_template(self, skymap, template):
         shutil.copy(skymap, template)
@@ -92,8 +119,7 @@ class Mapper():
         return hdr_info
 
     def get_dl3_hdr(self, dl3_file):
-        with fits.open(dl3_file) as h:
-            hdr = h['EVENTS'].header
+        hdr = read_event_list(dl3_file).header
         return hdr
 
     def set_dl3_hdr(self, dl3_file, hdr_fits):
@@ -104,8 +130,7 @@ class Mapper():
         return self
 
     def get_dl3_data(self, dl3_file):
-        with fits.open(dl3_file) as h:
-            data = h['EVENTS'].data
+        data = read_event_list(dl3_file)
         return data
 
     def set_dl3_data(self, dl3_file, data, GTI=None):
@@ -172,60 +197,225 @@ class Mapper():
         hdr_fits['RADESYS'] = dl3_hdr['RADECSYS']
         return hdr_fits
 
-    def get_countmap_in_fits(self, dl3_file, template, pixelsize=0.02, maproi=5, trange=None, erange=None, sigma=1, fitsname='skymap.fits'):
-        shutil.copy(template, fitsname)
-        dl3_hdr = self.get_dl3_hdr(dl3_file=dl3_file)
+    def get_countmap(self, dl3_file, pixelsize=0.02, maproi=5, trange=None, erange=None, sigma=1, region='box'):
+        dl3_data = self.get_dl3_data(dl3_file=dl3_file)
+        dl3_hdr = dl3_data.header
         pointing = {'ra': float(dl3_hdr['RA_PNT']), 'dec': float(dl3_hdr['DEC_PNT'])}
         hdr_fits = self.store_hdr_in_dict(dl3_hdr=dl3_hdr, maproi=maproi, pixelsize=pixelsize)
+        index = self.selection_index(dl3_data=dl3_data, pointing=pointing, trange=trange, erange=erange, maproi=maproi, region=region)
+        dl4_data = self.from_dl3_to_dl4(dl3_data=dl3_data, pointing=pointing, maproi=maproi, pixelsize=pixelsize, sigma=sigma, index=index)
+        return dl4_data, hdr_fits
+
+    def get_countmaps_by_exposure(self, dl3_file, exposures, pixelsize=0.02, maproi=5, tstart=0, erange=None, sigma=1, region='box'):
+        exposures = sorted(exposures)
         dl3_data = self.get_dl3_data(dl3_file=dl3_file)
-        dl3_data = self.selection_cuts(dl3_data=dl3_data, pointing=pointing, trange=trange, erange=erange, maproi=maproi)
-        if sigma != 0:
-            dl4_data = self.from_dl3_to_dl4(dl3_data=dl3_data, pointing=pointing, maproi=maproi, pixelsize=0.02, sigma=sigma)
-        else:
-            dl4_data = self.from_dl3_to_dl4(dl3_data=dl3_data, pointing=pointing, maproi=maproi, pixelsize=pixelsize)
-        self.set_dl4_hdr(dl4_file=fitsname, hdr_fits=hdr_fits)
-        self.set_dl4_data(dl4_file=fitsname, data=dl4_data)
+        dl3_hdr = dl3_data.header
+        pointing = {'ra': float(dl3_hdr['RA_PNT']), 'dec': float(dl3_hdr['DEC_PNT'])}
+        hdr_fits = self.store_hdr_in_dict(dl3_hdr=dl3_hdr, maproi=maproi, pixelsize=pixelsize)
+        index = self.selection_index(dl3_data=dl3_data, pointing=pointing, trange=[tstart, exposures[-1]], erange=erange, maproi=maproi, region=region)
+        dl4_data = self.from_dl3_to_dl4_by_exposure(dl3_data=dl3_data, pointing=pointing, exposures=exposures, maproi=maproi, pixelsize=pixelsize, sigma=sigma, index=index)
+        return dict(zip(exposures, dl4_data)), hdr_fits
+
+    def get_countmap_in_fits(self, dl3_file, template, pixelsize=0.02, maproi=5, trange=None, erange=None, sigma=1, fitsname='skymap.fits', region='box'):
+        dl4_data, hdr_fits = self.get_countmap(dl3_file=dl3_file, pixelsize=pixelsize, maproi=maproi, trange=trange, erange=erange, sigma=sigma, region=region)
+        self.write_countmap_in_fits(dl4_data=dl4_data, hdr_fits=hdr_fits, template=template, fitsname=fitsname)
         return
 
+    def write_countmap_in_fits(self, dl4_data, hdr_fits, template, fitsname='skymap.fits'):
+        hdr = self.get_template(template=template)
+        for k in hdr_fits.keys():
+            hdr[k] = hdr_fits[k]
+        # keep the template cards as they are, including the structural ones
+        hdu = fits.PrimaryHDU(data=dl4_data)
+        hdu.header = hdr
+        self.write_fits(hdul=fits.HDUList([hdu]), fitsname=fitsname)
+        return self
+
+    def get_stack_row(self, row, seed, dl3_file, hdr_fits):
+        return {'row': row, 'seed': seed, 'name': basename(dl3_file).replace('.fits', ''), 'point_ra': hdr_fits['CRVAL1'], 'point_dec': hdr_fits['CRVAL2'], 'tstart': hdr_fits['TSTART'], 'tstop': hdr_fits['TSTOP'], 'telapse': hdr_fits['TELAPSE'], 'ontime': hdr_fits['ONTIME'], 'livetime': hdr_fits['LIVETIME'], 'deadc': hdr_fits['DEADC'], 'emin': hdr_fits['E_MIN'], 'emax': hdr_fits['E_MAX']}
+
+    def get_countmaps_in_stack(self, dl3_files, seeds=None, pixelsize=0.02, maproi=5, trange=None, erange=None, sigma=1, npyname='stack.npy', memmap=True, region='box', renew=None):
+        if seeds is None:
+            seeds = np.arange(len(dl3_files))
+        assert len(seeds) == len(dl3_files), 'seeds and DL3 files lengths do not match'
+        nbins = self.get_binning_size(maproi=maproi, pixelsize=pixelsize)
+        shape = (len(dl3_files), nbins, nbins)
+        # preallocate stack
+        if memmap:
+            stack = np.lib.format.open_memmap(npyname, mode='w+', dtype=np.float64, shape=shape)
+        else:
+            stack = np.zeros(shape, dtype=np.float64)
+        rows = []
+        for i, (seed, dl3_file) in enumerate(zip(seeds, dl3_files)):
+            # keep the queue lease of the batch
+            if renew is not None:
+                renew()
+            stack[i], hdr_fits = self.get_countmap(dl3_file=dl3_file, pixelsize=pixelsize, maproi=maproi, trange=trange, erange=erange, sigma=0, region=region)
+            rows.append(self.get_stack_row(row=i, seed=seed, dl3_file=dl3_file, hdr_fits=hdr_fits))
+            self.log.debug(f"Stacked {dl3_file} in row {i}")
+        # smooth the stack in blocks of maps
+        for start in range(0, len(stack), STACK_BLOCK):
+            smooth_stack(stack[start:start+STACK_BLOCK], sigma=sigma, out=stack[start:start+STACK_BLOCK])
+        # write stack and sidecar table
+        if memmap:
+            stack.flush()
+        else:
+            np.save(npyname, stack, allow_pickle=False)
+        pd.DataFrame(rows).to_csv(npyname.replace('.npy', '.dat'), index=False, header=True, sep=' ', na_rep=np.nan)
+        return stack
+
     def get_extent(self, pointing, roi):
         extent = [pointing['ra']-roi, pointing['ra']+roi, pointing['dec']-roi, pointing['dec']+roi]
         return extent
 
-    def get_heatmap(self, x, y, extent, sigma=0, bins=1000):
-        r = [[extent[0], extent[1]], [extent[2], extent[3]]]
-        heatmap, xedges, yedges = np.histogram2d(x, y, bins=bins)
-        if sigma != 0:
-            heatmap = gaussian_filter(heatmap, sigma=sigma)
-        return heatmap.T
+    def get_grid(self, pointing, maproi=5, pixelsize=0.02):
+        return get_sky_grid(ra=pointing['ra'], dec=pointing['dec'], maproi=maproi, pixelsize=pixelsize)
 
-    def from_dl3_to_dl4(self, dl3_data, pointing, maproi=5, pixelsize=0.02, sigma=0):
-        ra = np.array(dl3_data.field('RA')).flatten()
-        dec = np.array(dl3_data.field('DEC')).flatten()
-        nbins = self.get_binning_size(maproi=maproi, pixelsize=pixelsize)
-        extent = self.get_extent(pointing=pointing, roi=maproi)
-        dl4_data = self.get_heatmap(ra, dec, extent=extent, bins=nbins, sigma=sigma)
+    def smooth_heatmap(self, heatmap, sigma=0):
+        return smooth_map(heatmap, sigma=sigma)
+
+    def get_heatmap(self, x, y, extent, sigma=0, bins=1000, pixelsize=None):
+        grid = get_sky_grid_from_extent(extent=extent, bins=bins, pixelsize=pixelsize)
+        heatmap = grid.bin(x, y)
+        return self.smooth_heatmap(heatmap, sigma=sigma)
+
+    def from_dl3_to_dl4(self, dl3_data, pointing, maproi=5, pixelsize=0.02, sigma=0, index=None):
+        ra = dl3_data.field('RA')
+        dec = dl3_data.field('DEC')
+        if index is not None:
+            ra, dec = ra[index], dec[index]
+        grid = self.get_grid(pointing=pointing, maproi=maproi, pixelsize=pixelsize)
+        pixels, inside = grid.get_flat_index(ra, dec)
+        dl4_data = smooth_pixels(pixels, (grid.nbins, grid.nbins), sigma=sigma)
         return dl4_data
 
-    def selection_cuts(self, dl3_data, pointing, trange=None, erange=None, maproi=None):
-        if trange != None:
-            dl3_data = dl3_data[(dl3_data['TIME'] > trange[0]) & (dl3_data['TIME'] < trange[1])] 
-        if erange != None:
-            dl3_data = dl3_data[(dl3_data['ENERGY'] > erange[0]) & (dl3_data['ENERGY'] < erange[1])] 
-        if maproi != None:
-            dl3_data = dl3_data[(np.abs(np.abs(dl3_data['RA'])-np.abs(pointing['ra'])) < maproi)]
-            dl3_data = dl3_data[(np.abs(np.abs(dl3_data['DEC'])-np.abs(pointing['dec'])) < maproi)]
-        if len(dl3_data) == 0:
-            self.log.warning("Empty photon list selection.")
-        return dl3_data
+    def from_dl3_to_dl4_by_exposure(self, dl3_data, pointing, exposures, maproi=5, pixelsize=0.02, sigma=0, index=None):
+        ra = dl3_data.field('RA')
+        dec = dl3_data.field('DEC')
+        time = dl3_data.field('TIME')
+        if index is not None:
+            ra, dec, time = ra[index], dec[index], time[index]
+        grid = self.get_grid(pointing=pointing, maproi=maproi, pixelsize=pixelsize)
+        pixels, inside = grid.get_flat_index(ra, dec)
+        # sort once by time, each exposure is a prefix of the sorted events
+        time = time[inside]
+        order = np.argsort(time, kind='stable')
+        pixels, time = pixels[order], time[order]
+        stops = np.searchsorted(time, exposures, side='left')
+        dl4_data = np.zeros((len(stops), grid.nbins, grid.nbins), dtype=np.float64)
+        counts = dl4_data.reshape(len(stops), grid.size)
+        start = 0
+        for i, stop in enumerate(stops):
+            # add the new time slice to the previous cumulative map
+            counts[i] = counts[i-1] if i > 0 else 0
+            counts[i] += np.bincount(pixels[start:stop], minlength=grid.size)
+            start = stop
+        # all exposures smoothed at once
+        return list(smooth_stack(dl4_data, sigma=sigma))
 
-    def get_countmap_in_npy(self, dl3_file, pixelsize=0.02, maproi=5, trange=None, erange=None, sigma=1, npyname='heatmap.npy'):
-        dl3_hdr = self.get_dl3_hdr(dl3_file=dl3_file)
-        pointing = {'ra': float(dl3_hdr['RA_PNT']), 'dec': float(dl3_hdr['DEC_PNT'])}
-        dl3_data = self.get_dl3_data(dl3_file=dl3_file)
-        dl3_data = self.selection_cuts(dl3_data=dl3_data, pointing=pointing, trange=trange, erange=erange, maproi=maproi)
-        if sigma != 0:
-            dl4_data = self.from_dl3_to_dl4(dl3_data=dl3_data, pointing=pointing, maproi=maproi, pixelsize=0.02, sigma=sigma)
+    def get_energy_edges(self, ebins, erange):
+        if type(ebins) == int:
+            edges = np.geomspace(erange[0], erange[1], ebins+1)
         else:
-            dl4_data = self.from_dl3_to_dl4(dl3_data=dl3_data, pointing=pointing, maproi=maproi, pixelsize=pixelsize)
+            edges = np.asarray(ebins, dtype=np.float64)
+        assert np.all(np.diff(edges) > 0), 'energy edges must be strictly increasing'
+        return edges
+
+    def from_dl3_to_dl4_cube(self, dl3_data, pointing, edges, maproi=5, pixelsize=0.02, sigma=0, index=None):
+        ra = dl3_data.field('RA')
+        dec = dl3_data.field('DEC')
+        energy = dl3_data.field('ENERGY')
+        if index is not None:
+            ra, dec, energy = ra[index], dec[index], energy[index]
+        grid = self.get_grid(pointing=pointing, maproi=maproi, pixelsize=pixelsize)
+        pixels, inside = grid.get_flat_index(ra, dec)
+        # energy bin of each event, half-open [E_MIN, E_MAX)
+        layers = np.searchsorted(edges, energy[inside], side='right') - 1
+        valid = (layers >= 0) & (layers < len(edges)-1)
+        pixels = layers[valid] * grid.size + pixels[valid]
+        cube = np.bincount(pixels, minlength=(len(edges)-1) * grid.size).astype(np.float64)
+        cube = cube.reshape(len(edges)-1, grid.nbins, grid.nbins)
+        return smooth_stack(cube, sigma=sigma)
+
+    def get_countcube(self, dl3_file, ebins, pixelsize=0.02, maproi=5, trange=None, erange=None, sigma=1, region='box'):
+        dl3_data = self.get_dl3_data(dl3_file=dl3_file)
+        dl3_hdr = dl3_data.header
+        pointing = {'ra': float(dl3_hdr['RA_PNT']), 'dec': float(dl3_hdr['DEC_PNT'])}
+        hdr_fits = self.store_hdr_in_dict(dl3_hdr=dl3_hdr, maproi=maproi, pixelsize=pixelsize)
+        edges = self.get_energy_edges(ebins=ebins, erange=erange if erange is not None else [hdr_fits['E_MIN'], hdr_fits['E_MAX']])
+        hdr_fits['E_MIN'], hdr_fits['E_MAX'] = float(edges[0]), float(edges[-1])
+        index = self.selection_index(dl3_data=dl3_data, pointing=pointing, trange=trange, erange=erange, maproi=maproi, region=region)
+        cube = self.from_dl3_to_dl4_cube(dl3_data=dl3_data, pointing=pointing, edges=edges, maproi=maproi, pixelsize=pixelsize, sigma=sigma, index=index)
+        return cube, edges, hdr_fits
+
+    def write_countcube_in_fits(self, cube, edges, hdr_fits, template, fitsname='skycube.fits'):
+        hdr = self.get_template(template=template)
+        for k in hdr_fits.keys():
+            hdr[k] = hdr_fits[k]
+        skymap = fits.PrimaryHDU(data=cube, header=hdr)
+        energies = fits.BinTableHDU.from_columns([fits.Column(name='E_MIN', format='1D', unit='TeV', array=edges[:-1]), fits.Column(name='E_MAX', format='1D', unit='TeV', array=edges[1:])], name='ENERGIES')
+        self.write_fits(hdul=fits.HDUList([skymap, energies]), fitsname=fitsname)
+        return self
+
+    def write_countcube_in_npy(self, cube, edges, npyname='skycube.npy'):
+        np.save(npyname, cube, allow_pickle=False)
+        np.save(npyname.replace('.npy', '_energies.npy'), edges, allow_pickle=False)
+        return self
+
+    def get_countcube_in_fits(self, dl3_file, template, ebins, pixelsize=0.02, maproi=5, trange=None, erange=None, sigma=1, fitsname='skycube.fits', region='box'):
+        cube, edges, hdr_fits = self.get_countcube(dl3_file=dl3_file, ebins=ebins, pixelsize=pixelsize, maproi=maproi, trange=trange, erange=erange, sigma=sigma, region=region)
+        self.write_countcube_in_fits(cube=cube, edges=edges, hdr_fits=hdr_fits, template=template, fitsname=fitsname)
+        return
+
+    def get_countcube_in_npy(self, dl3_file, ebins, pixelsize=0.02, maproi=5, trange=None, erange=None, sigma=1, npyname='skycube.npy', region='box'):
+        cube, edges, hdr_fits = self.get_countcube(dl3_file=dl3_file, ebins=ebins, pixelsize=pixelsize, maproi=maproi, trange=trange, erange=erange, sigma=sigma, region=region)
+        self.write_countcube_in_npy(cube=cube, edges=edges, npyname=npyname)
+        return
+
+    def selection_index(self, dl3_data, pointing, trange=None, erange=None, maproi=None, region='box'):
+        index = select_events(dl3_data, pointing=pointing, trange=trange, erange=erange, maproi=maproi, region=region)
+        if len(index) == 0:
+            self.log.warning("Empty photon list selection.")
+        return index
+
+    def selection_cuts(self, dl3_data, pointing, trange=None, erange=None, maproi=None, region='box'):
+        index = self.selection_index(dl3_data=dl3_data, pointing=pointing, trange=trange, erange=erange, maproi=maproi, region=region)
+        return dl3_data[index]
+
+    def write_countmap_in_npy(self, dl4_data, npyname='heatmap.npy'):
         np.save(npyname, dl4_data, allow_pickle=True, fix_imports=True)
+        return self
+
+    def get_countmap_in_npy(self, dl3_file, pixelsize=0.02, maproi=5, trange=None, erange=None, sigma=1, npyname='heatmap.npy', region='box'):
+        dl4_data, hdr_fits = self.get_countmap(dl3_file=dl3_file, pixelsize=pixelsize, maproi=maproi, trange=trange, erange=erange, sigma=sigma, region=region)
+        self.write_countmap_in_npy(dl4_data=dl4_data, npyname=npyname)
+        return
+
+    def write_countmap_in_dataset(self, dl4_data, writer, seed, exposure=0):
+        writer.write(seed, dl4_data, exposure=exposure)
+        return self
+
+    def get_countmap_in_dataset(self, dl3_file, writer, seed, exposure=0, pixelsize=0.02, maproi=5, trange=None, erange=None, sigma=1, region='box'):
+        dl4_data, hdr_fits = self.get_countmap(dl3_file=dl3_file, pixelsize=pixelsize, maproi=maproi, trange=trange, erange=erange, sigma=sigma, region=region)
+        self.write_countmap_in_dataset(dl4_data=dl4_data, writer=writer, seed=seed, exposure=exposure)
+        return
+
+    def get_countcube_in_dataset(self, dl3_file, writer, seed, ebins, exposure=0, pixelsize=0.02, maproi=5, trange=None, erange=None, sigma=1, region='box'):
+        cube, edges, hdr_fits = self.get_countcube(dl3_file=dl3_file, ebins=ebins, pixelsize=pixelsize, maproi=maproi, trange=trange, erange=erange, sigma=sigma, region=region)
+        self.write_countmap_in_dataset(dl4_data=cube, writer=writer, seed=seed, exposure=exposure)
+        return
+
+    def write_countmap_in_sparse(self, counts, hdr_fits, sigma=0, npzname='heatmap.npz', edges=None):
+        # counts are stored before smoothing, sigma is applied by the reader
+        write_sparse_map(npzname, counts, hdr_fits=hdr_fits, sigma=sigma, edges=edges)
+        return self
+
+    def get_countmap_in_sparse(self, dl3_file, pixelsize=0.02, maproi=5, trange=None, erange=None, sigma=1, npzname='heatmap.npz', region='box'):
+        counts, hdr_fits = self.get_countmap(dl3_file=dl3_file, pixelsize=pixelsize, maproi=maproi, trange=trange, erange=erange, sigma=0, region=region)
+        self.write_countmap_in_sparse(counts=counts, hdr_fits=hdr_fits, sigma=sigma, npzname=npzname)
+        return
+
+    def get_countcube_in_sparse(self, dl3_file, ebins, pixelsize=0.02, maproi=5, trange=None, erange=None, sigma=1, npzname='skycube.npz', region='box'):
+        cube, edges, hdr_fits = self.get_countcube(dl3_file=dl3_file, ebins=ebins, pixelsize=pixelsize, maproi=maproi, trange=trange, erange=erange, sigma=0, region=region)
+        self.write_countmap_in_sparse(counts=cube, hdr_fits=hdr_fits, sigma=sigma, npzname=npzname, edges=edges)
         return
@@ -0,0 +1,63 @@
+# *****************************************************************************
+# Copyright (C) 2023 Ambra Di Piano
+# This software is distributed under the terms of the BSD-3-Clause license
+#
+# Authors:
+# Ambra Di Piano <ambra.dipiano@inaf.it>
+# *****************************************************************************
+
+import re
+from os import getpid, stat
+from os.path import join, abspath
+from tempfile import gettempdir
+from functools import lru_cache
+from xml.etree import ElementTree
+
+XML_DECLARATION = '<?xml version="1.0" standalone="no"?>\n'
+
+class ModelTemplate():
+    '''Class that parses a model XML once and renders it with new source coordinates.'''
+    def __init__(self, model, source) -> None:
+        self.model = model
+        self.source = source
+        tree = ElementTree.parse(model)
+        self.parameters = {}
+        for src in tree.getroot().iter('source'):
+            if src.attrib.get('name') != source:
+                continue
+            for parameter in src.iter('parameter'):
+                if parameter.attrib.get('name') in ('RA', 'DEC'):
+                    self.parameters[parameter.attrib['name']] = (float(parameter.attrib['value']), float(parameter.attrib.get('scale', 1)))
+                    # placeholder, replaced at each rendering
+                    parameter.set('value', f"@{parameter.attrib['name']}@")
+        if len(self.parameters) != 2:
+            raise ValueError(f"Source {source} with RA and DEC parameters not found in {model}")
+        text = XML_DECLARATION + ElementTree.tostring(tree.getroot(), encoding='unicode')
+        # text chunks alternated with the parameter names
+        self.parts = re.split('@(RA|DEC)@', text)
+        pass
+
+    def get_ra_dec(self):
+        return self.parameters['RA'][0] * self.parameters['RA'][1], self.parameters['DEC'][0] * self.parameters['DEC'][1]
+
+    def render(self, ra, dec):
+        # values are stored in units of the parameter scale
+        values = {'RA': f"{float(ra) / self.parameters['RA'][1]}", 'DEC': f"{float(dec) / self.parameters['DEC'][1]}"}
+        return ''.join(values[part] if i % 2 else part for i, part in enumerate(self.parts))
+
+    def write(self, ra, dec, filename):
+        with open(filename, 'w+') as f:
+            f.write(self.render(ra, dec))
+        return filename
+
+@lru_cache(maxsize=16)
+def cached_model_template(model, mtime, source):
+    return ModelTemplate(model, source)
+
+def get_model_template(model, source):
+    model = abspath(model)
+    return cached_model_template(model, stat(model).st_mtime_ns, source)
+
+def get_model_tmpfile(name):
+    # one file per process, rewritten at each seed
+    return join(gettempdir(), f'astrort_{getpid()}_{name}.xml')
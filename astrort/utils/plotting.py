@@ -7,14 +7,18 @@
 # *****************************************************************************
 
 import numpy as np
+from os.path import basename
+from multiprocessing import Pool
 import matplotlib as mpl
 mpl.use('Agg')
 import matplotlib.pyplot as plt
 from astropy.io import fits
-from scipy.ndimage import gaussian_filter
 from astropy.wcs import WCS
 from matplotlib.colors import SymLogNorm
 from astropy import units as u
+from astrort.utils.events import read_event_list, select_events
+from astrort.utils.binning import get_sky_grid_from_extent
+from astrort.utils.smoothing import smooth_map
 
 class Plotter():
     def __init__(self, logger) -> None:
@@ -62,15 +66,13 @@ class Plotter():
         return data
 
     def heatmap_with_smoothing(self, x, y, sigma, extent, bins=1000):
-        r = [[extent[0], extent[1]], [extent[2], extent[3]]]
-        heatmap, xedges, yedges = np.histogram2d(x, y, bins=bins)
-        heatmap = gaussian_filter(heatmap, sigma=sigma)
-        return heatmap.T, extent
+        heatmap = get_sky_grid_from_extent(extent=extent, bins=bins).bin(x, y)
+        heatmap = smooth_map(heatmap, sigma=sigma)
+        return heatmap, extent
 
     def heatmap(self, x, y, extent, bins=1000):
-        r = [[extent[0], extent[1]], [extent[2], extent[3]]]
-        heatmap, xedges, yedges = np.histogram2d(x, y, bins=bins)
-        return heatmap.T, extent
+        heatmap = get_sky_grid_from_extent(extent=extent, bins=bins).bin(x, y)
+        return heatmap, extent
 
     def get_extent(self, roi):
         extent = [self.pointing['ra']-roi, self.pointing['ra']+roi, self.pointing['dec']-roi, self.pointing['dec']+roi]
@@ -108,8 +110,8 @@ class Plotter():
         # select counts map
         data = self.phlist_selection_cuts(data=data, trange=trange, erange=erange, roi=roi)
         # axis and binning
-        ra = np.array(data.field('RA')).flatten()
-        dec = np.array(data.field('DEC')).flatten()
+        ra = data.field('RA')
+        dec = data.field('DEC')
         bins = int(roi*2/pixelsize)
         # plot
         fig = plt.figure(figsize=figsize) 
@@ -147,8 +149,8 @@ class Plotter():
         # select counts map
         data = self.phlist_selection_cuts(data=data, trange=trange, erange=erange, roi=roi)
         # axis and binning
-        ra = np.array(data.field('RA')).flatten()
-        dec = np.array(data.field('DEC')).flatten()
+        ra = data.field('RA')
+        dec = data.field('DEC')
         bins = int(roi*2/pixelsize)
         # wcs
         wcs = self.set_wcs(point_ref=bins/2+0.5, pixelsize=pixelsize)
@@ -250,24 +252,152 @@ class Plotter():
         return data, w
 
     def get_phlist_data(self, file):
-        with fits.open(file) as h:
-            try:
-                data = h['EVENTS'].data
-            except KeyError as e:
-                self.log.error(f'Missin "EVENTS" extention, the input file may not be a compatible photon list. {e}')
-                raise KeyError(f'Missin "EVENTS" extention, the input file may not be a compatible photon list. {e}')
-            if len(data) == 0:
-                self.log.warning("Empty photon list.")
+        try:
+            data = read_event_list(file)
+        except KeyError as e:
+            self.log.error(f'Missin "EVENTS" extention, the input file may not be a compatible photon list. {e}')
+            raise KeyError(f'Missin "EVENTS" extention, the input file may not be a compatible photon list. {e}')
+        if len(data) == 0:
+            self.log.warning("Empty photon list.")
         return data
 
-    def phlist_selection_cuts(self, data, trange=None, erange=None, roi=None):
-        if trange != None:
-            data = data[(data['TIME'] > trange[0]) & (data['TIME'] < trange[1])] 
-        if erange != None:
-            data = data[(data['ENERGY'] > erange[0]) & (data['ENERGY'] < erange[1])] 
-        if roi != None:
-            data = data[(np.abs(np.abs(data['RA'])-np.abs(self.pointing['ra'])) < roi)]
-            data = data[(np.abs(np.abs(data['DEC'])-np.abs(self.pointing['dec'])) < roi)]
-        if len(data) == 0:
+    def phlist_selection_cuts(self, data, trange=None, erange=None, roi=None, region='box'):
+        index = select_events(data, pointing=self.pointing, trange=trange, erange=erange, maproi=roi, region=region)
+        if len(index) == 0:
             self.log.warning("Empty photon list selection.")
-        return data
+        return data[index]
+
+def read_skymap_with_wcs(file):
+    with fits.open(file) as h:
+        hdu = h['SKYMAP'] if 'SKYMAP' in h else next(hdu for hdu in h if hdu.data is not None and hdu.data.ndim == 2)
+        return np.array(hdu.data, dtype=np.float64), WCS(hdu.header)
+
+def get_skymap_geometry(data, wcs):
+    # maps of a run differ only by the reference coordinates
+    return (data.shape, tuple(wcs.wcs.ctype), tuple(wcs.wcs.crpix), tuple(wcs.wcs.cdelt))
+
+class SkymapCanvas():
+    '''Class that keeps one figure, WCS axes and colorbar per map geometry and swaps the image data of each map.'''
+    def __init__(self, data, wcs, xlabel='right ascension (deg)', ylabel='declination (deg)', figsize=(10, 10), fontsize=20, cmap='CMRmap', logbar=False) -> None:
+        self.wcs = wcs
+        self.geometry = get_skymap_geometry(data, wcs)
+        self.xlabel, self.ylabel, self.fontsize = xlabel, ylabel, fontsize
+        self.fig = plt.figure(figsize=figsize)
+        self.ax = self.fig.add_subplot(projection=wcs)
+        # same image as Plotter.plot_fits_skymap
+        if logbar:
+            self.img = self.ax.imshow(data, norm=SymLogNorm(1, base=10), origin='lower', interpolation='gaussian', cmap=cmap)
+        else:
+            self.img = self.ax.imshow(data, interpolation='gaussian', cmap=cmap)
+        self.cb = self.fig.colorbar(self.img, ax=self.ax)
+        self.cb.ax.tick_params(labelsize=fontsize)
+        self.cb.set_label('counts', fontsize=fontsize)
+        self.set_axes()
+        pass
+
+    def set_axes(self):
+        self.ax.coords[0].set_format_unit(u.deg)
+        self.ax.coords[1].set_format_unit(u.deg)
+        self.ax.tick_params(axis='both', labelsize=self.fontsize)
+        self.ax.set_xlabel(self.xlabel, fontsize=self.fontsize)
+        self.ax.set_ylabel(self.ylabel, fontsize=self.fontsize)
+        self.ax.set_aspect('equal')
+        self.ax.grid(color='grey', ls='solid')
+        return self
+
+    def accepts(self, data, wcs):
+        return get_skymap_geometry(data, wcs) == self.geometry
+
+    def draw(self, data, wcs, name, title=None):
+        if not np.array_equal(wcs.wcs.crval, self.wcs.wcs.crval):
+            # new reference coordinates rebuild the coordinate frame only
+            self.wcs = wcs
+            self.ax.reset_wcs(wcs)
+            self.set_axes()
+        self.img.set_data(data)
+        self.img.autoscale()
+        self.ax.set_title(title, fontsize=self.fontsize)
+        self.fig.savefig(name)
+        return name
+
+    def close(self):
+        plt.close(self.fig)
+        return self
+
+class SkymapBatchPlotter():
+    '''Class that plots many count maps, reusing the canvas of each map geometry.'''
+    def __init__(self, **kwargs) -> None:
+        self.kwargs = kwargs
+        self.canvases = []
+        pass
+
+    def get_canvas(self, data, wcs):
+        for canvas in self.canvases:
+            if canvas.accepts(data, wcs):
+                return canvas
+        self.canvases.append(SkymapCanvas(data, wcs, **self.kwargs))
+        return self.canvases[-1]
+
+    def plot(self, file, name, title=None):
+        data, wcs = read_skymap_with_wcs(file)
+        return self.get_canvas(data, wcs).draw(data, wcs, name, title=title)
+
+    def plot_files(self, files, names=None, titles=None):
+        names = names if names is not None else [get_plot_name(f) for f in files]
+        titles = titles if titles is not None else [None] * len(files)
+        return [self.plot(f, n, title=t) for f, n, t in zip(files, names, titles)]
+
+    def close(self):
+        for canvas in self.canvases:
+            canvas.close()
+        self.canvases = []
+        return self
+
+def get_plot_name(file, suffix=''):
+    return file.replace('.fits', f'{suffix}.png')
+
+def plot_skymap_chunk(files, names, kwargs):
+    plotter = SkymapBatchPlotter(**kwargs)
+    try:
+        return plotter.plot_files(files, names)
+    finally:
+        plotter.close()
+
+def plot_skymaps(files, names=None, processes=1, **kwargs):
+    # one batch plotter per process, each on a contiguous chunk of maps
+    names = names if names is not None else [get_plot_name(f) for f in files]
+    processes = max(min(processes, len(files)), 1)
+    if processes == 1:
+        return plot_skymap_chunk(files, names, kwargs)
+    chunks = [(list(f), list(n), kwargs) for f, n in zip(np.array_split(np.array(files, dtype=object), processes), np.array_split(np.array(names, dtype=object), processes))]
+    with Pool(processes=processes) as pool:
+        plotmaps = pool.starmap(plot_skymap_chunk, chunks)
+    return [name for chunk in plotmaps for name in chunk]
+
+def plot_contact_sheets(files, prefix, size=64, ncols=8, cmap='CMRmap', logbar=False, titles=None, fontsize=8, panelsize=2):
+    # mosaics of up to size maps per png, the grid is built once and reused for every sheet
+    nrows = -(-min(size, len(files)) // ncols)
+    fig, axes = plt.subplots(nrows, ncols, figsize=(ncols * panelsize, nrows * panelsize), squeeze=False)
+    axes = axes.ravel()
+    images = [None] * len(axes)
+    titles = titles if titles is not None else [basename(f).replace('.fits', '') for f in files]
+    sheets = []
+    for number, start in enumerate(range(0, len(files), size)):
+        for i, ax in enumerate(axes):
+            if start + i >= min(start + size, len(files)):
+                ax.set_visible(False)
+                continue
+            data, wcs = read_skymap_with_wcs(files[start + i])
+            if images[i] is None or images[i].get_array().shape != data.shape:
+                ax.clear()
+                ax.set_axis_off()
+                images[i] = ax.imshow(data, norm=SymLogNorm(1, base=10) if logbar else None, origin='lower', interpolation='nearest', cmap=cmap)
+            images[i].set_data(data)
+            images[i].autoscale()
+            ax.set_title(titles[start + i], fontsize=fontsize)
+            ax.set_visible(True)
+        fig.tight_layout()
+        sheets.append(f'{prefix}_sheet_{number:04d}.png')
+        fig.savefig(sheets[-1])
+    plt.close(fig)
+    return sheets
@@ -0,0 +1,267 @@
+# *****************************************************************************
+# Copyright (C) 2023 Ambra Di Piano
+# This software is distributed under the terms of the BSD-3-Clause license
+#
+# Authors:
+# Ambra Di Piano <ambra.dipiano@inaf.it>
+# *****************************************************************************
+
+import re
+import atexit
+import signal
+import numpy as np
+from time import time
+from os import getpid, makedirs, listdir, replace, remove
+from os.path import isfile, isdir, join
+from shutil import rmtree
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from astrort.utils.dataset import close_datasets
+
+SIMULATION_COLUMNS = ('name', 'seed', 'start', 'stop', 'duration', 'source_ra', 'source_dec', 'point_ra', 'point_dec', 'offset', 'irf', 'fov', 'sim_time')
+MAPPING_COLUMNS = ('name', 'seed', 'exposure', 'center_on', 'pixelsize', 'smooth', 'map_time')
+# rows buffered and seconds waited before an append, unless 'logging' sets them
+FLUSH_ROWS = 100
+FLUSH_TIME = 60
+
+class RecordWriter():
+    '''Class that buffers data rows and appends them to a datfile in blocks.'''
+    def __init__(self, datfile, columns, flush=FLUSH_ROWS, flushtime=FLUSH_TIME, binary=False) -> None:
+        self.datfile = datfile
+        self.columns = tuple(columns)
+        self.flush_rows = flush
+        self.flush_time = flushtime
+        self.binary = binary
+        self.rows = []
+        self.clock = time()
+        # forked children inherit the buffer, only the owner flushes it
+        self.pid = getpid()
+        pass
+
+    def get_binary_folder(self):
+        return get_record_folder(self.datfile)
+
+    def write(self, row):
+        if isinstance(row, dict):
+            row = [row[column] for column in self.columns]
+        assert len(row) == len(self.columns), f"Expected {len(self.columns)} values, found {len(row)}"
+        self.rows.append(row)
+        if len(self.rows) >= self.flush_rows or time() - self.clock >= self.flush_time:
+            self.flush()
+        return self
+
+    def flush(self):
+        if getpid() != self.pid or len(self.rows) == 0:
+            return self
+        rows, self.rows = self.rows, []
+        lines = ''.join(' '.join(f'{value}' for value in row) + '\n' for row in rows)
+        if not isfile(self.datfile):
+            lines = ' '.join(self.columns) + '\n' + lines
+        # a single append per block
+        with open(self.datfile, 'a') as f:
+            f.write(lines)
+        if self.binary:
+            self.write_binary(rows)
+        self.clock = time()
+        return self
+
+    def write_binary(self, rows):
+        columns = {}
+        for name, values in zip(self.columns, zip(*rows)):
+            column = np.asarray(values)
+            if column.dtype.kind == 'O':
+                column = column.astype(str)
+            columns[name] = column
+        write_record_part(self.get_binary_folder(), columns)
+        return self
+
+    def close(self):
+        self.flush()
+        return self
+
+WRITERS = {}
+
+def flush_records():
+    # buffered rows go to disk at batch boundaries, e.g. before a queue batch is completed
+    for writer in list(WRITERS.values()):
+        writer.flush()
+
+def close_records(datfile=None):
+    for key in list(WRITERS.keys()):
+        if datfile is None or key[1] == datfile:
+            WRITERS.pop(key).close()
+
+def flush_writers():
+    # rows and partial dataset shards of this process are kept on exit
+    flush_records()
+    close_datasets()
+
+def handle_signal(signum, frame):
+    flush_writers()
+    # restore the previous behaviour and deliver the signal again
+    signal.signal(signum, HANDLERS.get(signum) or signal.SIG_DFL)
+    signal.raise_signal(signum)
+
+HANDLERS = {}
+
+def install_handlers():
+    # called by the job entry points, library callers keep their own handlers
+    if 'atexit' in HANDLERS:
+        return
+    HANDLERS['atexit'] = atexit.register(flush_writers)
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        try:
+            HANDLERS[signum] = signal.signal(signum, handle_signal)
+        except ValueError:
+            # signals can only be handled from the main thread
+            pass
+
+def open_records(datfile, columns, flush=FLUSH_ROWS, flushtime=FLUSH_TIME, binary=False):
+    # one buffered writer per process and datfile, flushed by flush_records or when closed
+    key = (getpid(), datfile)
+    if key not in WRITERS:
+        WRITERS[key] = RecordWriter(datfile, columns, flush=flush, flushtime=flushtime, binary=binary)
+    return WRITERS[key]
+
+def write_record(datfile, columns, row):
+    # rows go to the writer opened by the job, otherwise straight to the datfile
+    key = (getpid(), datfile)
+    if key in WRITERS:
+        return WRITERS[key].write(row)
+    return RecordWriter(datfile, columns, flush=1).write(row).close()
+
+def get_record_options(configuration):
+    return {'flush': configuration['logging'].get('flush', FLUSH_ROWS), 'flushtime': configuration['logging'].get('flushtime', FLUSH_TIME), 'binary': configuration['logging'].get('binary', False)}
+
+def get_record_folder(datfile):
+    return datfile.replace('.dat', '_records')
+
+def write_record_part(folder, columns):
+    makedirs(folder, exist_ok=True)
+    # each block is a new part, renamed once complete
+    tmpname = join(folder, f'tmp{getpid()}.npz')
+    np.savez(tmpname, **columns)
+    replace(tmpname, join(folder, f'part_{len(get_record_parts(folder)):06d}.npz'))
+    return folder
+
+def get_record_parts(folder):
+    return sorted(join(folder, f) for f in listdir(folder) if f.startswith('part_') and f.endswith('.npz'))
+
+def read_records(folder):
+    import pandas as pd
+    parts = []
+    for part in get_record_parts(folder):
+        with np.load(part, allow_pickle=False) as data:
+            parts.append(pd.DataFrame({name: data[name] for name in data.files}))
+    if len(parts) == 0:
+        return pd.DataFrame()
+    return pd.concat(parts, ignore_index=True)
+
+def is_record_folder(folder):
+    return isdir(folder) and len(get_record_parts(folder)) > 0
+
+def get_table_columns(table):
+    columns = {}
+    for name in table.columns:
+        column = table[name].to_numpy()
+        if column.dtype.kind in 'OT':
+            column = column.astype(str)
+        columns[name] = column
+    return columns
+
+def merge_record_folders(folders, folder):
+    folders = [f for f in folders if is_record_folder(f)]
+    if len(folders) == 0:
+        return folder
+    import pandas as pd
+    table = pd.concat([read_records(f) for f in folders], ignore_index=True)
+    table = table.sort_values(by='seed', kind='stable')
+    write_record_part(folder, get_table_columns(table))
+    for f in folders:
+        rmtree(f)
+    return folder
+
+def drop_records(datfile, seeds):
+    # rows of seeds that run again, so that a resumed job keeps one row per seed
+    import pandas as pd
+    if not isfile(datfile):
+        return 0
+    table = pd.read_csv(datfile, sep=' ')
+    mask = np.isin(table['seed'].to_numpy(), seeds)
+    if mask.any():
+        tmpname = f'{datfile}.tmp{getpid()}'
+        table[~mask].to_csv(tmpname, index=False, sep=' ', na_rep=np.nan)
+        replace(tmpname, datfile)
+    folder = get_record_folder(datfile)
+    if is_record_folder(folder):
+        records = read_records(folder)
+        stale = np.isin(records['seed'].to_numpy(), seeds)
+        if stale.any():
+            rmtree(folder)
+            if not stale.all():
+                write_record_part(folder, get_table_columns(records[~stale]))
+    return int(mask.sum())
+
+def sort_datfiles(datfiles):
+    # job_2 before job_10
+    return sorted(datfiles, key=lambda f: [int(t) if t.isdigit() else t for t in re.split(r'(\d+)', f)])
+
+def prefetch_tables(datfiles, threads=4):
+    # at most threads tables are held in memory at once, yielded in order
+    import pandas as pd
+    with ThreadPoolExecutor(max_workers=max(threads, 1)) as pool:
+        queue = deque()
+        for datfile in datfiles:
+            queue.append((datfile, pool.submit(pd.read_csv, datfile, sep=' ')))
+            if len(queue) >= max(threads, 1):
+                datfile, table = queue.popleft()
+                yield datfile, table.result()
+        while len(queue) > 0:
+            datfile, table = queue.popleft()
+            yield datfile, table.result()
+
+def get_seed_gaps(seeds):
+    seeds = np.unique(np.asarray(seeds, dtype=np.int64))
+    if len(seeds) == 0:
+        return []
+    jumps = np.flatnonzero(np.diff(seeds) > 1)
+    return [(int(seeds[i]) + 1, int(seeds[i+1]) - 1) for i in jumps]
+
+def get_record_keys(table):
+    # one row per seed, and per exposure for mapping data
+    keys = np.zeros(0 if table is None else len(table), dtype=[('seed', np.int64), ('exposure', np.float64)])
+    if table is not None:
+        keys['seed'] = table['seed'].to_numpy()
+        if 'exposure' in table.columns:
+            keys['exposure'] = table['exposure'].to_numpy()
+    return keys
+
+def merge_record_tables(datfiles, merger, log, threads=4, binary=False):
+    if isfile(merger):
+        log.warning(f"Merger output already exists, overwrite {merger}")
+        remove(merger)
+    folder = get_record_folder(merger)
+    if binary and isdir(folder):
+        rmtree(folder)
+    seen, duplicates, lines = get_record_keys(None), 0, 0
+    for datfile, table in prefetch_tables(sort_datfiles(datfiles), threads=threads):
+        log.info(f"Collect data from {datfile}")
+        # first row of each key within the table and across the tables before it
+        keys = get_record_keys(table)
+        mask = np.zeros(len(table), dtype=bool)
+        mask[np.unique(keys, return_index=True)[1]] = True
+        mask &= ~np.isin(keys, seen)
+        duplicates += int(np.sum(~mask))
+        table = table[mask]
+        seen = np.unique(np.concatenate((seen, keys[mask])))
+        table.to_csv(merger, mode='a', index=False, header=not isfile(merger), sep=' ', na_rep=np.nan)
+        if binary and len(table) > 0:
+            write_record_part(folder, get_table_columns(table))
+        lines += len(table)
+        log.info(f"Lines in data: {lines}")
+    if duplicates > 0:
+        log.warning(f"Dropped {duplicates} duplicated rows")
+    gaps = get_seed_gaps(seen['seed'])
+    for start, stop in gaps:
+        log.warning(f"Missing seeds [{start}, {stop}]")
+    return {'lines': lines, 'duplicates': duplicates, 'gaps': gaps}
@@ -0,0 +1,100 @@
+# *****************************************************************************
+# Copyright (C) 2023 Ambra Di Piano
+# This software is distributed under the terms of the BSD-3-Clause license
+#
+# Authors:
+# Ambra Di Piano <ambra.dipiano@inaf.it>
+# *****************************************************************************
+
+import json
+import numpy as np
+from os import makedirs
+from os.path import join, isdir, isfile
+
+REPLICA_MANIFEST = 'replica.json'
+
+class ReplicaPlan():
+    '''Class that holds a replica table as seed-sorted columns, for direct lookups by seed.'''
+    def __init__(self, columns) -> None:
+        self.columns = columns
+        self.seeds = columns['seed']
+        pass
+
+    def names(self):
+        return list(self.columns.keys())
+
+    def index(self, seed):
+        # first row of the seed, as the pandas lookup did
+        i = np.searchsorted(self.seeds, seed, side='left')
+        if i == len(self.seeds) or self.seeds[i] != seed:
+            raise KeyError(f"Seed {seed} not found in replica plan")
+        return i
+
+    def get(self, seed, column):
+        return self.columns[column][self.index(seed)].item()
+
+    def row(self, seed):
+        i = self.index(seed)
+        return {name: column[i].item() for name, column in self.columns.items()}
+
+    def __contains__(self, seed):
+        i = np.searchsorted(self.seeds, seed, side='left')
+        return i < len(self.seeds) and self.seeds[i] == seed
+
+    def __len__(self):
+        return len(self.seeds)
+
+    def subset(self, start, stop):
+        # contiguous slice of the sorted columns, views on memory maps stay lazy
+        i = np.searchsorted(self.seeds, start, side='left')
+        j = np.searchsorted(self.seeds, stop, side='right')
+        return ReplicaPlan({name: column[i:j] for name, column in self.columns.items()})
+
+    def save(self, folder, metadata=None):
+        makedirs(folder, exist_ok=True)
+        for name, column in self.columns.items():
+            np.save(join(folder, f'{name}.npy'), np.asarray(column), allow_pickle=False)
+        with open(join(folder, REPLICA_MANIFEST), 'w+') as f:
+            json.dump({'columns': self.names(), 'rows': len(self), 'metadata': metadata}, f)
+        return folder
+
+def get_replica_columns(table):
+    columns = {}
+    for name in table.columns:
+        column = table[name].to_numpy()
+        if column.dtype.kind in 'OT':
+            # fixed width strings can be memory mapped
+            column = column.astype(str)
+        columns[name] = column
+    return columns
+
+def read_replica_table(filename):
+    import pandas as pd
+    table = pd.read_csv(filename, sep=' ', header=0)
+    table = table.sort_values('seed', kind='stable')
+    return ReplicaPlan(get_replica_columns(table))
+
+def read_replica_store(folder):
+    with open(join(folder, REPLICA_MANIFEST)) as f:
+        manifest = json.load(f)
+    return ReplicaPlan({name: np.load(join(folder, f'{name}.npy'), mmap_mode='r', allow_pickle=False) for name in manifest['columns']})
+
+def read_replica_metadata(folder):
+    with open(join(folder, REPLICA_MANIFEST)) as f:
+        return json.load(f).get('metadata')
+
+def is_replica_store(filename):
+    return isdir(filename) and isfile(join(filename, REPLICA_MANIFEST))
+
+def load_replica_plan(filename, seeds=None):
+    if is_replica_store(filename):
+        plan = read_replica_store(filename)
+    else:
+        plan = read_replica_table(filename)
+    # restrict to the seed range of the job
+    if seeds is not None and len(seeds) > 0:
+        plan = plan.subset(min(seeds), max(seeds))
+    return plan
+
+def convert_replica_plan(filename, folder):
+    return read_replica_table(filename).save(folder)
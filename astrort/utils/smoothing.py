@@ -0,0 +1,122 @@
+# *****************************************************************************
+# Copyright (C) 2023 Ambra Di Piano
+# This software is distributed under the terms of the BSD-3-Clause license
+#
+# Authors:
+# Ambra Di Piano <ambra.dipiano@inaf.it>
+# *****************************************************************************
+
+import numpy as np
+from functools import lru_cache
+from scipy.ndimage import correlate1d
+
+# a stamp costs about 16 filter passes per pixel, see is_sparse
+SPARSE_FACTOR = 1 / 16
+
+def gaussian_kernel1d(sigma, truncate=4.0):
+    # same weights as scipy.ndimage.gaussian_filter
+    radius = int(truncate * float(sigma) + 0.5)
+    x = np.arange(-radius, radius + 1)
+    phi = np.exp(-0.5 / (float(sigma) * float(sigma)) * x ** 2)
+    phi /= phi.sum()
+    return phi
+
+class GaussianSmoother():
+    '''Class that applies the scipy gaussian filter (reflect mode) to maps and stacks of maps.'''
+    def __init__(self, sigma, truncate=4.0) -> None:
+        self.sigma = sigma
+        self.truncate = truncate
+        self.kernel = gaussian_kernel1d(sigma, truncate)
+        self.radius = len(self.kernel) // 2
+        self.stamps = {}
+        pass
+
+    def filter(self, data, axes):
+        # separable filter, one pass per axis as gaussian_filter does
+        output = np.asarray(data, dtype=np.float64)
+        for axis in axes:
+            output = correlate1d(output, self.kernel, axis=axis, mode='reflect')
+        return output
+
+    def smooth_stack(self, stack, out=None):
+        # dense maps of a (N, H, W) stack in two passes, sparse maps with stamps
+        stack = np.asarray(stack, dtype=np.float64)
+        if out is None:
+            out = np.empty(stack.shape, dtype=np.float64)
+        sparse = np.array([self.is_sparse(heatmap) for heatmap in stack], dtype=bool)
+        if not sparse.all():
+            out[~sparse] = self.filter(stack[~sparse], axes=(-2, -1))
+        for i in np.flatnonzero(sparse):
+            out[i] = self.splat(stack[i])
+        return out
+
+    def get_stamps(self, nbins):
+        # response of each pixel to a unit count, as offsets [-radius, radius] from the pixel
+        if nbins not in self.stamps:
+            response = correlate1d(np.eye(nbins), self.kernel, axis=0, mode='reflect')
+            stamps = np.zeros((nbins, 2*self.radius + 1))
+            for offset in range(-self.radius, self.radius + 1):
+                pixels = np.arange(max(0, -offset), min(nbins, nbins - offset))
+                stamps[pixels, offset + self.radius] = response[pixels + offset, pixels]
+            self.stamps[nbins] = stamps
+        return self.stamps[nbins]
+
+    def splat_pixels(self, pixels, shape, weights=None):
+        # add a kernel stamp at each flat pixel index, repeated pixels sum up
+        nrows, ncols = shape
+        ys, xs = np.divmod(np.asarray(pixels, dtype=np.intp), ncols)
+        ky, kx = self.get_stamps(nrows)[ys], self.get_stamps(ncols)[xs]
+        if weights is not None:
+            ky = ky * np.asarray(weights, dtype=np.float64)[:, None]
+        # stamp entries outside the map have zero weight, clipping keeps them in bounds
+        rows = np.clip(ys[:, None] + np.arange(-self.radius, self.radius + 1), 0, nrows - 1)
+        cols = np.clip(xs[:, None] + np.arange(-self.radius, self.radius + 1), 0, ncols - 1)
+        index = (rows * ncols)[:, :, None] + cols[:, None, :]
+        values = ky[:, :, None] * kx[:, None, :]
+        heatmap = np.bincount(index.ravel(), weights=values.ravel(), minlength=nrows * ncols)
+        return heatmap.reshape(nrows, ncols)
+
+    def splat(self, heatmap):
+        pixels = np.flatnonzero(heatmap)
+        return self.splat_pixels(pixels, heatmap.shape, weights=heatmap.ravel()[pixels])
+
+    def is_sparse_count(self, count, shape):
+        # reflections are only handled within one kernel radius of the borders
+        width = 2*self.radius + 1
+        if width > min(shape):
+            return False
+        # stamps cost width**2 per count, the filter 2*width per pixel
+        return count * width < SPARSE_FACTOR * 2 * shape[0] * shape[1]
+
+    def is_sparse(self, heatmap):
+        return self.is_sparse_count(np.count_nonzero(heatmap), heatmap.shape)
+
+    def smooth(self, heatmap):
+        heatmap = np.asarray(heatmap, dtype=np.float64)
+        if heatmap.ndim == 2 and self.is_sparse(heatmap):
+            return self.splat(heatmap)
+        return self.filter(heatmap, axes=range(heatmap.ndim))
+
+@lru_cache(maxsize=8)
+def get_gaussian_smoother(sigma, truncate=4.0):
+    return GaussianSmoother(sigma, truncate)
+
+def smooth_map(heatmap, sigma):
+    if sigma == 0:
+        return heatmap
+    return get_gaussian_smoother(sigma).smooth(heatmap)
+
+def smooth_pixels(pixels, shape, sigma):
+    # counts map of flat pixel indices, stamped directly when there are few
+    if sigma != 0 and get_gaussian_smoother(sigma).is_sparse_count(len(pixels), shape):
+        return get_gaussian_smoother(sigma).splat_pixels(pixels, shape)
+    heatmap = np.bincount(pixels, minlength=shape[0] * shape[1]).astype(np.float64).reshape(shape)
+    return smooth_map(heatmap, sigma)
+
+def smooth_stack(stack, sigma, out=None):
+    if sigma == 0:
+        if out is None or out is stack:
+            return stack
+        out[...] = stack
+        return out
+    return get_gaussian_smoother(sigma).smooth_stack(stack, out=out)
@@ -0,0 +1,65 @@
+# *****************************************************************************
+# Copyright (C) 2023 Ambra Di Piano
+# This software is distributed under the terms of the BSD-3-Clause license
+#
+# Authors:
+# Ambra Di Piano <ambra.dipiano@inaf.it>
+# *****************************************************************************
+
+import json
+import numpy as np
+from astrort.utils.smoothing import smooth_map, smooth_stack, get_gaussian_smoother
+
+def get_sparse_header(hdr_fits):
+    # header cards as plain python values
+    return json.dumps({k: v.item() if hasattr(v, 'item') else v for k, v in hdr_fits.items()})
+
+def write_sparse_map(npzname, counts, hdr_fits=None, sigma=0, edges=None):
+    # raw counts as flat indices (COO), smoothing is applied when densifying
+    counts = np.asarray(counts)
+    indices = np.flatnonzero(counts)
+    values = counts.ravel()[indices]
+    if np.all(values == np.round(values)) and (len(values) == 0 or values.max() < 2**32):
+        values = values.astype(np.uint32)
+    columns = {'indices': indices.astype(np.uint32 if counts.size < 2**32 else np.uint64), 'counts': values, 'shape': np.array(counts.shape, dtype=np.int64), 'sigma': np.float64(sigma), 'header': np.array(get_sparse_header(hdr_fits or {}))}
+    if edges is not None:
+        columns['energies'] = np.asarray(edges, dtype=np.float64)
+    with open(npzname, 'wb') as f:
+        np.savez(f, **columns)
+    return npzname
+
+def read_sparse_map(npzname):
+    with np.load(npzname, allow_pickle=False) as data:
+        sparse = {'indices': data['indices'], 'counts': data['counts'], 'shape': tuple(int(n) for n in data['shape']), 'sigma': float(data['sigma']), 'header': json.loads(str(data['header']))}
+        if 'energies' in data.files:
+            sparse['energies'] = data['energies']
+    return sparse
+
+def densify_sparse_map(sparse, smooth=True, out=None):
+    if isinstance(sparse, str):
+        sparse = read_sparse_map(sparse)
+    shape, sigma = sparse['shape'], sparse['sigma'] if smooth else 0
+    if out is None:
+        out = np.empty(shape, dtype=np.float64)
+    assert out.shape == shape, f"Buffer shape {out.shape} does not match map shape {shape}"
+    if sigma != 0 and len(shape) == 2 and get_gaussian_smoother(sigma).is_sparse_count(len(sparse['indices']), shape):
+        # stamps straight from the stored pixels
+        out[...] = get_gaussian_smoother(sigma).splat_pixels(sparse['indices'], shape, weights=sparse['counts'])
+        return out
+    out[...] = 0
+    out[np.unravel_index(sparse['indices'], shape)] = sparse['counts']
+    # same smoothing as the dense maps
+    if sigma != 0 and len(shape) == 3:
+        smooth_stack(out, sigma, out=out)
+    elif sigma != 0:
+        out[...] = smooth_map(out, sigma)
+    return out
+
+def read_sparse_batch(npznames, out=None, smooth=True):
+    # densify straight into a preallocated (N, H, W) buffer
+    for i, npzname in enumerate(npznames):
+        sparse = read_sparse_map(npzname)
+        if out is None:
+            out = np.zeros((len(npznames),) + sparse['shape'], dtype=np.float64)
+        densify_sparse_map(sparse, smooth=smooth, out=out[i])
+    return out
@@ -0,0 +1,107 @@
+# *****************************************************************************
+# Copyright (C) 2023 Ambra Di Piano
+# This software is distributed under the terms of the BSD-3-Clause license
+#
+# Authors:
+# Ambra Di Piano <ambra.dipiano@inaf.it>
+# *****************************************************************************
+
+import zlib
+import struct
+import numpy as np
+from os.path import splitext
+from functools import lru_cache
+
+# segment data of the matplotlib colormaps, as (x, y0, y1) knots per channel
+COLORMAPS = {
+    'CMRmap': {'red': ((0.0, 0.0, 0.0), (0.125, 0.15, 0.15), (0.25, 0.3, 0.3), (0.375, 0.6, 0.6), (0.5, 1.0, 1.0), (0.625, 0.9, 0.9), (0.75, 0.9, 0.9), (0.875, 0.9, 0.9), (1.0, 1.0, 1.0)),
+               'green': ((0.0, 0.0, 0.0), (0.125, 0.15, 0.15), (0.25, 0.15, 0.15), (0.375, 0.2, 0.2), (0.5, 0.25, 0.25), (0.625, 0.5, 0.5), (0.75, 0.75, 0.75), (0.875, 0.9, 0.9), (1.0, 1.0, 1.0)),
+               'blue': ((0.0, 0.0, 0.0), (0.125, 0.5, 0.5), (0.25, 0.75, 0.75), (0.375, 0.5, 0.5), (0.5, 0.15, 0.15), (0.625, 0.0, 0.0), (0.75, 0.1, 0.1), (0.875, 0.5, 0.5), (1.0, 1.0, 1.0))},
+    'gray': {'red': ((0.0, 0, 0), (1.0, 1, 1)), 'green': ((0.0, 0, 0), (1.0, 1, 1)), 'blue': ((0.0, 0, 0), (1.0, 1, 1))},
+}
+
+@lru_cache(maxsize=8)
+def get_colormap_lut(cmap='CMRmap', size=256):
+    # same table and byte conversion as matplotlib LinearSegmentedColormap
+    if cmap not in COLORMAPS:
+        raise ValueError(f"Invalid thumbnail colormap {cmap}, available {list(COLORMAPS)}")
+    lut = np.stack([get_channel_lut(COLORMAPS[cmap][channel], size) for channel in ('red', 'green', 'blue')], axis=-1)
+    return (lut * 255).astype(np.uint8)
+
+def get_channel_lut(knots, size):
+    # linear segments between knots, in the matplotlib order of operations
+    x, y0, y1 = np.array(knots, dtype=np.float64).T
+    x = x * (size - 1)
+    xind = (size - 1) * np.linspace(0, 1, size)
+    ind = np.searchsorted(x, xind)[1:-1]
+    distance = (xind[1:-1] - x[ind - 1]) / (x[ind] - x[ind - 1])
+    return np.clip(np.concatenate([[y1[0]], distance * (y0[ind] - y1[ind - 1]) + y1[ind - 1], [y0[-1]]]), 0.0, 1.0)
+
+def symlog_transform(data, linthresh=1, base=10, linscale=1):
+    # matplotlib SymLogNorm transform, linear within linthresh
+    linscale = linscale / (1 - 1 / base)
+    data = np.asarray(data, dtype=np.float64)
+    magnitude = np.abs(data)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        logs = np.sign(data) * linthresh * (linscale + np.log(magnitude / linthresh) / np.log(base))
+    return np.where(magnitude > linthresh, logs, data * linscale)
+
+def normalise_map(data, norm='symlog', vmin=None, vmax=None):
+    # scaled to [0, 1] between the map extremes, as autoscaled images
+    data = np.asarray(data, dtype=np.float64)
+    vmin = np.nanmin(data) if vmin is None else vmin
+    vmax = np.nanmax(data) if vmax is None else vmax
+    if norm == 'symlog':
+        data, vmin, vmax = symlog_transform(data), symlog_transform(vmin), symlog_transform(vmax)
+    elif norm != 'linear':
+        raise ValueError(f"Invalid thumbnail norm {norm}, available ['symlog', 'linear']")
+    if vmax == vmin:
+        return np.zeros(data.shape)
+    return (data - vmin) / (vmax - vmin)
+
+def render_thumbnail(data, norm='symlog', cmap='CMRmap', scale=1):
+    # rgb image with the first row at the bottom, as origin lower
+    lut = get_colormap_lut(cmap)
+    index = (normalise_map(data, norm=norm) * len(lut)).astype(np.intp)
+    rgb = lut[np.clip(index, 0, len(lut) - 1)][::-1]
+    if scale > 1:
+        rgb = rgb.repeat(scale, axis=0).repeat(scale, axis=1)
+    return rgb
+
+def get_png_chunk(tag, content):
+    return struct.pack('>I', len(content)) + tag + content + struct.pack('>I', zlib.crc32(tag + content) & 0xffffffff)
+
+def write_png(filename, rgb, level=1):
+    # 8 bit rgb, no row filters
+    height, width = rgb.shape[:2]
+    rows = np.zeros((height, width * 3 + 1), dtype=np.uint8)
+    rows[:, 1:] = rgb.reshape(height, width * 3)
+    header = struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)
+    with open(filename, 'wb') as f:
+        f.write(b'\x89PNG\r\n\x1a\n')
+        f.write(get_png_chunk(b'IHDR', header))
+        f.write(get_png_chunk(b'IDAT', zlib.compress(rows.tobytes(), level)))
+        f.write(get_png_chunk(b'IEND', b''))
+    return filename
+
+def read_map_data(file):
+    if file.endswith('.npy'):
+        return np.load(file)
+    elif file.endswith('.npz'):
+        from astrort.utils.sparse import densify_sparse_map
+        return densify_sparse_map(file)
+    from astropy.io import fits
+    with fits.open(file) as h:
+        hdu = h['SKYMAP'] if 'SKYMAP' in h else next(hdu for hdu in h if hdu.data is not None and hdu.data.ndim == 2)
+        return np.array(hdu.data, dtype=np.float64)
+
+def get_thumbnail_name(file):
+    return splitext(file)[0] + '.png'
+
+def render_thumbnails(files, names=None, norm='symlog', cmap='CMRmap', scale=1, level=1):
+    # maps given as files or as arrays, e.g. the rows of a stack
+    names = names if names is not None else [get_thumbnail_name(f) for f in files]
+    for file, name in zip(files, names):
+        data = read_map_data(file) if isinstance(file, str) else file
+        write_png(name, render_thumbnail(data, norm=norm, cmap=cmap, scale=scale), level=level)
+    return names
@@ -8,12 +8,18 @@
 
 import random
 import numpy as np
-from os import listdir
-from os.path import join, expandvars, dirname, abspath
+from os import listdir, access, W_OK
+from tempfile import mkdtemp
+from os.path import join, expandvars, dirname, abspath, basename, isdir
+from astrort.utils.irf import get_irf_catalog
 
 def map_template():
     return join(dirname(abspath(__file__)).replace('utils', 'templates'), 'base_empty_map.fits')
 
+def get_map_extension(save):
+    # sparse maps are numpy archives
+    return 'npz' if save == 'sparse' else save
+
 def seeds_to_string_formatter_files(samples, output, name, seed, ext, suffix=None):
     if samples < 1e3:
         name = join(output, f"{name}_{seed:03d}.{ext}")
@@ -25,7 +31,7 @@ def seeds_to_string_formatter_files(samples, output, name, seed, ext, suffix=Non
         name = join(output, f"{name}_{seed}.{ext}")
     # suffix
     if suffix is not None:
-        name.replace(f'.{ext}', f'_{suffix}.{ext}')
+        name = name.replace(f'.{ext}', f'_{suffix}.{ext}')
     return name
 
 def seeds_to_string_formatter(samples, name, seed):
@@ -72,16 +78,37 @@ def adjust_tev_range_to_irf(erange, irf):
     return erange
 
 def select_random_irf(array, prod, filter=None):
-    path = join(expandvars('$CALDB'), f'data/cta/{prod}/bcf')
-    irfs = listdir(path)
-    if filter is None:
-        irf = random.choice([i for i in irfs if array.lower() in i.lower() and '0.5h' in i.lower()])
-    else:
-        irf = random.choice([i for i in irfs if array.lower() in i.lower() and '0.5h' in i.lower() and filter.lower() in i.lower()])
+    irf = random.choice(get_irf_catalog(prod).select(array, filter=filter))
     return irf
 
 def get_all_seeds(simulator):
     start_seed = simulator['seed']
     samples = simulator['samples']
     seeds = np.arange(start_seed, samples+start_seed, step=1)
-    return seeds
\ No newline at end of file
+    return seeds
+
+def split_seeds(seeds, workers):
+    chunks = np.array_split(np.asarray(seeds), workers)
+    return [chunk for chunk in chunks if len(chunk) > 0]
+
+def get_worker_datfile(datfile, worker):
+    return datfile.replace('.dat', f'_worker_{worker+1}.dat')
+
+def get_fused_datfile(configuration, datfile):
+    return join(configuration['mapper']['output'], basename(datfile).replace('simulator', 'mapper'))
+
+def get_fused_folder():
+    # event lists of the fused mode stay in memory backed storage when available
+    if isdir('/dev/shm') and access('/dev/shm', W_OK):
+        return mkdtemp(prefix='astrort_', dir='/dev/shm')
+    return mkdtemp(prefix='astrort_')
+
+def keep_fused_dl3(seed, fraction):
+    # drawn from the seed, it does not touch the simulation random state
+    return fraction > 0 and np.random.default_rng(seed).random() < fraction
+
+def get_worker_datfiles(datfile):
+    folder, prefix = dirname(datfile), basename(datfile).replace('.dat', '_worker_')
+    if not isdir(folder):
+        return []
+    return sorted(join(folder, f) for f in listdir(folder) if f.startswith(prefix) and f.endswith('.dat'))
@@ -0,0 +1,122 @@
+# *****************************************************************************
+# Copyright (C) 2023 Ambra Di Piano
+# This software is distributed under the terms of the BSD-3-Clause license
+#
+# Authors:
+# Ambra Di Piano <ambra.dipiano@inaf.it>
+# *****************************************************************************
+
+import sqlite3
+import numpy as np
+from time import time
+from os import getpid, makedirs
+from os.path import dirname, abspath
+from socket import gethostname
+
+class SeedQueue():
+    '''Class that hands out batches of seeds from a SQLite queue shared by workers and nodes.'''
+    def __init__(self, database, lease=3600, timeout=600) -> None:
+        self.database = database
+        self.lease = lease
+        makedirs(dirname(abspath(database)), exist_ok=True)
+        # transactions are opened explicitly, one writer at a time
+        self.connection = sqlite3.connect(database, timeout=timeout, isolation_level=None)
+        self.connection.execute('CREATE TABLE IF NOT EXISTS batches (id INTEGER PRIMARY KEY, start INTEGER, stop INTEGER, status TEXT, owner TEXT, expires REAL, attempts INTEGER)')
+        pass
+
+    def close(self):
+        self.connection.close()
+        return self
+
+    def get_owner(self):
+        return f'{gethostname()}:{getpid()}'
+
+    def populate(self, seeds, batch=100):
+        seeds = np.unique(np.asarray(seeds, dtype=np.int64))
+        # contiguous ranges of at most batch seeds
+        ranges = []
+        for block in np.split(seeds, np.flatnonzero(np.diff(seeds) > 1) + 1):
+            for i in range(0, len(block), batch):
+                ranges.append((int(block[i]), int(block[min(i + batch, len(block)) - 1]) + 1))
+        self.connection.execute('BEGIN IMMEDIATE')
+        try:
+            # the first worker fills the queue, the others find it already filled
+            if self.connection.execute('SELECT COUNT(*) FROM batches').fetchone()[0] == 0:
+                self.connection.executemany("INSERT INTO batches (start, stop, status, attempts) VALUES (?, ?, 'todo', 0)", ranges)
+            self.connection.execute('COMMIT')
+        except Exception:
+            self.connection.execute('ROLLBACK')
+            raise
+        return self
+
+    def claim(self, owner=None):
+        owner = owner if owner is not None else self.get_owner()
+        now = time()
+        self.connection.execute('BEGIN IMMEDIATE')
+        try:
+            # expired leases go back to the queue
+            self.connection.execute("UPDATE batches SET status = 'todo', owner = NULL WHERE status = 'claimed' AND expires < ?", (now,))
+            batch = self.connection.execute("SELECT id, start, stop FROM batches WHERE status = 'todo' ORDER BY id LIMIT 1").fetchone()
+            if batch is not None:
+                self.connection.execute("UPDATE batches SET status = 'claimed', owner = ?, expires = ?, attempts = attempts + 1 WHERE id = ?", (owner, now + self.lease, batch[0]))
+            self.connection.execute('COMMIT')
+        except Exception:
+            self.connection.execute('ROLLBACK')
+            raise
+        if batch is None:
+            return None
+        return batch[0], np.arange(batch[1], batch[2])
+
+    def renew(self, batch_id, owner=None):
+        # called between seeds, a lease taken over by another worker stops the batch
+        owner = owner if owner is not None else self.get_owner()
+        renewed = self.connection.execute("UPDATE batches SET expires = ? WHERE id = ? AND status = 'claimed' AND owner = ?", (time() + self.lease, batch_id, owner)).rowcount
+        if renewed == 0:
+            raise RuntimeError(f"Lease of batch {batch_id} expired and was claimed by another worker, increase 'lease'")
+        return self
+
+    def complete(self, batch_id, owner=None):
+        owner = owner if owner is not None else self.get_owner()
+        self.connection.execute("UPDATE batches SET status = 'done', expires = NULL WHERE id = ? AND status = 'claimed' AND owner = ?", (batch_id, owner))
+        return self
+
+    def release(self, batch_id, owner=None):
+        owner = owner if owner is not None else self.get_owner()
+        self.connection.execute("UPDATE batches SET status = 'todo', owner = NULL, expires = NULL WHERE id = ? AND status = 'claimed' AND owner = ?", (batch_id, owner))
+        return self
+
+    def status(self):
+        counts = {'todo': 0, 'claimed': 0, 'done': 0}
+        for status, count in self.connection.execute('SELECT status, COUNT(*) FROM batches GROUP BY status'):
+            counts[status] = count
+        return counts
+
+    def seeds(self):
+        # all seeds of the queue, whatever their status
+        ranges = self.connection.execute('SELECT start, stop FROM batches ORDER BY id').fetchall()
+        return np.concatenate([np.arange(start, stop) for start, stop in ranges]) if len(ranges) else np.empty(0, dtype=np.int64)
+
+    def batches(self, owner=None, before_complete=None):
+        while True:
+            claimed = self.claim(owner=owner)
+            if claimed is None:
+                return
+            batch_id, seeds = claimed
+            try:
+                yield batch_id, seeds
+            except BaseException:
+                self.release(batch_id, owner=owner)
+                raise
+            # outputs of the batch must be on disk before it is marked done
+            if before_complete is not None:
+                before_complete()
+            self.complete(batch_id, owner=owner)
+
+def open_seed_queue(configuration, mode, seeds=None):
+    # 'lease' is the time in seconds a worker holds a batch, renewed after each seed
+    if configuration[mode].get('queue') is None:
+        return None
+    queue = SeedQueue(configuration[mode]['queue'], lease=configuration[mode].get('lease', 3600))
+    if seeds is not None:
+        queue.populate(seeds, batch=configuration[mode].get('batch', 100))
+    return queue
@@ -6,18 +6,20 @@
 # Ambra Di Piano <ambra.dipiano@inaf.it>
 # *****************************************************************************
 
+import json
 import yaml
 import numpy as np
-import pandas as pd
-import astropy.units as u
-from os.path import dirname, abspath, join, basename, isfile
-from shutil import copyfile
-from rtasci.lib.RTAManageXml import ManageXml
-from astropy.coordinates import SkyCoord 
+from time import time
+from os import remove, listdir, getpid
+from os.path import dirname, abspath, join, basename, isfile, isdir
 from astrort.utils.utils import *
 from astrort.configure.check_configuration import CheckConfiguration
-from astrort.utils.mapping import Mapper
-from astrort.utils.plotting import Plotter
+from astrort.utils.thumbnail import render_thumbnails
+from astrort.utils.models import get_model_template, get_model_tmpfile
+from astrort.utils.irf import get_irf_catalog
+from astrort.utils.replica import ReplicaPlan, is_replica_store, load_replica_plan, read_replica_metadata
+from astrort.utils.dataset import MapDataset, open_dataset, get_dataset_folder, get_dataset_options
+from astrort.utils.records import write_record, drop_records, merge_record_folders, merge_record_tables, get_record_folder, SIMULATION_COLUMNS, MAPPING_COLUMNS
 
 def load_yaml_conf(yamlfile):
     with open(yamlfile) as f:
@@ -25,18 +27,79 @@ def load_yaml_conf(yamlfile):
         CheckConfiguration(configuration=configuration)
     return configuration
 
-def execute_mapper_no_visibility(configuration, log):
-    phlist = seeds_to_string_formatter_files(configuration['simulator']['samples'], configuration['simulator']['output'], configuration['simulator']['name'], configuration['simulator']['seed'], 'fits')
-    skymap = phlist.replace('.fits', f"_map.{configuration['mapper']['save']}").replace(configuration['simulator']['output'], configuration['mapper']['output'])
+def execute_mapper_no_visibility(configuration, log, phlist=None):
+    if phlist is None:
+        phlist = seeds_to_string_formatter_files(configuration['simulator']['samples'], configuration['simulator']['output'], configuration['simulator']['name'], configuration['simulator']['seed'], 'fits')
+    skymap = seeds_to_string_formatter_files(configuration['simulator']['samples'], configuration['mapper']['output'], configuration['simulator']['name'], configuration['simulator']['seed'], get_map_extension(configuration['mapper']['save']), suffix='map')
     maproi = get_instrument_fov(configuration['simulator']['array'])
+    from astrort.utils.mapping import Mapper
     mapper = Mapper(log)
-    if configuration['mapper']['save'] == 'fits':
-        mapper.get_countmap_in_fits(dl3_file=phlist, fitsname=skymap, template=map_template(), maproi=maproi, pixelsize=configuration['mapper']['pixelsize'], trange=[0, configuration['mapper']['exposure']], sigma=configuration['mapper']['smooth'])
+    if configuration['mapper'].get('energy') is not None:
+        execute_mapper_cube(mapper, configuration, phlist, skymap, maproi)
+    elif configuration['mapper']['save'] == 'fits':
+        mapper.get_countmap_in_fits(dl3_file=phlist, fitsname=skymap, template=map_template(), maproi=maproi, pixelsize=configuration['mapper']['pixelsize'], trange=[0, configuration['mapper']['exposure']], sigma=configuration['mapper']['smooth'], region=configuration['mapper'].get('selection', 'box'))
     elif configuration['mapper']['save'] == 'npy':
-        mapper.get_countmap_in_npy(dl3_file=phlist, npyname=skymap, maproi=maproi, pixelsize=configuration['mapper']['pixelsize'], trange=[0, configuration['mapper']['exposure']], sigma=configuration['mapper']['smooth'])
+        mapper.get_countmap_in_npy(dl3_file=phlist, npyname=skymap, maproi=maproi, pixelsize=configuration['mapper']['pixelsize'], trange=[0, configuration['mapper']['exposure']], sigma=configuration['mapper']['smooth'], region=configuration['mapper'].get('selection', 'box'))
+    elif configuration['mapper']['save'] == 'sparse':
+        mapper.get_countmap_in_sparse(dl3_file=phlist, npzname=skymap, maproi=maproi, pixelsize=configuration['mapper']['pixelsize'], trange=[0, configuration['mapper']['exposure']], sigma=configuration['mapper']['smooth'], region=configuration['mapper'].get('selection', 'box'))
+    elif configuration['mapper']['save'] == 'dataset':
+        skymap = get_dataset_folder(configuration)
+        mapper.get_countmap_in_dataset(dl3_file=phlist, writer=open_dataset(skymap, **get_dataset_options(configuration)), seed=configuration['simulator']['seed'], exposure=configuration['mapper']['exposure'], maproi=maproi, pixelsize=configuration['mapper']['pixelsize'], trange=[0, configuration['mapper']['exposure']], sigma=configuration['mapper']['smooth'], region=configuration['mapper'].get('selection', 'box'))
+    else:
+        raise ValueError(f"Invalid 'mapper:save' {configuration['mapper']['save']}")
     del mapper
     return skymap
 
+def execute_mapper_cube(mapper, configuration, phlist, skymap, maproi):
+    if configuration['mapper']['save'] == 'fits':
+        mapper.get_countcube_in_fits(dl3_file=phlist, fitsname=skymap, template=map_template(), ebins=configuration['mapper']['energy'], maproi=maproi, pixelsize=configuration['mapper']['pixelsize'], trange=[0, configuration['mapper']['exposure']], sigma=configuration['mapper']['smooth'], region=configuration['mapper'].get('selection', 'box'))
+    elif configuration['mapper']['save'] == 'npy':
+        mapper.get_countcube_in_npy(dl3_file=phlist, npyname=skymap, ebins=configuration['mapper']['energy'], maproi=maproi, pixelsize=configuration['mapper']['pixelsize'], trange=[0, configuration['mapper']['exposure']], sigma=configuration['mapper']['smooth'], region=configuration['mapper'].get('selection', 'box'))
+    elif configuration['mapper']['save'] == 'dataset':
+        skymap = get_dataset_folder(configuration)
+        mapper.get_countcube_in_dataset(dl3_file=phlist, writer=open_dataset(skymap, **get_dataset_options(configuration)), seed=configuration['simulator']['seed'], exposure=configuration['mapper']['exposure'], ebins=configuration['mapper']['energy'], maproi=maproi, pixelsize=configuration['mapper']['pixelsize'], trange=[0, configuration['mapper']['exposure']], sigma=configuration['mapper']['smooth'], region=configuration['mapper'].get('selection', 'box'))
+    elif configuration['mapper']['save'] == 'sparse':
+        mapper.get_countcube_in_sparse(dl3_file=phlist, npzname=skymap, ebins=configuration['mapper']['energy'], maproi=maproi, pixelsize=configuration['mapper']['pixelsize'], trange=[0, configuration['mapper']['exposure']], sigma=configuration['mapper']['smooth'], region=configuration['mapper'].get('selection', 'box'))
+    else:
+        raise ValueError(f"Invalid 'mapper:save' {configuration['mapper']['save']}")
+    return skymap
+
+def execute_mapper_exposures(configuration, log, phlist=None):
+    if phlist is None:
+        phlist = seeds_to_string_formatter_files(configuration['simulator']['samples'], configuration['simulator']['output'], configuration['simulator']['name'], configuration['simulator']['seed'], 'fits')
+    maproi = get_instrument_fov(configuration['simulator']['array'])
+    from astrort.utils.mapping import Mapper
+    mapper = Mapper(log)
+    # sparse maps keep the counts, smoothed when read
+    sigma = configuration['mapper']['smooth'] if configuration['mapper']['save'] != 'sparse' else 0
+    dl4_data, hdr_fits = mapper.get_countmaps_by_exposure(dl3_file=phlist, exposures=configuration['mapper']['exposure'], maproi=maproi, pixelsize=configuration['mapper']['pixelsize'], sigma=sigma, region=configuration['mapper'].get('selection', 'box'))
+    skymaps = {}
+    for exposure in dl4_data.keys():
+        skymap = seeds_to_string_formatter_files(configuration['simulator']['samples'], configuration['mapper']['output'], configuration['simulator']['name'], configuration['simulator']['seed'], get_map_extension(configuration['mapper']['save']), suffix=f'map_{exposure}s')
+        if configuration['mapper']['save'] == 'fits':
+            mapper.write_countmap_in_fits(dl4_data=dl4_data[exposure], hdr_fits=hdr_fits, template=map_template(), fitsname=skymap)
+        elif configuration['mapper']['save'] == 'npy':
+            mapper.write_countmap_in_npy(dl4_data=dl4_data[exposure], npyname=skymap)
+        elif configuration['mapper']['save'] == 'sparse':
+            mapper.write_countmap_in_sparse(counts=dl4_data[exposure], hdr_fits=hdr_fits, sigma=configuration['mapper']['smooth'], npzname=skymap)
+        elif configuration['mapper']['save'] == 'dataset':
+            skymap = get_dataset_folder(configuration)
+            mapper.write_countmap_in_dataset(dl4_data=dl4_data[exposure], writer=open_dataset(skymap, **get_dataset_options(configuration)), seed=configuration['simulator']['seed'], exposure=exposure)
+        else:
+            raise ValueError(f"Invalid 'mapper:save' {configuration['mapper']['save']}")
+        skymaps[exposure] = skymap
+    del mapper
+    return skymaps
+
+def execute_mapper_batch(configuration, seeds, stackfile, log, renew=None):
+    phlists = [seeds_to_string_formatter_files(configuration['simulator']['samples'], configuration['simulator']['output'], configuration['simulator']['name'], seed, 'fits') for seed in seeds]
+    maproi = get_instrument_fov(configuration['simulator']['array'])
+    from astrort.utils.mapping import Mapper
+    mapper = Mapper(log)
+    mapper.get_countmaps_in_stack(dl3_files=phlists, seeds=seeds, npyname=stackfile, maproi=maproi, pixelsize=configuration['mapper']['pixelsize'], trange=[0, configuration['mapper']['exposure']], sigma=configuration['mapper']['smooth'], region=configuration['mapper'].get('selection', 'box'), renew=renew)
+    del mapper
+    return stackfile
+
 def configure_simulator_no_visibility(simulator, configuration, log):
     if '$TEMPLATES$' in configuration['model']:
         configuration['model'] = join(dirname(abspath(__file__)).replace('utils', 'templates'), basename(configuration['model']))
@@ -64,7 +127,10 @@ def set_pointing(simulator, configuration, log):
 def randomise_pointing_sim(simulator):
     if '$TEMPLATES$' in simulator['model']:
         simulator['model'] = join(dirname(abspath(__file__)).replace('utils', 'templates'), basename(simulator['model']))
+    import astropy.units as u
+    from astropy.coordinates import SkyCoord
     if 'background.xml' not in simulator['model']:
+        from rtasci.lib.RTAManageXml import ManageXml
         model_xml = ManageXml(xml=simulator['model'])
         source = model_xml.getRaDec()
         del model_xml
@@ -82,6 +148,9 @@ def get_point_source_info(simulator):
     if '$TEMPLATES$' in simulator['model']:
         simulator['model'] = join(dirname(abspath(__file__)).replace('utils', 'templates'), basename(simulator['model']))
     if 'background.xml' not in simulator['model']: 
+        import astropy.units as u
+        from astropy.coordinates import SkyCoord
+        from rtasci.lib.RTAManageXml import ManageXml
         model_xml = ManageXml(xml=simulator['model'])
         source = model_xml.getRaDec()
         del model_xml
@@ -93,6 +162,64 @@ def get_point_source_info(simulator):
     else:
         return {'point_ra': simulator['pointing']['ra'], 'point_dec': simulator['pointing']['dec'], 'offset': np.nan, 'source_ra': np.nan, 'source_dec': np.nan}
 
+def make_simulation_plan(configuration, seeds, rng=None):
+    # pointing, source, offset and IRF of all seeds at once, reproducible for the same seeds
+    import astropy.units as u
+    from astropy.coordinates import SkyCoord
+    seeds = np.sort(np.asarray(seeds, dtype=int))
+    size = len(seeds)
+    rng = rng if rng is not None else np.random.default_rng([int(seeds[0]), size])
+    model = configuration['model']
+    if '$TEMPLATES$' in model:
+        model = join(dirname(abspath(__file__)).replace('utils', 'templates'), basename(model))
+    background = 'background.xml' in model
+    if background:
+        ra, dec = np.full(size, np.nan), np.full(size, np.nan)
+    elif configuration['target'] == 'random':
+        # skip DEC galactic center as in randomise_target
+        ra = rng.uniform(0, 360, size)
+        dec = np.where(rng.random(size) < 0.5, rng.uniform(-90, 60, size), rng.uniform(0, 90, size))
+    else:
+        ra, dec = np.full(size, np.nan), np.full(size, np.nan)
+        ra[:], dec[:] = get_model_template(model, configuration['name']).get_ra_dec()
+    if configuration['pointing'] == 'random':
+        if background:
+            ra, dec = rng.uniform(0, 360, size), rng.uniform(-90, 90, size)
+        offset = rng.random(size) * configuration['maxoffset']
+        pointing = SkyCoord(ra * u.deg, dec * u.deg, frame='icrs').directional_offset_by(rng.uniform(0, 360, size) * u.deg, offset * u.deg)
+        point_ra, point_dec = pointing.ra.deg, pointing.dec.deg
+    else:
+        point_ra, point_dec = np.full(size, float(configuration['pointing']['ra'])), np.full(size, float(configuration['pointing']['dec']))
+        if background:
+            offset = np.full(size, np.nan)
+        else:
+            offset = SkyCoord(ra * u.deg, dec * u.deg, frame='icrs').separation(SkyCoord(point_ra * u.deg, point_dec * u.deg, frame='icrs')).deg
+    names = np.array([seeds_to_string_formatter(configuration['samples'], configuration['name'], seed) for seed in seeds])
+    irfs = plan_seed_irfs(configuration, seeds, rng=rng).astype(str)
+    return ReplicaPlan({'name': names, 'seed': seeds, 'source_ra': ra, 'source_dec': dec, 'point_ra': point_ra, 'point_dec': point_dec, 'offset': offset, 'irf': irfs})
+
+def get_plan_pointing(row):
+    return {key: row[key] for key in ('point_ra', 'point_dec', 'offset', 'source_ra', 'source_dec')}
+
+def get_plan_metadata(configuration):
+    # the keys the plan is drawn from, as stored in json
+    return json.loads(json.dumps({key: configuration.get(key) for key in ('name', 'samples', 'pointing', 'maxoffset', 'target', 'model', 'prod', 'array', 'irf')}))
+
+def get_simulation_plan(configuration, seeds, log, subset=True):
+    # the plan is stored once in the output folder and shared by jobs and workers
+    folder = join(configuration['simulator']['output'], 'simulation_plan')
+    metadata = get_plan_metadata(configuration['simulator'])
+    if not is_replica_store(folder):
+        clock = time()
+        make_simulation_plan(configuration['simulator'], seeds).save(folder, metadata=metadata)
+        log.info(f"Simulation plan of {len(seeds)} seeds, took {time() - clock} s")
+    elif read_replica_metadata(folder) != metadata:
+        raise ValueError(f"Simulation plan {folder} was made with a different configuration, remove it to plan again")
+    plan = load_replica_plan(folder, seeds if subset else None)
+    if not np.isin(seeds, plan.seeds).all():
+        raise ValueError(f"Simulation plan {folder} does not cover the seeds [{min(seeds)}, {max(seeds)}], remove it to plan again")
+    return plan
+
 def write_simulation_info(simulator, configuration, pointing, datfile, clock):
     name = seeds_to_string_formatter(configuration['samples'], configuration['name'], configuration['seed'])
     seed = simulator.seed
@@ -101,75 +228,144 @@ def write_simulation_info(simulator, configuration, pointing, datfile, clock):
     duration = configuration['duration']
     irf = simulator.irf
     point_ra, point_dec, offset, source_ra, source_dec = pointing['point_ra'], pointing['point_dec'], pointing['offset'], pointing['source_ra'], pointing['source_dec']
-    if not isfile(datfile):
-        with open(datfile, 'w+') as f:
-            f.write('name seed start stop duration source_ra source_dec point_ra point_dec offset irf fov sim_time\n')
-    with open(datfile, 'a') as f:
-        f.write(f'{name} {seed} {tstart} {tstop} {duration} {source_ra} {source_dec} {point_ra} {point_dec} {offset} {irf} {fov} {clock}\n')
+    write_record(datfile, SIMULATION_COLUMNS, [name, seed, tstart, tstop, duration, source_ra, source_dec, point_ra, point_dec, offset, irf, fov, clock])
 
-def merge_simulation_info(configuration, log):
+def merge_simulation_info(configuration, log, threads=4, binary=False):
     folder = configuration['output']
     datfiles = [join(folder, f) for f in listdir(folder) if '.dat' in f and 'job' in f and 'simulator' in f]
     merger = join(folder, 'merged_sim_data.dat')
-    # check merger file
-    if isfile(merger):
-        log.warning(f"Merger output already exists, overwrite {merger}")
-        f = open(merger, 'w+')
-        f.close()
-    # collect data
-    for i, datfile in enumerate(datfiles):
-        log.info(f"Collect data from {datfile}")
-        data = pd.read_csv(join(datfile), sep=' ')
-        if i == 0:
-            table = data
-        else:
-            table = pd.concat([table, data], ignore_index=True)
-        log.info(f"Lines in data: {len(table)}")
-    # write merger file
-    table.to_csv(merger, index=False, header=True, sep=' ', na_rep=np.nan)
+    return merge_record_tables(datfiles, merger, log, threads=threads, binary=binary)
+
+def get_expected_outputs(configuration, seeds, mode):
+    samples, name = configuration['simulator']['samples'], configuration['simulator']['name']
+    if mode == 'simulator' and not configuration['simulator'].get('fused', False):
+        return {seed: [seeds_to_string_formatter_files(samples, configuration['simulator']['output'], name, seed, 'fits')] for seed in seeds}
+    if type(configuration['mapper']['exposure']) == list:
+        suffixes = [f'map_{exposure}s' for exposure in sorted(configuration['mapper']['exposure'])]
+    else:
+        suffixes = ['map']
+    return {seed: [seeds_to_string_formatter_files(samples, configuration['mapper']['output'], name, seed, get_map_extension(configuration['mapper']['save']), suffix=suffix) for suffix in suffixes] for seed in seeds}
+
+def get_written_seeds(datfile):
+    if not isfile(datfile):
+        return np.empty(0, dtype=int)
+    import pandas as pd
+    return np.unique(pd.read_csv(datfile, sep=' ', usecols=['seed'])['seed'].to_numpy())
 
-def write_mapping_info(configuration, mapper, datfile, clock):
+def get_completed_seeds(datfile, outputs):
+    if not isfile(datfile):
+        return np.empty(0, dtype=int)
+    written = set(get_written_seeds(datfile).tolist())
+    # one listing per folder instead of a stat per file
+    listing = {}
+    for files in outputs.values():
+        for f in files:
+            if dirname(f) not in listing:
+                listing[dirname(f)] = set(listdir(dirname(f))) if isdir(dirname(f)) else set()
+    completed = [seed for seed, files in outputs.items() if seed in written and all(basename(f) in listing[dirname(f)] for f in files)]
+    return np.array(sorted(completed), dtype=int)
+
+def resume_seeds(configuration, seeds, datfile, mode, log):
+    # rows left by workers of the interrupted run
+    shards = get_worker_datfiles(datfile)
+    if len(shards) > 0:
+        merge_worker_datfiles(datfile, shards, log)
+    if configuration['mapper']['save'] == 'dataset' and (mode == 'mapper' or configuration['simulator'].get('fused', False)):
+        # maps are complete once their shard is
+        folder = get_dataset_folder(configuration)
+        completed = np.intersect1d(get_written_seeds(datfile), MapDataset(folder).seeds if isdir(folder) else [])
+    else:
+        completed = get_completed_seeds(datfile, get_expected_outputs(configuration, [int(seed) for seed in seeds], mode))
+    seeds = np.asarray(seeds)[~np.isin(seeds, completed)]
+    log.info(f"Resume {mode}: {len(completed)} seeds already complete, {len(seeds)} left")
+    # seeds with a row but missing outputs are written again
+    stale = drop_records(datfile, seeds)
+    if mode == 'simulator' and configuration['simulator'].get('fused', False):
+        stale += drop_records(get_fused_datfile(configuration, datfile), seeds)
+    if stale > 0:
+        log.info(f"Resume {mode}: dropped {stale} rows of incomplete seeds from {datfile}")
+    return seeds
+
+def merge_worker_datfiles(datfile, shards, log):
+    shards = [shard for shard in shards if isfile(shard)]
+    if len(shards) == 0:
+        log.warning(f"No worker data found to merge in {datfile}")
+        return datfile
+    import pandas as pd
+    table = pd.concat([pd.read_csv(shard, sep=' ') for shard in shards], ignore_index=True)
+    table = table.sort_values(by='seed', kind='stable')
+    table.to_csv(datfile, mode='a', index=False, header=not isfile(datfile), sep=' ', na_rep=np.nan)
+    log.info(f"Merged {len(shards)} worker files in {datfile}, lines added: {len(table)}")
+    merge_record_folders([get_record_folder(shard) for shard in shards], get_record_folder(datfile))
+    for shard in shards:
+        remove(shard)
+    return datfile
+
+def write_mapping_info(configuration, datfile, clock, mapper=None, exposure=None):
     name = seeds_to_string_formatter(configuration['simulator']['samples'], configuration['simulator']['name'], configuration['simulator']['seed'])
     seed = configuration['simulator']['seed']
-    exposure = mapper.t[1] - mapper.t[0]
+    if mapper is not None:
+        exposure = mapper.t[1] - mapper.t[0]
+    elif exposure is None:
+        exposure = configuration['mapper']['exposure']
     center_type = configuration['mapper']['center']  
     pixelsize = configuration['mapper']['pixelsize']
     smooth = configuration['mapper']['smooth']
-    if not isfile(datfile):
-        with open(datfile, 'w+') as f:
-            f.write('name seed exposure center_on pixelsize smooth map_time\n')
-    with open(datfile, 'a') as f:
-        f.write(f'{name} {seed} {exposure} {center_type} {pixelsize} {smooth} {clock}\n')
+    write_record(datfile, MAPPING_COLUMNS, [name, seed, exposure, center_type, pixelsize, smooth, clock])
 
-def merge_data_info(configuration, mode, log):
+def merge_data_info(configuration, mode, log, threads=4, binary=False):
     folder = configuration['output']
-    datfiles = [join(folder, f) for f in listdir(folder) if '.dat' in f and 'job' in f and mode in f]
+    datfiles = [join(folder, f) for f in listdir(folder) if f.startswith('job') and f.endswith(f'_{mode}.dat')]
     merger = join(folder, f'merged_{mode}_data.dat')
     log.info(f"Merger file: {merger}")
-    # check merger file
-    if isfile(merger):
-        log.warning(f"Merger output already exists, overwrite {merger}")
-        f = open(merger, 'w+')
-        f.close()
-    # collect data
-    for i, datfile in enumerate(datfiles):
-        log.info(f"Collect data from {datfile}")
-        data = pd.read_csv(join(datfile), sep=' ')
-        if i == 0:
-            table = data
-        else:
-            table = pd.concat([table, data], ignore_index=True)
-        log.info(f"Lines in data: {len(table)}")
-    # write merger file
-    table.to_csv(merger, index=False, header=True, sep=' ', na_rep=np.nan)
+    return merge_record_tables(datfiles, merger, log, threads=threads, binary=binary)
+
+PLOTTERS = {}
+
+def get_batch_plotter():
+    # one figure per process, reused by every map of the same geometry
+    key = getpid()
+    if key not in PLOTTERS:
+        from astrort.utils.plotting import SkymapBatchPlotter
+        PLOTTERS.clear()
+        PLOTTERS[key] = SkymapBatchPlotter()
+    return PLOTTERS[key]
 
-def plot_map(fitsmap, log):
+def get_plot_mode(configuration):
+    # thumbnails only need the counts, figures need the WCS of a fits map
+    plot, save = configuration['mapper']['plot'], configuration['mapper']['save']
+    if configuration['mapper'].get('energy') is not None:
+        return None
+    elif plot == 'thumbnail' and save in ['fits', 'npy', 'sparse']:
+        return 'thumbnail'
+    elif plot is True and save == 'fits':
+        return 'figure'
+    return None
+
+def get_thumbnail_options(configuration):
+    return {'scale': configuration['mapper'].get('thumbscale', 1), 'norm': configuration['mapper'].get('thumbnorm', 'symlog')}
+
+def plot_map(fitsmap, log, configuration=None):
+    if configuration is not None and configuration['mapper']['plot'] == 'thumbnail':
+        return render_thumbnails([fitsmap], **get_thumbnail_options(configuration))[0]
     plotmap = fitsmap.replace('.fits', '.png')
-    plot = Plotter(log)
-    plot.plot_fits_skymap(fitsmap, plotmap)
-    del plot
+    get_batch_plotter().plot(fitsmap, plotmap)
     return plotmap
 
+def plot_maps(configuration, fitsmaps, log, prefix=None):
+    if get_plot_mode(configuration) == 'thumbnail':
+        plotmaps = render_thumbnails(fitsmaps, **get_thumbnail_options(configuration))
+        log.debug(f"Rendered {len(plotmaps)} thumbnails")
+        return plotmaps
+    from astrort.utils.plotting import plot_skymaps, plot_contact_sheets
+    plotmaps = plot_skymaps(fitsmaps, processes=configuration['mapper'].get('plotpool', 1))
+    log.debug(f"Plotted {len(plotmaps)} maps")
+    if configuration['mapper'].get('sheet', 0) > 0 and len(fitsmaps):
+        prefix = prefix if prefix is not None else fitsmaps[0].replace('.fits', '')
+        sheets = plot_contact_sheets(fitsmaps, prefix, size=configuration['mapper']['sheet'])
+        log.info(f"Contact sheets: {sheets}")
+    return plotmaps
+
 def set_irf(configuration, log):
     if configuration['irf'] == 'random':
         irf = select_random_irf(configuration['array'], configuration['prod'])
@@ -180,23 +376,31 @@ def set_irf(configuration, log):
         irf = configuration['irf']
     return irf
 
-def randomise_target(model, output, samples, name, seed):
+def plan_seed_irfs(configuration, seeds, rng=None):
+    # IRF of each seed, drawn for the whole range when random
+    if configuration['irf'] == 'random':
+        return get_irf_catalog(configuration['prod']).sample(configuration['array'], len(seeds), rng=rng)
+    elif len(configuration['irf']) < 10:
+        return get_irf_catalog(configuration['prod']).sample(configuration['array'], len(seeds), filter=configuration['irf'], rng=rng)
+    else:
+        return np.full(len(seeds), configuration['irf'])
+
+def randomise_target(model, output, samples, name, seed, keepxml=True):
     if '$TEMPLATES$' in model:
         model = join(dirname(abspath(__file__)).replace('utils', 'templates'), basename(model))
-    new_model = join(output, seeds_to_string_formatter(samples, name, seed) + '.xml')
-    copyfile(model, new_model)
-    model_xml = ManageXml(xml=new_model)
+    if keepxml:
+        new_model = join(output, seeds_to_string_formatter(samples, name, seed) + '.xml')
+    else:
+        new_model = get_model_tmpfile(name)
     # skip DEC galactic center +/- 30 deg (DEC allowed [-90, -60] U [0, +90] in GAL [-90, -30] U [30, 90])
-    model_xml.setModelParameters(parameters=('RA', 'DEC'), values=(np.random.uniform(0, 360), np.random.choice([np.random.uniform(-90, 60), np.random.uniform(0, 90)])), source=name)
-    del model_xml
-    return new_model
+    ra, dec = np.random.uniform(0, 360), np.random.choice([np.random.uniform(-90, 60), np.random.uniform(0, 90)])
+    return get_model_template(model, name).write(ra, dec, new_model)
 
-def replicate_target(model, output, samples, name, seed, ra, dec):
+def replicate_target(model, output, samples, name, seed, ra, dec, keepxml=True):
     if '$TEMPLATES$' in model:
         model = join(dirname(abspath(__file__)).replace('utils', 'templates'), basename(model))
-    new_model = join(output, seeds_to_string_formatter(samples, name, seed) + '.xml')
-    copyfile(model, new_model)
-    model_xml = ManageXml(xml=new_model)
-    model_xml.setModelParameters(parameters=('RA', 'DEC'), values=(ra, dec), source=name)
-    del model_xml
-    return new_model
\ No newline at end of file
+    if keepxml:
+        new_model = join(output, seeds_to_string_formatter(samples, name, seed) + '.xml')
+    else:
+        new_model = get_model_tmpfile(name)
+    return get_model_template(model, name).write(ra, dec, new_model)
\ No newline at end of file